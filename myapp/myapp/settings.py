@@ -137,6 +137,43 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 # archivos subidos por usuarios (media)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# una portada reutilizada hace menos de esto no se borra aunque nadie la referencie todavía
+# (la subida que la reutiliza puede no haber confirmado); ver tasks/storage.py
+COVER_RELEASE_GRACE_SECONDS = int(os.getenv('COVER_RELEASE_GRACE_SECONDS', '3600'))
+
+# fichas PDF generadas (una por libro y versión; ver tasks/cards.py). Fuera de MEDIA_ROOT: no se publican
+CARD_CACHE_DIR = os.getenv('CARD_CACHE_DIR', str(BASE_DIR / 'cache' / 'cards'))
+
+# Eventos de analítica (tasks/analytics.py): se guardan por lotes desde un hilo en segundo plano.
+# ANALYTICS_SYNC=1 los inserta en la misma petición (los tests lo activan con override_settings).
+ANALYTICS_SYNC = os.getenv('ANALYTICS_SYNC', '0') == '1'
+ANALYTICS_BATCH_SIZE = int(os.getenv('ANALYTICS_BATCH_SIZE', '200'))
+ANALYTICS_FLUSH_MS = int(os.getenv('ANALYTICS_FLUSH_MS', '1000'))
+ANALYTICS_QUEUE_SIZE = int(os.getenv('ANALYTICS_QUEUE_SIZE', '10000'))
+# archive_analytics: meses de eventos crudos que se conservan (el panel usa los totales diarios)
+ANALYTICS_RETENTION_MONTHS = int(os.getenv('ANALYTICS_RETENTION_MONTHS', '6'))
+ANALYTICS_ARCHIVE_DIR = os.getenv('ANALYTICS_ARCHIVE_DIR', str(BASE_DIR / 'archive' / 'analytics'))
+
+# Ranking de libros (tasks/ranking.py): vida media de los puntajes y fecha de referencia
+RANKING_POPULAR_HALF_LIFE_DAYS = float(os.getenv('RANKING_POPULAR_HALF_LIFE_DAYS', '30'))
+RANKING_TRENDING_HALF_LIFE_DAYS = float(os.getenv('RANKING_TRENDING_HALF_LIFE_DAYS', '3'))
+RANKING_EPOCH = os.getenv('RANKING_EPOCH', '2026-01-01')
+
+# Búsqueda aproximada del catálogo: umbral de similitud de trigramas (0-1)
+CATALOG_FUZZY_THRESHOLD = float(os.getenv('CATALOG_FUZZY_THRESHOLD', '0.3'))
+
+# Caché: LocMem por defecto (por proceso). Con CACHE_URL=redis://... la caché es compartida
+# y la invalidación de los índices en memoria (tasks/indexes.py) alcanza a todos los workers.
+CACHE_URL = os.getenv('CACHE_URL', '')
+if CACHE_URL.startswith(('redis://', 'rediss://')):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': CACHE_URL}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'academia'}}
+
+# segundos que el navegador puede reutilizar una respuesta del autocompletado antes de revalidar (ETag)
+AUTOCOMPLETE_MAX_AGE = int(os.getenv('AUTOCOMPLETE_MAX_AGE', '300'))
+# las sugerencias del catálogo incluyen disponibilidad: reutilizarlas menos tiempo
+CATALOG_SUGGEST_MAX_AGE = int(os.getenv('CATALOG_SUGGEST_MAX_AGE', '30'))
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
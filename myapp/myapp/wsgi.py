@@ -7,6 +7,7 @@ For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/wsgi/
 """
 
+import logging
 import os
 
 from django.core.wsgi import get_wsgi_application
@@ -14,3 +15,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myapp.settings')
 
 application = get_wsgi_application()
+
+# precargar los índices en memoria del worker (autocompletado de códigos); si falla, se
+# construyen en la primera petición que los use
+try:
+    from tasks.indexes import warm_indexes
+    warm_indexes()
+except Exception:
+    logging.getLogger('tasks.indexes').exception('No se pudieron precargar los índices en memoria')
@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User, Libros, DictionaryEntry
+from .models import User, Libros, DictionaryEntry, Ejemplar
 
 # Register your models here.
 
@@ -14,3 +14,9 @@ class DictionaryEntryAdmin(admin.ModelAdmin):
     list_display = ('codigo', 'clasificacion', 'descripcion')
     search_fields = ('codigo', 'descripcion', 'descripcion_en', 'clasificacion')
 
+@admin.register(Ejemplar)
+class EjemplarAdmin(admin.ModelAdmin):
+    list_display = ('codigo_barras', 'book', 'estado', 'condicion', 'prestamo')
+    list_filter = ('estado', 'condicion')
+    search_fields = ('codigo_barras', 'book__cota', 'book__titulo')
+    raw_id_fields = ('book', 'prestamo')
@@ -0,0 +1,184 @@
+"""Registro de eventos de analítica fuera del ciclo de la petición.
+
+Las vistas más consultadas (detalle del libro, ficha PDF) no deben esperar un
+INSERT por visita: ``record`` deja el evento en una cola en memoria y un hilo
+del proceso los guarda con ``bulk_create`` cada ``ANALYTICS_BATCH_SIZE``
+eventos o cada ``ANALYTICS_FLUSH_MS`` milisegundos, lo que ocurra primero.
+
+- La cola está acotada (``ANALYTICS_QUEUE_SIZE``): si la base no da abasto
+  los eventos nuevos se descartan y se cuentan en ``dropped``; la analítica
+  nunca frena ni rompe una petición.
+- Al terminar el proceso (``atexit``; gunicorn sale con ``sys.exit``) se
+  guardan los eventos pendientes.
+- Cada lote actualiza también los totales diarios del panel (``rollups.py``)
+  y los puntajes de popularidad (``ranking.py``).
+- Con ``ANALYTICS_SYNC`` (variable de entorno ``ANALYTICS_SYNC=1``; los tests
+  lo activan con ``override_settings``) cada evento se inserta en el momento,
+  dentro de la transacción de la petición.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, InterfaceError, OperationalError, connection, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class EventBuffer:
+    def __init__(self, batch_size=None, flush_interval=None, max_queue=None):
+        self.batch_size = batch_size or getattr(settings, 'ANALYTICS_BATCH_SIZE', 200)
+        self.flush_interval = flush_interval if flush_interval is not None else getattr(settings, 'ANALYTICS_FLUSH_MS', 1000) / 1000
+        self.queue = queue.Queue(maxsize=max_queue or getattr(settings, 'ANALYTICS_QUEUE_SIZE', 10000))
+        self.dropped = 0
+        self.written = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    @property
+    def pending(self):
+        return self.queue.qsize()
+
+    def put(self, events):
+        """Encola eventos sin guardar; los que no caben se descartan."""
+        self._ensure_worker()
+        for event in events:
+            try:
+                self.queue.put_nowait(event)
+            except queue.Full:
+                with self._lock:
+                    self.dropped += 1
+
+    def _ensure_worker(self):
+        # tras un fork (gunicorn --preload) el hilo del padre no existe en el hijo
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='analytics-writer', daemon=True)
+            self._thread.start()
+
+    def _take(self, block, timeout=None):
+        batch = []
+        deadline = time.monotonic() + (timeout or 0)
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if block and remaining > 0:
+                    batch.append(self.queue.get(timeout=remaining))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                batch = self._take(block=True, timeout=self.flush_interval)
+                if batch:
+                    self._write(batch)
+        finally:
+            # la conexión de este hilo no la cierra el ciclo de peticiones de Django
+            connection.close()
+
+    def _store(self, batch):
+        # el hilo no pasa por el ciclo de peticiones: descartar aquí la conexión vencida
+        # (CONN_MAX_AGE) o rota, y reintentar una vez si el servidor la cerró (reinicio, timeout).
+        # Dentro de una transacción ajena (flush() desde una petición o un test) no se toca.
+        in_transaction = connection.in_atomic_block
+        if not in_transaction:
+            connection.close_if_unusable_or_obsolete()
+        try:
+            store(batch)
+        except (OperationalError, InterfaceError):
+            if in_transaction:
+                raise
+            connection.close()
+            store(batch)
+
+    def _write(self, batch):
+        from .models import Libros
+
+        try:
+            self._store(batch)
+        except IntegrityError:
+            # un libro borrado mientras el evento esperaba: guardar el evento sin libro
+            existing = set(Libros.objects.filter(pk__in={e.book_id for e in batch if e.book_id}).values_list('pk', flat=True))
+            for event in batch:
+                if event.book_id not in existing:
+                    event.book_id = None
+            try:
+                self._store(batch)
+            except Exception:
+                logger.exception('No se pudieron guardar %d eventos de analítica', len(batch))
+                with self._lock:
+                    self.dropped += len(batch)
+                return
+        except Exception:
+            logger.exception('No se pudieron guardar %d eventos de analítica', len(batch))
+            with self._lock:
+                self.dropped += len(batch)
+            return
+        with self._lock:
+            self.written += len(batch)
+
+    def flush(self):
+        """Guarda ya todo lo pendiente en el hilo que llama."""
+        while True:
+            batch = self._take(block=False)
+            if not batch:
+                return
+            self._write(batch)
+
+    def shutdown(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout)
+        self.flush()
+
+
+buffer = EventBuffer()
+atexit.register(buffer.shutdown)
+
+
+def make_event(event_type, book=None, user=None):
+    from .models import AnalyticsEvent
+
+    book_id = getattr(book, 'pk', book)
+    user_id = user.pk if user is not None and getattr(user, 'is_authenticated', False) else None
+    return AnalyticsEvent(event_type=event_type, book_id=book_id, user_id=user_id, timestamp=timezone.now())
+
+
+def store(events):
+    """Inserta los eventos y suma sus totales y puntajes en la misma transacción."""
+    from . import ranking, rollups
+    from .models import AnalyticsEvent
+
+    with transaction.atomic():
+        AnalyticsEvent.objects.bulk_create(events)
+        rollups.add_events(events)
+        ranking.add_events(events)
+
+
+def record_many(events):
+    if getattr(settings, 'ANALYTICS_SYNC', False):
+        store(events)
+        return
+    # encolar al confirmar: el hilo no debe ver un libro que la transacción aún no guardó
+    transaction.on_commit(lambda: buffer.put(events))
+
+
+def record(event_type, book=None, user=None):
+    """Registra un evento (``book``/``user`` pueden ser instancias o ``None``)."""
+    record_many([make_event(event_type, book, user)])
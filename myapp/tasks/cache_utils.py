@@ -0,0 +1,43 @@
+"""Versiones compartidas en la caché de Django para invalidar datos derivados.
+
+Cada nombre (p. ej. ``'dictionary-codes'``) tiene un token en la caché que se
+renueva con ``bump_version`` cuando cambian los datos de origen. Los índices
+en memoria de cada worker guardan el token con que se construyeron y se
+reconstruyen cuando no coincide. Con una caché compartida (Redis) la
+invalidación llega a todos los workers; con LocMem, sólo al proceso actual.
+"""
+import uuid
+
+from django.core.cache import cache
+
+VERSION_KEY = 'academia:version:{}'
+
+
+def get_version(name):
+    """Token de versión actual de ``name`` (se crea si la caché no lo tiene)."""
+    key = VERSION_KEY.format(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(name):
+    """Invalida todo lo derivado de ``name``."""
+    version = uuid.uuid4().hex
+    cache.set(VERSION_KEY.format(name), version, timeout=None)
+    return version
+
+
+def get_or_build(name, key, builder, timeout=86400):
+    """Valor de ``builder()`` guardado en la caché bajo la versión actual de ``name``.
+
+    Al renovarse la versión la clave cambia; las copias viejas expiran solas.
+    """
+    cache_key = f'academia:{key}:{get_version(name)}'
+    value = cache.get(cache_key)
+    if value is None:
+        value = builder()
+        cache.set(cache_key, value, timeout)
+    return value
@@ -0,0 +1,355 @@
+"""Fichas PDF de los libros, cacheadas en disco por versión de contenido.
+
+La ficha de un libro sólo cambia cuando cambia el libro (``Libros.version``
+sube en cada ``save()``) o la etiqueta de su clasificación, así que el PDF se
+genera una vez y se guarda en ``CARD_CACHE_DIR`` con esa clave en el nombre.
+Las siguientes peticiones leen el archivo y la vista responde 304 si el
+navegador ya tiene la misma versión (ETag / Last-Modified).
+
+Las fichas por lote (``batch_card_path``) se dibujan en un único canvas y
+se guardan del mismo modo, con la lista de claves de las fichas como clave.
+Las portadas se reducen una sola vez al tamaño del recuadro y se comparten
+entre páginas y peticiones (``cover_cache``).
+"""
+import glob
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from PIL import Image
+from reportlab.lib.pagesizes import A5, landscape
+from reportlab.lib.units import cm
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+from .covers import cover_path
+
+# subir al cambiar el diseño de la ficha para descartar los PDF ya generados
+CARD_LAYOUT = 2
+
+PAGE_SIZE = landscape(A5)
+
+# recuadro de portada de 5 x 7 cm a ~150 ppp
+COVER_PIXELS = (300, 420)
+
+# fichas por lote conservadas en disco (las más recientes)
+BATCH_FILES_KEPT = 20
+
+
+class CoverCache:
+    """Portadas reducidas a ``COVER_PIXELS`` (JPEG en memoria), LRU por ruta y fecha del archivo."""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _thumbnail(self, path):
+        with Image.open(path) as img:
+            img.draft('RGB', COVER_PIXELS)  # JPEG: decodificar ya reducido
+            img = img.convert('RGB')
+            img.thumbnail(COVER_PIXELS)
+            buffer = io.BytesIO()
+            img.save(buffer, 'JPEG', quality=85)
+            return buffer.getvalue()
+
+    def get(self, path):
+        """``ImageReader`` de la portada reducida, o ``None`` si no se puede leer."""
+        try:
+            key = (path, os.path.getmtime(path))
+        except OSError:
+            return None
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+        if data is None:
+            try:
+                data = self._thumbnail(path)
+            except Exception:
+                return None
+            with self._lock:
+                self._items[key] = data
+                while len(self._items) > self.maxsize:
+                    self._items.popitem(last=False)
+        return ImageReader(io.BytesIO(data))
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+cover_cache = CoverCache()
+
+
+def _classification_label(book):
+    try:
+        return book.classification.label if getattr(book, 'classification', None) and getattr(book.classification, 'label', None) else (str(book.classification) if getattr(book, 'classification', None) else '')
+    except Exception:
+        return str(getattr(book, 'classification', '') or '')
+
+
+def card_key(book):
+    """Clave de contenido de la ficha: libro, versión, diseño y etiqueta de clasificación."""
+    label = hashlib.md5(_classification_label(book).encode('utf-8')).hexdigest()[:8]
+    return f'{book.pk}-{book.version}-{CARD_LAYOUT}-{label}'
+
+
+def card_etag(book):
+    return f'"card-{card_key(book)}"'
+
+
+def draw_card(c, book, page_size=PAGE_SIZE):
+    """Dibuja la ficha de ``book`` en la página actual del canvas ``c``."""
+    w, h = page_size
+    m = 0.7 * cm
+
+    # espacio reservado arriba para el título (fuera del recuadro)
+    title_space = 1.0 * cm
+    # dibujar rectángulo principal desplazado hacia abajo para dejar espacio al título
+    rect_x = m
+    rect_y = m
+    rect_width = w - 2 * m
+    rect_height = h - 2 * m - title_space  # altura reducida para que el título quede fuera
+
+    # borde externo (rectángulo)
+    c.setLineWidth(1)
+    c.rect(rect_x, rect_y, rect_width, rect_height)
+
+    # Título centrado por fuera (arriba del recuadro)
+    title_text = "ACADEMIA NACIONAL DE MEDICINA - BIBLIOTECA"
+    c.setFont("Helvetica-Bold", 11)
+    title_y = rect_y + rect_height + (title_space / 2)  # centrado vertical en el espacio superior
+    c.drawCentredString(w / 2, title_y, title_text)
+
+    # Área portada (derecha) dentro del rectángulo
+    cover_w = 5.0 * cm
+    cover_h = 7.0 * cm
+    cover_x = rect_x + rect_width - cover_w - (0.3 * cm)
+    cover_y = rect_y + rect_height - cover_h - (0.6 * cm)  # dejar pequeño margen superior dentro del rect.
+    c.rect(cover_x, cover_y, cover_w, cover_h)
+    if getattr(book, 'portada', None):
+        try:
+            img = cover_cache.get(cover_path(book, 'card'))
+            if img is not None:
+                c.drawImage(img, cover_x+2, cover_y+2, cover_w-4, cover_h-4, preserveAspectRatio=True, anchor='nw')
+        except Exception:
+            pass
+
+    # Cajas y etiquetas principales (imitando ficha)
+    x0 = rect_x + 6
+    # AUMENTE el margen superior del bloque de datos (mayor separación desde la parte superior del rectángulo)
+    top_block_margin = 1.9 * cm  # aumentado
+    y = rect_y + rect_height - top_block_margin
+    line_h = 12
+
+    c.setFont("Helvetica-Bold", 9)
+    c.drawString(x0, y, "COTA:")
+    c.setFont("Helvetica", 9)
+    c.drawString(x0 + 36, y, book.cota or "")
+    y -= line_h
+
+    c.setFont("Helvetica-Bold", 9)
+    c.drawString(x0, y, "N.º REGISTRO:")
+    c.setFont("Helvetica", 9)
+    numero_reg = getattr(book, 'numero_registro', None) or getattr(book, 'id', '')
+    c.drawString(x0 + 70, y, str(numero_reg))
+    y -= line_h
+
+    c.setFont("Helvetica-Bold", 9)
+    c.drawString(x0, y, "FECHA REGISTRO:")
+    c.setFont("Helvetica", 9)
+    fr = getattr(book, 'fecha_registro', None)
+    try:
+        fr_txt = fr.strftime('%Y-%m-%d') if fr else ''
+    except Exception:
+        fr_txt = str(fr) if fr else ''
+    c.drawString(x0 + 90, y, fr_txt)
+    y -= line_h
+
+    c.setFont("Helvetica-Bold", 9)
+    c.drawString(x0, y, "TÍTULO:")
+    c.setFont("Helvetica", 9)
+    c.drawString(x0 + 40, y, (book.titulo or "")[:80])
+    y -= line_h
+
+    c.setFont("Helvetica-Bold", 9)
+    c.drawString(x0, y, "SUBTÍTULO:")
+    c.setFont("Helvetica", 9)
+    c.drawString(x0 + 60, y, (book.subtitulo or "")[:80])
+    y -= line_h
+
+    c.setFont("Helvetica-Bold", 9)
+    c.drawString(x0, y, "AUTOR:")
+    c.setFont("Helvetica", 9)
+    c.drawString(x0 + 40, y, (book.autor or "")[:60])
+    y -= line_h
+
+    c.setFont("Helvetica-Bold", 9)
+    c.drawString(x0, y, "COAUTOR:")
+    c.setFont("Helvetica", 9)
+    c.drawString(x0 + 50, y, (getattr(book, 'co_autor', '') or '')[:60])
+    y -= line_h
+
+    c.setFont("Helvetica-Bold", 9)
+    c.drawString(x0, y, "AÑO PUB:")
+    c.setFont("Helvetica", 9)
+    try:
+        ap = book.fecha_publicacion.strftime('%Y') if getattr(book, 'fecha_publicacion', None) else ''
+    except Exception:
+        ap = str(getattr(book, 'fecha_publicacion', '') or '')
+    c.drawString(x0 + 53, y, ap)
+    y -= line_h
+
+    c.setFont("Helvetica-Bold", 9)
+    c.drawString(x0, y, "EDITORIAL:")
+    c.setFont("Helvetica", 9)
+    c.drawString(x0 + 60, y, (book.editorial or "")[:60])
+    y -= line_h
+
+    c.setFont("Helvetica-Bold", 9)
+    c.drawString(x0, y, "CLASIFICACIÓN:")
+    c.setFont("Helvetica", 9)
+    clas_txt = _classification_label(book)
+    c.drawString(x0 + 86, y, (clas_txt or '')[:60])
+    y -= line_h
+
+    c.setFont("Helvetica-Bold", 9)
+    c.drawString(x0, y, "EDICIÓN:")
+    c.setFont("Helvetica", 9)
+    c.drawString(x0 + 50, y, f"{book.edicion}ª" if book.edicion else "")
+    y -= line_h
+
+    c.setFont("Helvetica-Bold", 9)
+    c.drawString(x0, y, "UBICACIÓN:")
+    c.setFont("Helvetica", 9)
+    c.drawString(x0 + 60, y, (book.ubicacion_publicacion or "")[:60])
+    y -= (line_h + 8) # un poco más de espacio antes del bloque inferior
+
+    # sección inferior: aumentar separación entre las filas y margen superior del bloque
+    c.setFont("Helvetica-Bold", 9)
+    bottom_x = x0
+    # Espaciado más grande entre líneas de firma
+    sig_spacing = 30  # distancia vertical entre cada campo (aumentada)
+    line_len = 220
+    # Ajustar posición vertical para tener mayor margen superior antes de esta zona
+    y -= 6  # pequeño ajuste extra para empujar hacia abajo (puedes aumentar)
+    # PRESTADO POR
+    c.drawString(bottom_x, y, "PRESTADO POR:")
+    c.line(bottom_x + 80, y-2, bottom_x + 80 + line_len, y-2)
+    y -= sig_spacing
+    # RECIBIDO POR
+    c.drawString(bottom_x, y, "RECIBIDO POR:")
+    c.line(bottom_x + 80, y-2, bottom_x + 80 + line_len, y-2)
+    y -= sig_spacing
+    # FIRMA
+    c.drawString(bottom_x, y, "FIRMA:")
+    c.line(bottom_x + 40, y-2, bottom_x + 40 + (line_len * 0.6), y-2)
+
+    # Pie pequeño con número de serie / vol / año
+    c.setFont("Helvetica", 8)
+    footer_items = []
+    nr = getattr(book, 'numero_registro', None)
+    if nr:
+        footer_items.append(f"N.º registro: {nr}")
+    footer_items.append(f"ID: {book.id}")
+    if getattr(book, 'paginas', None):
+        footer_items.append(f"Páginas: {book.paginas}")
+    if getattr(book, 'volumen', None):
+        footer_items.append(f"Vol: {book.volumen}")
+    if getattr(book, 'serie', None):
+        footer_items.append(f"Serie: {book.serie}")
+    # incluir fecha_registro si existe
+    if getattr(book, 'fecha_registro', None):
+        try:
+            footer_items.append(f"Fecha registro: {book.fecha_registro.strftime('%Y-%m-%d')}")
+        except Exception:
+            footer_items.append(f"Fecha registro: {book.fecha_registro}")
+    c.drawString(m + 6, m + 6, '  |  '.join(footer_items))
+
+
+def render_card(book):
+    """PDF de una página con la ficha de ``book``."""
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=PAGE_SIZE)
+    draw_card(c, book, PAGE_SIZE)
+    c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+
+def render_batch(books, fh):
+    """Escribe en ``fh`` un PDF con una página por libro (un solo canvas y recursos compartidos)."""
+    c = canvas.Canvas(fh, pagesize=PAGE_SIZE)
+    for book in books:
+        draw_card(c, book, PAGE_SIZE)
+        c.showPage()
+    c.save()
+
+
+def _card_path(key):
+    return os.path.join(settings.CARD_CACHE_DIR, f'{key}.pdf')
+
+
+def _write_atomic(path, write):
+    """Escribe ``path`` con ``write(fh)``; otro worker nunca lee un PDF a medio escribir."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def card_bytes(book):
+    """Bytes del PDF de la ficha; se genera y guarda sólo si no existe la versión actual."""
+    key = card_key(book)
+    path = _card_path(key)
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except OSError:
+        pass
+    data = render_card(book)
+    try:
+        _write_atomic(path, lambda f: f.write(data))
+        # descartar versiones anteriores de la ficha de este libro
+        for old in glob.glob(_card_path(f'{book.pk}-*')):
+            if old != path:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+    except OSError:
+        pass  # sin disco escribible la ficha se sirve igual, sólo que sin caché
+    return data
+
+
+def batch_card_path(books):
+    """Ruta del PDF con las fichas de ``books`` (en orden); se genera sólo si no existe."""
+    digest = hashlib.md5(','.join(card_key(b) for b in books).encode('ascii')).hexdigest()
+    directory = os.path.join(settings.CARD_CACHE_DIR, 'batches')
+    path = os.path.join(directory, f'{digest}.pdf')
+    if os.path.exists(path):
+        os.utime(path)  # reciente: no se descarta en la limpieza
+        return path
+    _write_atomic(path, lambda f: render_batch(books, f))
+    # conservar sólo los lotes más recientes
+    batches = sorted(glob.glob(os.path.join(directory, '*.pdf')), key=os.path.getmtime, reverse=True)
+    for old in batches[BATCH_FILES_KEPT:]:
+        try:
+            os.remove(old)
+        except OSError:
+            pass
+    return path
@@ -0,0 +1,128 @@
+"""Derivados de las portadas: tamaños fijos en JPEG y WebP, sin metadatos EXIF.
+
+La portada original (a menudo una foto de varios MB) se guarda tal cual; a
+partir de ella se generan una miniatura para los listados, un tamaño de
+detalle y el tamaño de la ficha PDF. Los nombres son deterministas
+(``covers/derived/<nombre>-<tamaño>.<ext>``) y ``Libros.portada_derivados``
+recuerda para qué archivo original se generaron, de modo que las plantillas
+eligen el derivado sin consultar el disco y vuelven al original si todavía
+no existen.
+
+``generate_derivatives`` sólo usa rutas de archivo (no la base de datos),
+para poder ejecutarse en un pool de procesos desde ``build_cover_derivatives``.
+Con el almacenamiento por contenido (``storage.py``) varios libros pueden
+compartir portada y, por lo tanto, derivados.
+"""
+import os
+import tempfile
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+# nombre -> caja máxima (ancho, alto) en píxeles
+SIZES = {
+    'thumb': (160, 224),
+    'detail': (480, 672),
+    'card': (300, 420),
+}
+FORMATS = {
+    'jpg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+}
+DERIVED_DIR = 'covers/derived'
+
+
+def derivative_name(name, size, ext='jpg'):
+    """'covers/foto.jpeg' -> 'covers/derived/foto-thumb.jpg' (relativo a MEDIA_ROOT)."""
+    base = os.path.splitext(name)[0]
+    if base.startswith('covers/'):
+        base = base[len('covers/'):]
+    return f'{DERIVED_DIR}/{base}-{size}.{ext}'
+
+
+def derivative_names(name):
+    return [derivative_name(name, size, ext) for size in SIZES for ext in FORMATS]
+
+
+def _save(img, path, ext):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            # sin exif=...: Pillow no copia los metadatos (GPS, cámara) al derivado
+            img.save(f, **FORMATS[ext])
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def generate_derivatives(media_root, name):
+    """Genera todos los derivados de ``name``; devuelve ``name`` (útil en el pool de procesos)."""
+    source = os.path.join(media_root, name)
+    largest = max(max(box) for box in SIZES.values())
+    with Image.open(source) as original:
+        # JPEG: decodificar ya reducido al tamaño más grande que se necesita
+        original.draft('RGB', (largest, largest))
+        img = ImageOps.exif_transpose(original)
+        img = img.convert('RGB')
+    for size, box in sorted(SIZES.items(), key=lambda item: -item[1][0]):
+        resized = img.copy()
+        resized.thumbnail(box, Image.LANCZOS)
+        for ext in FORMATS:
+            _save(resized, os.path.join(media_root, derivative_name(name, size, ext)), ext)
+    return name
+
+
+def remove_derivatives(media_root, name):
+    for derived in derivative_names(name):
+        try:
+            os.remove(os.path.join(media_root, derived))
+        except OSError:
+            pass
+
+
+def has_derivatives(book):
+    return bool(book.portada) and book.portada_derivados == book.portada.name
+
+
+def cover_url(book, size, ext='jpg'):
+    """URL del derivado ``size`` (o de la portada original si aún no hay derivados)."""
+    if not book.portada:
+        return ''
+    if has_derivatives(book):
+        return settings.MEDIA_URL + derivative_name(book.portada.name, size, ext)
+    return book.portada.url
+
+
+def cover_path(book, size):
+    """Ruta en disco del derivado JPEG ``size`` (o del original)."""
+    if not book.portada:
+        return ''
+    if has_derivatives(book):
+        return os.path.join(settings.MEDIA_ROOT, derivative_name(book.portada.name, size))
+    return book.portada.path
+
+
+def refresh_derivatives(book_id, name):
+    """Genera los derivados de la portada ``name`` del libro y lo registra (tras el commit del save).
+
+    Los derivados de la portada anterior se borran con el archivo original
+    (``storage.release_cover``), cuando ningún libro la usa.
+    """
+    from .models import Libros
+
+    if name and not Libros.objects.filter(portada_derivados=name).exists():
+        try:
+            generate_derivatives(settings.MEDIA_ROOT, name)
+        except Exception:
+            return False  # imagen ilegible: las plantillas siguen usando el original
+    qs = Libros.objects.filter(pk=book_id)
+    if name:
+        qs = qs.filter(portada=name)
+    # update(): no cambia la versión del libro ni vuelve a disparar save()
+    qs.update(portada_derivados=name)
+    return True
@@ -0,0 +1,160 @@
+"""Exportación en flujo del catálogo y del historial de préstamos (CSV y JSON-lines).
+
+Las filas se leen con ``values_list(...).iterator(chunk_size=...)`` (cursor
+del lado del servidor en PostgreSQL) y se generan en bloques de texto, de
+modo que la memoria no depende de la cantidad de filas y la respuesta
+empieza a enviarse con el primer bloque. Los mismos generadores sirven para
+la vista (``StreamingHttpResponse``) y para el comando ``export_data``.
+"""
+import csv
+import datetime
+import json
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import Libros, Prestamo
+
+CHUNK_SIZE = 2000
+# filas por bloque de texto enviado al cliente
+ROWS_PER_WRITE = 500
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+# (encabezado, campo de values_list)
+BOOK_COLUMNS = [
+    ('id', 'id'),
+    ('cota', 'cota'),
+    ('titulo', 'titulo'),
+    ('subtitulo', 'subtitulo'),
+    ('autor', 'autor'),
+    ('co_autor', 'co_autor'),
+    ('editorial', 'editorial'),
+    ('ubicacion_publicacion', 'ubicacion_publicacion'),
+    ('fecha_publicacion', 'fecha_publicacion'),
+    ('edicion', 'edicion'),
+    ('volumen', 'volumen'),
+    ('paginas', 'paginas'),
+    ('dimensiones', 'dimensiones'),
+    ('serie', 'serie'),
+    ('numero_serie', 'numero_serie'),
+    ('numero_registro', 'numero_registro'),
+    ('fecha_registro', 'fecha_registro'),
+    ('contenido', 'contenido'),
+    ('cantidad', 'cantidad'),
+    ('en_prestamo', 'en_prestamo'),
+    ('codigo_diccionario', 'dictionary_entry__codigo'),
+    ('clasificacion', 'classification__code'),
+    ('is_active', 'is_active'),
+]
+
+LOAN_COLUMNS = [
+    ('id', 'id'),
+    ('libro_id', 'book_id'),
+    ('cota', 'book__cota'),
+    ('titulo', 'book__titulo'),
+    ('usuario', 'user__username'),
+    ('cantidad', 'cantidad'),
+    ('receptor_cedula', 'receiver_cedula'),
+    ('receptor_nombre', 'receiver_first_name'),
+    ('receptor_apellido', 'receiver_last_name'),
+    ('estado', 'status'),
+    ('aprobado', 'approved_at'),
+    ('devuelto', 'returned_at'),
+    ('reporte', 'return_report'),
+    ('puntuacion_libro', 'return_book_rating'),
+    ('puntuacion_receptor', 'return_receiver_rating'),
+]
+
+
+def _parse_day(value):
+    try:
+        return datetime.date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+def export_queryset(kind, params):
+    """Queryset y columnas a exportar; ``params`` admite los filtros de la vista o del comando."""
+    if kind == 'books':
+        qs = Libros.objects.all()
+        if params.get('activos') in ('1', 'true'):
+            qs = qs.filter(is_active=True)
+        return qs.order_by('id'), BOOK_COLUMNS
+    if kind == 'loans':
+        qs = Prestamo.objects.all()
+        status = params.get('status')
+        if status in dict(Prestamo.STATUS_CHOICES):
+            qs = qs.filter(status=status)
+        desde, hasta = _parse_day(params.get('desde')), _parse_day(params.get('hasta'))
+        if desde:
+            qs = qs.filter(approved_at__date__gte=desde)
+        if hasta:
+            qs = qs.filter(approved_at__date__lte=hasta)
+        return qs.order_by('id'), LOAN_COLUMNS
+    raise ValueError(f'exportación desconocida: {kind}')
+
+
+class _Echo:
+    """Pseudo-archivo para ``csv.writer``: devuelve la línea en lugar de guardarla."""
+
+    def write(self, value):
+        return value
+
+
+def _json_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    return value
+
+
+def _rows(qs, columns, chunk_size):
+    return qs.values_list(*[field for _, field in columns]).iterator(chunk_size=chunk_size)
+
+
+def iter_csv(qs, columns, chunk_size=CHUNK_SIZE):
+    writer = csv.writer(_Echo())
+    yield '\ufeff' + writer.writerow([header for header, _ in columns])  # BOM para Excel
+    block = []
+    for row in _rows(qs, columns, chunk_size):
+        block.append(writer.writerow([_json_value(v) for v in row]))
+        if len(block) >= ROWS_PER_WRITE:
+            yield ''.join(block)
+            block = []
+    if block:
+        yield ''.join(block)
+
+
+def iter_jsonl(qs, columns, chunk_size=CHUNK_SIZE):
+    headers = [header for header, _ in columns]
+    block = []
+    for row in _rows(qs, columns, chunk_size):
+        block.append(json.dumps(dict(zip(headers, map(_json_value, row))), ensure_ascii=False) + '\n')
+        if len(block) >= ROWS_PER_WRITE:
+            yield ''.join(block)
+            block = []
+    if block:
+        yield ''.join(block)
+
+
+def iter_export(kind, fmt, params, chunk_size=CHUNK_SIZE):
+    qs, columns = export_queryset(kind, params)
+    generator = iter_jsonl if fmt == 'jsonl' else iter_csv
+    return generator(qs, columns, chunk_size)
+
+
+def streaming_export(kind, fmt, params):
+    """``StreamingHttpResponse`` con el archivo como adjunto (``catalogo-AAAAMMDD.csv``)."""
+    if fmt not in FORMATS:
+        fmt = 'csv'
+    name = {'books': 'catalogo', 'loans': 'prestamos'}[kind]
+    filename = f'{name}-{timezone.localdate():%Y%m%d}.{fmt}'
+    response = StreamingHttpResponse((chunk.encode('utf-8') for chunk in iter_export(kind, fmt, params)),
+                                     content_type=FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    # evitar que un proxy (nginx) acumule la respuesta completa antes de enviarla
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,148 @@
+"""Facetas del catálogo (clasificación, editorial, década, contenido y disponibilidad).
+
+Todos los conteos salen de una sola consulta agrupada por
+(clasificación, editorial, década) con conteos condicionales para las marcas
+de ``contenido`` y la disponibilidad; luego se acumulan en Python por faceta.
+Agregar una faceta no agrega consultas.
+"""
+from urllib.parse import urlencode
+
+from django.db.models import Count, F, IntegerField, Q
+from django.db.models.expressions import ExpressionWrapper
+
+from .inventory import free_copy_q
+from .models import CONTENT_CHOICES
+
+# valor usado en la URL para "sin editorial"/"sin año"
+EMPTY_VALUE = '-'
+
+# cantidad máxima de editoriales que se muestran (las de más resultados)
+EDITORIAL_LIMIT = 15
+
+
+def available_q():
+    """Libros con al menos un ejemplar libre (ver ``inventory.free_copy_q``)."""
+    return free_copy_q()
+
+
+def selected_facets(params):
+    """Lee la selección de facetas desde ``request.GET`` (valores ya limpios)."""
+    contenido_allowed = {key for key, _ in CONTENT_CHOICES}
+    return {
+        'materia': params.get('materia', '').strip(),
+        'editorial': params.get('editorial', '').strip(),
+        'decada': params.get('decada', '').strip(),
+        'contenido': [c for c in params.getlist('contenido') if c in contenido_allowed],
+        'disponible': params.get('disponible', '') == '1',
+    }
+
+
+def apply_facets(qs, selected):
+    """Filtra el queryset por las facetas seleccionadas."""
+    if selected['materia']:
+        qs = qs.filter(classification__id=selected['materia'])
+    editorial = selected['editorial']
+    if editorial == EMPTY_VALUE:
+        qs = qs.filter(Q(editorial__isnull=True) | Q(editorial=''))
+    elif editorial:
+        qs = qs.filter(editorial=editorial)
+    decada = selected['decada']
+    if decada == EMPTY_VALUE:
+        qs = qs.filter(fecha_publicacion__isnull=True)
+    elif decada:
+        try:
+            start = int(decada)
+            qs = qs.filter(fecha_publicacion__gte=start, fecha_publicacion__lte=start + 9)
+        except ValueError:
+            pass
+    for flag in selected['contenido']:
+        qs = qs.filter(contenido__contains=flag)
+    if selected['disponible']:
+        qs = qs.filter(available_q())
+    return qs
+
+
+def facet_counts(qs):
+    """Conteos por faceta del queryset en una única consulta agrupada."""
+    decade = ExpressionWrapper(F('fecha_publicacion') / 10 * 10, output_field=IntegerField())
+    aggregates = {'total': Count('id'), 'libres': Count('id', filter=available_q())}
+    for key, _ in CONTENT_CHOICES:
+        aggregates[f'c_{key}'] = Count('id', filter=Q(contenido__contains=key))
+    rows = (
+        qs.order_by()
+        .annotate(decada=decade)
+        .values('classification_id', 'editorial', 'decada')
+        .annotate(**aggregates)
+    )
+
+    counts = {'materia': {}, 'editorial': {}, 'decada': {}, 'contenido': {}, 'disponible': 0}
+    for row in rows:
+        total = row['total']
+        for facet, value in (('materia', row['classification_id']),
+                             ('editorial', (row['editorial'] or '').strip() or EMPTY_VALUE),
+                             ('decada', EMPTY_VALUE if row['decada'] is None else row['decada'])):
+            if value is None:
+                continue
+            counts[facet][value] = counts[facet].get(value, 0) + total
+        for key, _ in CONTENT_CHOICES:
+            counts['contenido'][key] = counts['contenido'].get(key, 0) + row[f'c_{key}']
+        counts['disponible'] += row['libres']
+    return counts
+
+
+def _facet_url(params, name, value):
+    """Querystring con la faceta ``name`` alternada, sin página ni cursor."""
+    query = params.copy()
+    for key in ('page', 'cursor'):
+        query.pop(key, None)
+    if name == 'contenido':
+        current = query.getlist('contenido')
+        query.setlist('contenido', [c for c in current if c != value] if value in current else current + [value])
+    elif query.get(name) == value:
+        query.pop(name, None)
+    else:
+        query[name] = value
+    return '?' + query.urlencode()
+
+
+def build_facets(params, selected, counts, clasificaciones):
+    """Estructura para la plantilla: ``[{name, label, values: [{label, count, selected, url}]}]``."""
+    labels = {c.id: c.label for c in clasificaciones}
+
+    def entry(name, value, label, count, is_selected):
+        return {'value': value, 'label': label, 'count': count, 'selected': is_selected,
+                'url': _facet_url(params, name, str(value))}
+
+    materias = sorted(counts['materia'].items(), key=lambda kv: (-kv[1], labels.get(kv[0], '')))
+    editoriales = sorted(counts['editorial'].items(), key=lambda kv: (-kv[1], kv[0]))[:EDITORIAL_LIMIT]
+    # décadas más recientes primero, "sin año" al final
+    decadas = sorted(counts['decada'].items(), key=lambda kv: (kv[0] == EMPTY_VALUE, -kv[1] if kv[0] == EMPTY_VALUE else -kv[0]))
+
+    return [
+        {'name': 'materia', 'label': 'Clasificación', 'values': [
+            entry('materia', pk, labels.get(pk, pk), n, selected['materia'] == str(pk))
+            for pk, n in materias]},
+        {'name': 'editorial', 'label': 'Editorial', 'values': [
+            entry('editorial', value, 'Sin editorial' if value == EMPTY_VALUE else value, n, selected['editorial'] == value)
+            for value, n in editoriales]},
+        {'name': 'decada', 'label': 'Año de publicación', 'values': [
+            entry('decada', value, 'Sin año' if value == EMPTY_VALUE else f'{value}–{value + 9}', n, selected['decada'] == str(value))
+            for value, n in decadas]},
+        {'name': 'contenido', 'label': 'Contenido', 'values': [
+            entry('contenido', key, label, counts['contenido'].get(key, 0), key in selected['contenido'])
+            for key, label in CONTENT_CHOICES if counts['contenido'].get(key) or key in selected['contenido']]},
+        {'name': 'disponible', 'label': 'Disponibilidad', 'values': [
+            entry('disponible', 1, 'Con ejemplares disponibles', counts['disponible'], selected['disponible'])]},
+    ]
+
+
+def facet_query(selected):
+    """Parámetros de las facetas seleccionadas, para conservarlos en la paginación."""
+    pairs = []
+    for name in ('editorial', 'decada'):
+        if selected[name]:
+            pairs.append((name, selected[name]))
+    pairs.extend(('contenido', c) for c in selected['contenido'])
+    if selected['disponible']:
+        pairs.append(('disponible', '1'))
+    return urlencode(pairs)
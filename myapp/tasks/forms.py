@@ -1,4 +1,7 @@
 from .models import Libros, CONTENT_CHOICES, DictionaryEntry
+from .cache_utils import get_or_build
+from .indexes import DICTIONARY_CODES
+from .resolver import resolve_code
 import re
 from django import forms
 from django.contrib.auth import get_user_model
@@ -34,6 +37,23 @@ class DictionaryEntryForm(djforms.ModelForm):
         model = DictionaryEntry
         fields = ['codigo','descripcion','descripcion_en','clasificacion','is_active']
 
+def _cota_prefixes():
+    """Primer token (en mayúsculas) de cada código del diccionario, ordenados."""
+    prefixes = set()
+    for code in DictionaryEntry.objects.values_list('codigo', flat=True).distinct():
+        if not code:
+            continue
+        parts = str(code).strip().split(None, 1)
+        if parts:
+            prefixes.add(parts[0].upper())
+    return sorted(prefixes)
+
+
+def cota_prefixes():
+    """Prefijos para ``cota_part1``, cacheados hasta que cambie el diccionario (ver signals.py)."""
+    return get_or_build(DICTIONARY_CODES, 'cota-prefixes', _cota_prefixes)
+
+
 #libros modelo - correccion de formulario
 
 class TaskForm(forms.ModelForm):
@@ -93,14 +113,7 @@ class TaskForm(forms.ModelForm):
         super().__init__(*args, **kwargs)
         # Poblar cota_part1 como ChoiceField con prefijos únicos del diccionario (si hay datos)
         try:
-            prefixes = set()
-            for code in DictionaryEntry.objects.values_list('codigo', flat=True).distinct():
-                if not code:
-                    continue
-                parts = str(code).strip().split(None, 1)
-                if parts:
-                    prefixes.add(parts[0].upper())
-            choices = [('', 'Seleccione prefijo')] + [(p, p) for p in sorted(prefixes)]
+            choices = [('', 'Seleccione prefijo')] + [(p, p) for p in cota_prefixes()]
             # reemplazar el campo por ChoiceField para mostrar dropdown
             self.fields['cota_part1'] = forms.ChoiceField(choices=choices, required=True, label='Cota Parte 1')
         except Exception:
@@ -207,16 +220,8 @@ class TaskForm(forms.ModelForm):
             p2_norm = re.sub(r"\s+", " ", p2.strip()).upper()
             combined = f"{p1_norm} {p2_norm}".strip()
             try:
-                # Intentos de búsqueda en orden de preferencia
-                de = None
-                # 1) coincidencia exacta (case-insensitive)
-                de = DictionaryEntry.objects.filter(codigo__iexact=combined).first()
-                # 2) intentar startswith (p.ej. el código en DB puede tener sufijos adicionales)
-                if not de:
-                    de = DictionaryEntry.objects.filter(codigo__istartswith=combined).first()
-                # 3) intento más flexible: contiene
-                if not de:
-                    de = DictionaryEntry.objects.filter(codigo__icontains=combined).first()
+                # coincidencia exacta o, si no hay, por prefijo (p.ej. el código en DB puede tener sufijos adicionales)
+                de = resolve_code(combined)
 
                 if not de:
                     # si no hay coincidencia, marcar error en ambos campos
@@ -0,0 +1,361 @@
+"""Importación masiva de libros y del diccionario.
+
+``read_rows`` lee CSV (delimitador ',' o ';') o JSON-lines de forma
+incremental, y ``BookImporter`` convierte cada fila en un ``Libros``,
+resuelve diccionario y clasificación por lotes y los inserta con
+``bulk_create`` dentro de una transacción por lote.
+
+``DictionarySync`` compara el CSV del diccionario con las entradas
+existentes en memoria y aplica sólo las altas, cambios y bajas (en
+PostgreSQL con COPY a una tabla temporal y un único INSERT ... ON CONFLICT).
+
+Las operaciones masivas no llaman a ``save()`` ni envían señales, así que
+aquí se calculan los campos derivados y se invalidan los índices al final.
+"""
+import csv
+import datetime
+import io
+import json
+import re
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+
+from . import inventory
+from .cache_utils import bump_version
+from .indexes import BOOK_SUGGESTIONS, DICTIONARY_CODES
+from .models import CONTENT_CHOICES, DictionaryEntry, Libros
+from .resolver import classification_map, code_resolver
+from .search import dictionary_prefix, normalize_code
+
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%Y/%m/%d')
+
+TEXT_FIELDS = ('titulo', 'subtitulo', 'autor', 'co_autor', 'editorial', 'ubicacion_publicacion', 'serie', 'dimensiones')
+INT_FIELDS = ('fecha_publicacion', 'paginas', 'numero_serie', 'numero_registro', 'edicion', 'volumen', 'cantidad')
+REQUIRED_FIELDS = ('cota', 'titulo', 'autor')
+
+
+class RowError(ValueError):
+    """Fila rechazada; el mensaje explica el motivo."""
+
+
+FORMAT_EXTENSIONS = {
+    'jsonl': ('.jsonl', '.ndjson', '.json'),
+    'marc': ('.mrc', '.marc', '.iso', '.iso2709'),
+    'marcxml': ('.xml', '.marcxml'),
+}
+BINARY_FORMATS = ('marc', 'marcxml')
+
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    for name, extensions in FORMAT_EXTENSIONS.items():
+        if path.lower().endswith(extensions):
+            return name
+    return 'csv'
+
+
+def read_rows(fh, fmt):
+    """Genera ``(número de línea, dict)`` sin cargar el archivo completo en memoria."""
+    if fmt == 'jsonl':
+        for number, line in enumerate(fh, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield number, RowError(f'JSON inválido: {e}')
+                continue
+            yield number, row if isinstance(row, dict) else RowError('la línea no es un objeto JSON')
+        return
+    sample = fh.readline()
+    delimiter = ';' if sample.count(';') > sample.count(',') else ','
+    reader = csv.DictReader([sample], delimiter=delimiter)
+    fieldnames = [f.strip().lower() for f in reader.fieldnames or []]
+    reader = csv.DictReader(fh, fieldnames=fieldnames, delimiter=delimiter)
+    for row in reader:
+        yield reader.line_num + 1, row  # +1 por la cabecera ya leída
+
+
+def normalize_cota(value):
+    return ' '.join(str(value or '').split()).upper()
+
+
+def _clean_str(value):
+    if value is None:
+        return ''
+    return str(value).strip()
+
+
+def _parse_int(name, value):
+    value = _clean_str(value)
+    if value == '':
+        return None
+    # las hojas de cálculo suelen exportar enteros como '12.0'
+    match = re.fullmatch(r'(-?\d+)(\.0+)?', value)
+    if not match:
+        raise RowError(f'{name} debe ser un entero: {value!r}')
+    return int(match.group(1))
+
+
+def _parse_date(value):
+    value = _clean_str(value)
+    if not value:
+        return None
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    raise RowError(f'fecha_registro inválida: {value!r}')
+
+
+def _parse_contenido(value):
+    allowed = {key for key, _ in CONTENT_CHOICES}
+    if isinstance(value, (list, tuple)):
+        items = value
+    else:
+        items = _clean_str(value).split(',')
+    return ','.join(v.strip().lower() for v in items if v and v.strip().lower() in allowed)
+
+
+def _parse_bool(value, default=True):
+    value = _clean_str(value).lower()
+    if value == '':
+        return default
+    return value in ('1', 'true', 'si', 'sí', 'yes', 'x')
+
+
+def row_to_book(row, user):
+    """Convierte una fila en un ``Libros`` sin guardar; lanza ``RowError`` si no es válida."""
+    row = {str(k).strip().lower(): v for k, v in row.items() if k is not None}
+    for name in REQUIRED_FIELDS:
+        if not _clean_str(row.get(name)):
+            raise RowError(f'falta {name}')
+    book = Libros(cota=normalize_cota(row['cota']), user=user)
+    for name in TEXT_FIELDS:
+        value = _clean_str(row.get(name))
+        max_length = Libros._meta.get_field(name).max_length
+        if len(value) > max_length:
+            raise RowError(f'{name} supera {max_length} caracteres')
+        setattr(book, name, value or (None if Libros._meta.get_field(name).null else ''))
+    for name in INT_FIELDS:
+        value = _parse_int(name, row.get(name))
+        if value is not None:
+            # opciones, positivos y rango de la columna: un valor fuera de rango haría
+            # fallar el bulk_create de todo el lote
+            try:
+                value = Libros._meta.get_field(name).clean(value, book)
+            except ValidationError as e:
+                raise RowError(f'{name} inválido ({value}): {" ".join(e.messages)}')
+            setattr(book, name, value)
+    if len(book.cota) > Libros._meta.get_field('cota').max_length:
+        raise RowError('cota demasiado larga')
+    book.fecha_registro = _parse_date(row.get('fecha_registro'))
+    book.contenido = _parse_contenido(row.get('contenido'))
+    book.is_active = _parse_bool(row.get('is_active'))
+    return book
+
+
+def dictionary_key(cota):
+    """Primeras dos partes de la cota ('WG 200 A 12' -> 'WG 200'), como en TaskForm."""
+    return ' '.join(cota.split()[:2])
+
+
+class BookImporter:
+    """Inserta libros por lotes.
+
+    Los rechazos ``(línea, motivo, fila)`` se pasan a ``on_reject`` si se
+    indica; en memoria sólo se guardan los primeros ``REJECTED_KEPT`` para el
+    resumen, así un archivo grande con muchos errores no acumula filas.
+    """
+    REJECTED_KEPT = 100
+
+    def __init__(self, user, batch_size=1000, dry_run=False, require_dictionary=False, on_reject=None):
+        self.user = user
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.require_dictionary = require_dictionary
+        self.on_reject = on_reject
+        self.processed = 0
+        self.inserted = 0
+        self.rejected = []
+        self.rejected_count = 0
+        self._seen_cotas = set()
+
+    def reject(self, number, reason, row):
+        self.rejected_count += 1
+        if self.on_reject:
+            self.on_reject(number, str(reason), row)
+        if len(self.rejected) < self.REJECTED_KEPT:
+            self.rejected.append((number, str(reason), row))
+
+    def run(self, rows, progress=None):
+        """Consume ``rows`` (pares línea/fila) y llama a ``progress(importer)`` tras cada lote."""
+        batch = []
+        for number, row in rows:
+            self.processed += 1
+            if isinstance(row, Exception):
+                self.reject(number, row, {})
+                continue
+            try:
+                book = row_to_book(row, self.user)
+            except RowError as e:
+                self.reject(number, e, row)
+                continue
+            if book.cota in self._seen_cotas:
+                self.reject(number, f'cota repetida en el archivo: {book.cota}', row)
+                continue
+            self._seen_cotas.add(book.cota)
+            batch.append((number, row, book))
+            if len(batch) >= self.batch_size:
+                self._flush(batch)
+                batch = []
+                if not self.dry_run:
+                    # los lotes anteriores ya están en la base: _flush los detecta como existentes
+                    self._seen_cotas.clear()
+                if progress:
+                    progress(self)
+        if batch:
+            self._flush(batch)
+            if progress:
+                progress(self)
+        if self.inserted and not self.dry_run:
+            bump_version(BOOK_SUGGESTIONS)
+        return self
+
+    def _flush(self, batch):
+        cotas = [book.cota for _, _, book in batch]
+        existing = set(Libros.objects.filter(cota__in=cotas).values_list('cota', flat=True))
+        entries = code_resolver.resolve_many({dictionary_key(c) for c in cotas})
+
+        books = []
+        for number, row, book in batch:
+            if book.cota in existing:
+                self.reject(number, f'la cota ya existe: {book.cota}', row)
+                continue
+            entry = entries.get(dictionary_key(book.cota))
+            if entry is None and self.require_dictionary:
+                self.reject(number, f'la cota no corresponde a ningún código del diccionario: {book.cota}', row)
+                continue
+            book.dictionary_entry = entry
+            books.append(book)
+        if not books:
+            return
+
+        if self.dry_run:
+            # sin tocar la base: assign crea clasificaciones y completa etiquetas
+            self.inserted += len(books)
+            return
+        with transaction.atomic():
+            classification_map.assign(books)
+            for book in books:
+                book.set_derived_fields()
+            Libros.objects.bulk_create(books, batch_size=self.batch_size)
+            # bulk_create no pasa por Libros.save(): crear aquí los ejemplares
+            inventory.sync_copies([book.pk for book in books])
+        self.inserted += len(books)
+
+
+DICTIONARY_FIELDS = ('descripcion', 'descripcion_en', 'clasificacion')
+
+
+class DictionarySync:
+    """Sincroniza ``DictionaryEntry`` con un CSV ``codigo;descripcion;descripcion_en;clasificacion``.
+
+    ``load`` lee el archivo y calcula la diferencia (``inserts``, ``updates``,
+    ``deactivations``); ``apply`` la escribe en una transacción. Las entradas
+    que ya no figuran en el archivo sólo se inhabilitan con ``deactivate_missing``.
+    """
+
+    def __init__(self, deactivate_missing=False, batch_size=1000):
+        self.deactivate_missing = deactivate_missing
+        self.batch_size = batch_size
+        self.rows = 0
+        self.duplicates = 0
+        self.inserts = []
+        self.updates = []
+        self.deactivations = []
+        self.unchanged = 0
+
+    def load(self, fh, delimiter=';'):
+        incoming = {}
+        for row in csv.DictReader(fh, delimiter=delimiter):
+            codigo = (row.get('codigo') or '').strip()
+            if not codigo:
+                continue
+            self.rows += 1
+            if codigo in incoming:
+                self.duplicates += 1  # como antes, la última fila gana
+            incoming[codigo] = {name: row.get(name) or '' for name in DICTIONARY_FIELDS}
+
+        existing = {}
+        for entry in DictionaryEntry.objects.only('id', 'codigo', 'is_active', *DICTIONARY_FIELDS).order_by().iterator(chunk_size=2000):
+            existing[entry.codigo] = entry
+
+        for codigo, values in incoming.items():
+            entry = existing.get(codigo)
+            if entry is None:
+                self.inserts.append(DictionaryEntry(
+                    codigo=codigo, is_active=True, prefijo=dictionary_prefix(codigo),
+                    codigo_key=normalize_code(codigo), **values))
+            elif not entry.is_active or any(getattr(entry, name) != value for name, value in values.items()):
+                for name, value in values.items():
+                    setattr(entry, name, value)
+                entry.is_active = True
+                self.updates.append(entry)
+            else:
+                self.unchanged += 1
+        if self.deactivate_missing:
+            self.deactivations = [e for codigo, e in existing.items() if e.is_active and codigo not in incoming]
+        return self
+
+    @property
+    def changed(self):
+        return bool(self.inserts or self.updates or self.deactivations)
+
+    def apply(self):
+        if not self.changed:
+            return self
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                self._upsert_copy(self.inserts + self.updates)
+            else:
+                DictionaryEntry.objects.bulk_create(self.inserts, batch_size=self.batch_size)
+                DictionaryEntry.objects.bulk_update(self.updates, [*DICTIONARY_FIELDS, 'is_active'], batch_size=self.batch_size)
+            if self.deactivations:
+                DictionaryEntry.objects.filter(pk__in=[e.pk for e in self.deactivations]).update(is_active=False)
+            # una sola invalidación para toda la importación
+            transaction.on_commit(lambda: bump_version(DICTIONARY_CODES))
+        return self
+
+    def _upsert_copy(self, entries):
+        """COPY de las filas nuevas o modificadas a una tabla temporal y un único upsert."""
+        if not entries:
+            return
+        table = DictionaryEntry._meta.db_table
+        columns = ['codigo', *DICTIONARY_FIELDS, 'prefijo', 'codigo_key']
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for entry in entries:
+            # prefijo/codigo_key se calculan del código: en las filas existentes están diferidos
+            # (``.only`` en ``load``) y leerlos haría dos consultas por fila
+            writer.writerow([entry.codigo, *(getattr(entry, name) for name in DICTIONARY_FIELDS),
+                             dictionary_prefix(entry.codigo), normalize_code(entry.codigo)])
+        buffer.seek(0)
+        # FORCE_NOT_NULL: en CSV un campo vacío se leería como NULL ('[QS 32]' no tiene prefijo)
+        column_list = ', '.join(columns)
+        updates = ', '.join(f'{name} = EXCLUDED.{name}' for name in [*DICTIONARY_FIELDS, 'is_active'])
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE dictionary_staging (codigo varchar(200), descripcion text, descripcion_en text, '
+                'clasificacion varchar(200), prefijo varchar(10), codigo_key varchar(200)) ON COMMIT DROP'
+            )
+            cursor.cursor.copy_expert(f'COPY dictionary_staging ({column_list}) FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL ({column_list}))', buffer)
+            cursor.execute(
+                f'INSERT INTO {table} ({column_list}, is_active) '
+                f'SELECT {column_list}, true FROM dictionary_staging '
+                f'ON CONFLICT (codigo) DO UPDATE SET {updates}'
+            )
@@ -0,0 +1,259 @@
+"""Índices en memoria (por worker) sobre datos pequeños y muy consultados.
+
+``code_index`` responde el autocompletado de códigos del diccionario sin ir a
+la base de datos: guarda los códigos activos ordenados y un arreglo de
+sufijos (cada sufijo en minúsculas con la posición de su código), de modo que
+una búsqueda por prefijo o por subcadena es una búsqueda binaria.
+
+``book_index`` sugiere libros mientras se escribe: un índice de prefijos de
+palabras (lista ordenada de palabras normalizadas de título y autores, cada
+una con el conjunto de libros que la contienen) más los datos que muestra la
+sugerencia (título, autor, cota, ejemplares libres). Se actualiza de forma
+incremental con ``Libros.save``/``delete``. Los ejemplares libres cambian con
+cada préstamo o devolución: no renuevan la versión (obligaría a todos los
+workers a reconstruir el índice), ``inventory.publish`` los publica por libro
+en la caché durante ``FREE_TIMEOUT`` segundos. Cada worker reconstruye su índice
+cuando es más viejo que ese plazo, así que un valor publicado no caduca antes
+de que el índice que lo superpone lo haya leído de la base de datos.
+
+Los índices se construyen al arrancar el worker (``warm_indexes`` en
+wsgi.py) o en la primera consulta, y se reconstruyen cuando cambia su versión
+en la caché (ver ``cache_utils.py`` y ``signals.py``).
+"""
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.core.cache import cache
+
+from .cache_utils import bump_version, get_version
+
+DICTIONARY_CODES = 'dictionary-codes'
+BOOK_SUGGESTIONS = 'book-suggestions'
+# ejemplares libres de un libro, publicados al tomarse o devolverse uno (ver inventory.py)
+FREE_KEY = 'academia:book-free:{}'
+FREE_TIMEOUT = 60 * 60
+
+# cota superior para búsquedas por prefijo con bisect
+_PREFIX_END = '\U0010ffff'
+
+
+class CodeIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._codes = []
+        self._suffixes = []
+        self._positions = []
+
+    def _build(self):
+        from .models import DictionaryEntry
+
+        codes = list(
+            DictionaryEntry.objects.filter(is_active=True).order_by('codigo').values_list('codigo', flat=True)
+        )
+        pairs = sorted(
+            (lower[i:], pos)
+            for pos, lower in enumerate(c.lower() for c in codes)
+            for i in range(len(lower))
+        )
+        self._codes = codes
+        self._suffixes = [s for s, _ in pairs]
+        self._positions = [p for _, p in pairs]
+
+    def ensure_current(self):
+        version = get_version(DICTIONARY_CODES)
+        if version == self._version:
+            return
+        with self._lock:
+            if version != self._version:
+                self._build()
+                self._version = version
+
+    @property
+    def version(self):
+        self.ensure_current()
+        return self._version
+
+    def search(self, term, limit=50):
+        """Códigos activos que contienen ``term`` (sin distinguir mayúsculas), en orden de código."""
+        self.ensure_current()
+        codes = self._codes
+        if not term:
+            return codes[:limit]
+        term = term.lower()
+        lo = bisect_left(self._suffixes, term)
+        hi = bisect_left(self._suffixes, term + _PREFIX_END, lo)
+        positions = set(self._positions[lo:hi])
+        return [codes[p] for p in heapq.nsmallest(limit, positions)]
+
+
+code_index = CodeIndex()
+
+
+class BookSuggestIndex:
+    """Prefijos de palabras de ``titulo_norm``/``autores_norm`` -> libros activos."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._version = None
+        self._built_at = 0.0
+        self._books = {}     # id -> [titulo, autor, cota, cantidad, libres, titulo_norm, autores_norm]
+        self._words = []     # palabras ordenadas
+        self._postings = {}  # palabra -> set(ids)
+
+    @staticmethod
+    def _tokens(titulo_norm, autores_norm):
+        return set(titulo_norm.split()) | set(autores_norm.split())
+
+    def _add(self, book_id, titulo, autor, cota, cantidad, libres, titulo_norm, autores_norm):
+        self._books[book_id] = [titulo, autor, cota, cantidad, libres, titulo_norm, autores_norm]
+        for word in self._tokens(titulo_norm, autores_norm):
+            ids = self._postings.get(word)
+            if ids is None:
+                ids = self._postings[word] = set()
+                insort(self._words, word)
+            ids.add(book_id)
+
+    def _remove(self, book_id):
+        entry = self._books.pop(book_id, None)
+        if entry is None:
+            return None
+        for word in self._tokens(entry[5], entry[6]):
+            ids = self._postings.get(word)
+            if ids is None:
+                continue
+            ids.discard(book_id)
+            if not ids:
+                del self._postings[word]
+                del self._words[bisect_left(self._words, word)]
+        return entry
+
+    def _build(self):
+        from django.db.models import Count
+
+        from .models import Ejemplar, Libros
+
+        self._books, self._words, self._postings = {}, [], {}
+        free = dict(
+            Ejemplar.objects.filter(estado=Ejemplar.ESTADO_DISPONIBLE, book__is_active=True)
+            .values('book_id').annotate(n=Count('id')).order_by().values_list('book_id', 'n')
+        )
+        rows = Libros.objects.filter(is_active=True).values_list(
+            'id', 'titulo', 'autor', 'cota', 'cantidad', 'titulo_norm', 'autores_norm'
+        )
+        postings = {}
+        for book_id, titulo, autor, cota, cantidad, titulo_norm, autores_norm in rows.iterator(chunk_size=2000):
+            self._books[book_id] = [titulo, autor, cota, cantidad, free.get(book_id, 0), titulo_norm, autores_norm]
+            for word in self._tokens(titulo_norm, autores_norm):
+                postings.setdefault(word, set()).add(book_id)
+        self._postings = postings
+        self._words = sorted(postings)
+
+    def _stale(self, version):
+        # pasado FREE_TIMEOUT pueden haber caducado ejemplares libres publicados después de construirlo
+        return version != self._version or time.monotonic() - self._built_at >= FREE_TIMEOUT
+
+    def ensure_current(self):
+        version = get_version(BOOK_SUGGESTIONS)
+        if not self._stale(version):
+            return
+        with self._lock:
+            if self._stale(version):
+                self._built_at = time.monotonic()
+                self._build()
+                self._version = version
+
+    def _publish(self, change):
+        """Aplica ``change`` localmente y publica una versión nueva para los demás workers.
+
+        Si el índice local ya estaba desactualizado no se toca: se reconstruirá
+        completo en la próxima consulta.
+        """
+        with self._lock:
+            current = self._version is not None and self._version == get_version(BOOK_SUGGESTIONS)
+            version = bump_version(BOOK_SUGGESTIONS)
+            if current:
+                change()
+                self._version = version
+
+    def book_saved(self, book):
+        from .inventory import free_counts
+
+        def change():
+            entry = self._remove(book.pk)
+            if book.is_active:
+                # los ejemplares libres se publican aparte (copies_changed): conservar los del índice
+                libres = entry[4] if entry else free_counts([book.pk])[book.pk]
+                self._add(book.pk, book.titulo, book.autor, book.cota, book.cantidad, libres,
+                          book.titulo_norm, book.autores_norm)
+        self._publish(change)
+
+    def book_deleted(self, book_id):
+        self._publish(lambda: self._remove(book_id))
+
+    def copies_changed(self, book_ids, using=None):
+        """Publica los ejemplares libres de los libros sin renovar la versión del índice.
+
+        Se relee el valor confirmado (una consulta agrupada) y se guarda en la caché
+        compartida; ``suggest`` lo superpone a lo que tenga el índice de cada worker.
+        """
+        from .inventory import free_counts
+
+        free = free_counts(book_ids, using=using)
+        cache.set_many({FREE_KEY.format(pk): n for pk, n in free.items()}, timeout=FREE_TIMEOUT)
+        with self._lock:
+            for book_id, n in free.items():
+                entry = self._books.get(book_id)
+                if entry is not None:
+                    entry[4] = n
+
+    def suggest(self, query, limit=8):
+        """Libros cuyo título/autores tienen palabras que empiezan con cada término de ``query``."""
+        from .search import normalize_text
+
+        self.ensure_current()
+        terms = normalize_text(query).split()
+        if not terms:
+            return []
+        with self._lock:
+            matches = None
+            # los términos más largos primero: conjuntos más chicos para intersectar
+            for term in sorted(terms, key=len, reverse=True):
+                lo = bisect_left(self._words, term)
+                hi = bisect_left(self._words, term + _PREFIX_END, lo)
+                ids = set()
+                for word in self._words[lo:hi]:
+                    ids |= self._postings[word]
+                matches = ids if matches is None else matches & ids
+                if not matches:
+                    return []
+            phrase = ' '.join(terms)
+
+            def score(book_id):
+                titulo_norm = self._books[book_id][5]
+                # título que empieza con la frase, luego títulos más cortos
+                return (not titulo_norm.startswith(phrase), len(titulo_norm), titulo_norm, book_id)
+
+            top = [(book_id, self._books[book_id][:5]) for book_id in heapq.nsmallest(limit, matches, key=score)]
+        published = cache.get_many([FREE_KEY.format(book_id) for book_id, _ in top])
+        results = []
+        for book_id, (titulo, autor, cota, cantidad, libres) in top:
+            results.append({
+                'id': book_id,
+                'titulo': titulo,
+                'autor': autor,
+                'cota': cota,
+                'disponibles': int(published.get(FREE_KEY.format(book_id), libres) or 0),
+            })
+        return results
+
+
+book_index = BookSuggestIndex()
+
+
+def warm_indexes():
+    """Construye los índices en memoria al arrancar el worker."""
+    code_index.ensure_current()
+    book_index.ensure_current()
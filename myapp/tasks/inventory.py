@@ -0,0 +1,148 @@
+"""Inventario por ejemplar (``Ejemplar``) y asignación de copias a los préstamos.
+
+Cada libro tiene ``cantidad`` ejemplares que no están de baja (``sync_copies``
+los crea o da de baja al cambiar la cantidad). Un préstamo pendiente, activo o
+con la devolución sin confirmar retiene sus ejemplares; al devolverse o
+eliminarse los libera.
+
+Para tomar un ejemplar libre no se bloquea la fila del libro: ``claim`` usa
+``SELECT ... FOR UPDATE SKIP LOCKED`` sobre los ejemplares disponibles, de
+modo que dos préstamos simultáneos del mismo título toman copias distintas
+sin esperarse. La disponibilidad es el conteo de ejemplares libres (índice
+parcial ``ejemplar_libre_idx``): el catálogo, sus facetas, las sugerencias y el
+carrito la leen de aquí (``free_counts``/``availability``), no de los contadores
+``en_prestamo``/``pendientes`` de ``Libros``.
+"""
+from django.db import transaction
+from django.db.models import Case, Count, Exists, IntegerField, OuterRef, Q, Value, When
+
+from .indexes import book_index
+from .models import Ejemplar, Libros, Prestamo
+
+# estados del préstamo que retienen ejemplares
+HOLDING_STATUSES = (Prestamo.STATUS_PENDING, Prestamo.STATUS_ACTIVE, Prestamo.STATUS_RETURN_PENDING)
+
+
+def barcode(book_id, n):
+    """Código de barras del ``n``-ésimo ejemplar del libro."""
+    return f'{book_id:06d}-{n:03d}'
+
+
+def publish(book_ids, using=None):
+    """Publica los ejemplares libres de los libros a las sugerencias al confirmar la transacción."""
+    book_ids = sorted(set(book_ids))
+    if book_ids:
+        transaction.on_commit(lambda: book_index.copies_changed(book_ids, using=using), using=using, robust=True)
+
+
+def sync_copies(book_ids, using=None):
+    """Ajusta los ejemplares de cada libro a su ``cantidad``; devuelve (creados, dados de baja).
+
+    Faltan: se crean con códigos nuevos. Sobran: se dan de baja los libres más
+    recientes (los prestados se conservan hasta que vuelvan).
+    """
+    book_ids = [pk for pk in book_ids if pk]
+    if not book_ids:
+        return 0, 0
+    wanted = dict(Libros.objects.using(using).filter(pk__in=book_ids).values_list('pk', 'cantidad'))
+    rows = (
+        Ejemplar.objects.using(using).filter(book_id__in=wanted).values('book_id')
+        .annotate(total=Count('id'), vigentes=Count('id', filter=~Q(estado=Ejemplar.ESTADO_BAJA)))
+        .order_by()
+    )
+    existing = {row['book_id']: (row['total'], row['vigentes']) for row in rows}
+    new, retire, changed = [], [], []
+    for book_id, cantidad in wanted.items():
+        total, vigentes = existing.get(book_id, (0, 0))
+        cantidad = int(cantidad or 0)
+        if vigentes < cantidad:
+            # los códigos no se reutilizan: los ejemplares de baja conservan el suyo
+            new.extend(
+                Ejemplar(book_id=book_id, codigo_barras=barcode(book_id, n))
+                for n in range(total + 1, total + 1 + cantidad - vigentes)
+            )
+            changed.append(book_id)
+        elif vigentes > cantidad:
+            free = Ejemplar.objects.using(using).filter(book_id=book_id, estado=Ejemplar.ESTADO_DISPONIBLE).order_by('-pk')
+            surplus = list(free.values_list('pk', flat=True)[:vigentes - cantidad])
+            if surplus:
+                retire.extend(surplus)
+                changed.append(book_id)
+    with transaction.atomic(using=using):
+        Ejemplar.objects.using(using).bulk_create(new, batch_size=1000)
+        retired = 0
+        if retire:
+            # el estado se vuelve a comprobar: un préstamo pudo tomar el ejemplar entretanto
+            retired = Ejemplar.objects.using(using).filter(pk__in=retire, estado=Ejemplar.ESTADO_DISPONIBLE).update(estado=Ejemplar.ESTADO_BAJA)
+        publish(changed, using=using)
+    return len(new), retired
+
+
+def claim(book_id, n=1, using=None):
+    """Bloquea hasta ``n`` ejemplares libres del libro, saltando los que otra transacción ya tomó.
+
+    Debe llamarse dentro de una transacción; los ejemplares quedan bloqueados
+    hasta que ``assign`` los marque como prestados y la transacción confirme.
+    """
+    free = (
+        Ejemplar.objects.using(using).select_for_update(skip_locked=True)
+        .filter(book_id=book_id, estado=Ejemplar.ESTADO_DISPONIBLE).order_by('pk')
+    )
+    copies = list(free.values_list('pk', flat=True)[:n])
+    if copies:
+        publish([book_id], using=using)
+    return copies
+
+
+def assign(copies, using=None):
+    """Marca como prestados los ejemplares ``{ejemplar_id: prestamo_id}`` (un solo UPDATE)."""
+    if not copies:
+        return 0
+    loan = Case(*[When(pk=copy_id, then=Value(loan_id)) for copy_id, loan_id in copies.items()], output_field=IntegerField())
+    return Ejemplar.objects.using(using).filter(pk__in=list(copies)).update(estado=Ejemplar.ESTADO_PRESTADO, prestamo_id=loan)
+
+
+def release(loan_ids, using=None):
+    """Devuelve al estante los ejemplares que retenían los préstamos.
+
+    Si la ``cantidad`` del libro bajó mientras estaban prestados, los que
+    sobran se dan de baja en la misma transacción (``sync_copies``).
+    """
+    loan_ids = [pk for pk in loan_ids if pk]
+    if not loan_ids:
+        return 0
+    held = Ejemplar.objects.using(using).filter(prestamo_id__in=loan_ids, estado=Ejemplar.ESTADO_PRESTADO)
+    with transaction.atomic(using=using):
+        book_ids = list(held.values_list('book_id', flat=True).distinct().order_by())
+        released = held.update(estado=Ejemplar.ESTADO_DISPONIBLE, prestamo=None)
+        if released:
+            sync_copies(book_ids, using=using)
+            publish(book_ids, using=using)
+    return released
+
+
+def free_counts(book_ids, using=None):
+    """``{book_id: ejemplares libres}`` (0 si no hay ninguno)."""
+    rows = (
+        Ejemplar.objects.using(using).filter(book_id__in=book_ids, estado=Ejemplar.ESTADO_DISPONIBLE)
+        .values('book_id').annotate(n=Count('id')).order_by()
+    )
+    counts = {book_id: 0 for book_id in book_ids}
+    counts.update((row['book_id'], row['n']) for row in rows)
+    return counts
+
+
+def free_copy_q(outer='pk'):
+    """Q de los libros con al menos un ejemplar libre (subconsulta sobre ``ejemplar_libre_idx``)."""
+    return Q(Exists(Ejemplar.objects.filter(book_id=OuterRef(outer), estado=Ejemplar.ESTADO_DISPONIBLE)))
+
+
+def availability(books, using=None):
+    """Anota en cada libro ``libres``, ``total`` (``cantidad``) y ``prestados`` (los ejemplares
+    retenidos por préstamos, ``total - libres``) con una sola consulta."""
+    free = free_counts([book.pk for book in books], using=using)
+    for book in books:
+        book.libres = free[book.pk]
+        book.total = int(book.cantidad or 0)
+        book.prestados = max(book.total - book.libres, 0)
+    return books
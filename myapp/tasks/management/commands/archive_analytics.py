@@ -0,0 +1,47 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from tasks.partitions import add_months, drop_month, ensure_partitions, export_month, months_before
+
+
+class Command(BaseCommand):
+    help = ('Crea las particiones mensuales de AnalyticsEvent y archiva los meses cerrados '
+            'más antiguos en JSON-lines comprimido (ejecutar a diario, p. ej. desde cron)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-months', type=int, default=settings.ANALYTICS_RETENTION_MONTHS,
+                            help='Meses de eventos que se conservan en la base, contando el actual')
+        parser.add_argument('--archive-dir', default=settings.ANALYTICS_ARCHIVE_DIR, help='Directorio de los archivos .jsonl.gz')
+        parser.add_argument('--dry-run', action='store_true', help='Sólo informar qué meses se archivarían')
+
+    def handle(self, *args, **options):
+        if options['keep_months'] < 1:
+            raise CommandError('--keep-months debe ser mayor que cero')
+        created = [] if options['dry_run'] else ensure_partitions()
+        for month in created:
+            self.stdout.write(f'Partición creada: {month:%Y-%m}')
+
+        cutoff = add_months(timezone.localdate().replace(day=1), 1 - options['keep_months'])
+        months = months_before(cutoff)
+        if options['dry_run']:
+            names = ', '.join(f'{m:%Y-%m}' for m in months) or 'ninguno'
+            self.stdout.write(self.style.SUCCESS(f'Éxito: se archivarían los meses anteriores a {cutoff:%Y-%m}: {names}.'))
+            return
+
+        archived = 0
+        for month in months:
+            path, count = export_month(month, options['archive_dir'])
+            try:
+                drop_month(month, count)
+            except ValueError as e:
+                # el archivo queda; el mes se vuelve a exportar en la próxima ejecución
+                self.stderr.write(f'  {e}')
+                continue
+            archived += count
+            self.stdout.write(f'{month:%Y-%m}: {count} eventos -> {os.path.basename(path)}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Éxito: {archived} eventos archivados de {len(months)} meses anteriores a {cutoff:%Y-%m}.'
+        ))
@@ -0,0 +1,49 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from tasks.covers import generate_derivatives
+from tasks.models import Libros
+
+
+class Command(BaseCommand):
+    help = 'Genera las miniaturas y variantes WebP de las portadas existentes (en paralelo)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Procesos en paralelo')
+        parser.add_argument('--force', action='store_true', help='Regenerar también las portadas que ya tienen derivados')
+
+    def handle(self, *args, **options):
+        qs = Libros.objects.exclude(portada='').exclude(portada__isnull=True)
+        if not options['force']:
+            qs = qs.exclude(portada_derivados=F('portada'))
+        pending = {}
+        for pk, name in qs.values_list('pk', 'portada').iterator(chunk_size=2000):
+            # varias filas pueden compartir archivo: se procesa una sola vez
+            pending.setdefault(name, []).append(pk)
+        if not pending:
+            self.stdout.write(self.style.SUCCESS('Éxito: todas las portadas tienen derivados.'))
+            return
+
+        media_root = str(settings.MEDIA_ROOT)
+        done = failed = 0
+        # los procesos sólo leen y escriben archivos; la base se actualiza aquí
+        with ProcessPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+            futures = {pool.submit(generate_derivatives, media_root, name): name for name in pending}
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f'  {name}: {e}')
+                    continue
+                Libros.objects.filter(pk__in=pending[name], portada=name).update(portada_derivados=name)
+                done += 1
+                if done % 100 == 0:
+                    self.stdout.write(f'Procesadas {done} portadas...')
+
+        self.stdout.write(self.style.SUCCESS(f'Éxito: {done} portadas procesadas, {failed} con errores.'))
@@ -0,0 +1,88 @@
+import os
+import shutil
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tasks.covers import DERIVED_DIR, derivative_names
+from tasks.models import Libros
+from tasks.storage import content_hash, content_name, is_content_addressed, orphan_covers, recently_used, release_cover
+
+
+class Command(BaseCommand):
+    help = ('Renombra las portadas existentes por el hash de su contenido, unifica los duplicados, actualiza las referencias '
+            'y borra las portadas que ya no usa ningún libro')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Sólo informar cuántos archivos se unificarían')
+
+    def handle(self, *args, **options):
+        media_root = str(settings.MEDIA_ROOT)
+        covers_dir = os.path.join(media_root, 'covers')
+        derived_dir = os.path.join(media_root, DERIVED_DIR)
+
+        # nombre actual -> nombre por contenido (sólo los archivos con nombre antiguo)
+        renames = {}
+        reclaimed = 0
+        for root, dirs, files in os.walk(covers_dir):
+            if os.path.abspath(root) == os.path.abspath(derived_dir):
+                dirs[:] = []
+                continue
+            dirs[:] = [d for d in dirs if os.path.join(root, d) != derived_dir]
+            for filename in files:
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, media_root).replace(os.sep, '/')
+                if is_content_addressed(name):
+                    continue
+                with open(path, 'rb') as f:
+                    target = content_name('covers', content_hash(f), name)
+                if target in renames.values() or os.path.exists(os.path.join(media_root, target)):
+                    reclaimed += os.path.getsize(path)
+                renames[name] = target
+
+        unique = len(set(renames.values()))
+        if options['dry_run']:
+            orphans = [name for name in orphan_covers() if not recently_used(name)]
+            self.stdout.write(self.style.SUCCESS(
+                f'Éxito: {len(renames)} archivos se unificarían en {unique} ({reclaimed / 1024 / 1024:.1f} MB recuperables); '
+                f'{len(orphans)} portadas sin referencias se borrarían.'
+            ))
+            return
+
+        # 1) copiar al nombre por contenido (los originales siguen en su lugar hasta el commit)
+        for name, target in renames.items():
+            target_path = os.path.join(media_root, target)
+            if not os.path.exists(target_path):
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                shutil.copy2(os.path.join(media_root, name), target_path)
+                # conservar los derivados ya generados para el archivo antiguo
+                for old, new in zip(derivative_names(name), derivative_names(target)):
+                    if os.path.exists(os.path.join(media_root, old)):
+                        os.makedirs(os.path.dirname(os.path.join(media_root, new)), exist_ok=True)
+                        shutil.copy2(os.path.join(media_root, old), os.path.join(media_root, new))
+
+        # 2) reescribir las referencias en una sola transacción; update() no cambia la versión del libro
+        updated = 0
+        with transaction.atomic():
+            for name, target in renames.items():
+                has_derived = all(os.path.exists(os.path.join(media_root, d)) for d in derivative_names(target))
+                updated += Libros.objects.filter(portada=name).update(
+                    portada=target, portada_derivados=target if has_derived else ''
+                )
+
+        # 3) borrar los archivos antiguos (ya no los referencia ningún libro)
+        for name in renames:
+            for old in [name] + derivative_names(name):
+                try:
+                    os.remove(os.path.join(media_root, old))
+                except OSError:
+                    pass
+
+        # 4) portadas por contenido que release_cover dejó por estar recién reutilizadas
+        removed = sum(1 for name in orphan_covers() if release_cover(name))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Éxito: {len(renames)} archivos unificados en {unique}; {updated} libros actualizados '
+            f'({reclaimed / 1024 / 1024:.1f} MB recuperados); {removed} portadas sin referencias borradas.'
+        ))
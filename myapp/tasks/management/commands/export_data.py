@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tasks.exports import CHUNK_SIZE, iter_export
+
+
+class Command(BaseCommand):
+    help = 'Exporta el catálogo o el historial de préstamos a CSV o JSON-lines, en flujo'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=['books', 'loans'], help='Qué exportar: libros o préstamos')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+        parser.add_argument('--output', '-o', help='Archivo de salida (por defecto, la salida estándar)')
+        parser.add_argument('--status', help='Sólo préstamos con este estado (active, returned, pending...)')
+        parser.add_argument('--desde', help='Préstamos aprobados desde AAAA-MM-DD')
+        parser.add_argument('--hasta', help='Préstamos aprobados hasta AAAA-MM-DD')
+        parser.add_argument('--activos', action='store_true', help='Sólo libros activos')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Filas leídas por vuelta del cursor')
+
+    def handle(self, *args, **options):
+        params = {
+            'status': options['status'],
+            'desde': options['desde'],
+            'hasta': options['hasta'],
+            'activos': '1' if options['activos'] else '',
+        }
+        chunks = iter_export(options['kind'], options['format'], params, chunk_size=options['chunk_size'])
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        try:
+            out = open(options['output'], mode='w', encoding='utf-8', newline='')
+        except OSError as e:
+            raise CommandError(f'No se puede escribir {options["output"]}: {e}')
+        size = 0
+        with out:
+            for chunk in chunks:
+                out.write(chunk)
+                size += len(chunk)
+        self.stderr.write(self.style.SUCCESS(f'Éxito: exportado a {options["output"]} ({size} caracteres).'))
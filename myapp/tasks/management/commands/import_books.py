@@ -0,0 +1,76 @@
+import csv
+import os
+import time
+from contextlib import ExitStack
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from tasks.importers import BINARY_FORMATS, BookImporter, detect_format, read_rows
+from tasks.marc import read_marc
+
+
+class Command(BaseCommand):
+    help = 'Importa libros al catálogo desde CSV, JSON-lines o MARC21 (ISO 2709 / MARCXML), por lotes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', type=str, help='Ruta al archivo (.csv, .jsonl, .mrc o .xml)')
+        parser.add_argument('--format', choices=['csv', 'jsonl', 'marc', 'marcxml'], help='Formato del archivo (por defecto según la extensión)')
+        parser.add_argument('--user', help='Usuario que figura como creador (por defecto, el primer superusuario)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Filas por lote / transacción')
+        parser.add_argument('--rejects', help='CSV donde escribir las filas rechazadas con su motivo')
+        parser.add_argument('--require-dictionary', action='store_true',
+                            help='Rechazar libros cuya cota no corresponde a un código del diccionario')
+        parser.add_argument('--dry-run', action='store_true', help='Validar sin insertar')
+
+    def handle(self, *args, **options):
+        file_path = options['file']
+        if not os.path.exists(file_path):
+            raise CommandError(f'Archivo no encontrado: {file_path}')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size debe ser mayor que cero')
+
+        User = get_user_model()
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f'Usuario no encontrado: {options["user"]}')
+        else:
+            user = User.objects.filter(is_superuser=True).order_by('id').first()
+            if user is None:
+                raise CommandError('No hay superusuarios; indique --user')
+
+        fmt = detect_format(file_path, options['format'])
+        started = time.monotonic()
+
+        def progress(imp):
+            self.stdout.write(f'Procesadas {imp.processed} filas: {imp.inserted} insertadas, {imp.rejected_count} rechazadas...')
+
+        with ExitStack() as stack:
+            on_reject = None
+            if options['rejects']:
+                out = stack.enter_context(open(options['rejects'], mode='w', encoding='utf-8', newline=''))
+                writer = csv.writer(out)
+                writer.writerow(['linea', 'motivo', 'fila'])
+                on_reject = lambda number, reason, row: writer.writerow([number, reason, row])
+            importer = BookImporter(user, batch_size=options['batch_size'], dry_run=options['dry_run'],
+                                    require_dictionary=options['require_dictionary'], on_reject=on_reject)
+            if fmt in BINARY_FORMATS:
+                f = stack.enter_context(open(file_path, mode='rb'))
+                rows = read_marc(f, fmt)
+            else:
+                f = stack.enter_context(open(file_path, mode='r', encoding='utf-8-sig', newline=''))
+                rows = read_rows(f, fmt)
+            importer.run(rows, progress=progress)
+
+        elapsed = time.monotonic() - started
+        rate = importer.processed / elapsed if elapsed else 0
+        verb = 'se insertarían' if options['dry_run'] else 'se insertaron'
+        self.stdout.write(self.style.SUCCESS(
+            f'Éxito: {verb} {importer.inserted} libros; {importer.rejected_count} filas rechazadas '
+            f'({importer.processed} filas en {elapsed:.1f}s, {rate:.0f} filas/s).'
+        ))
+        for number, reason, _ in importer.rejected[:20]:
+            self.stdout.write(f'  línea {number}: {reason}')
+        if importer.rejected_count > 20:
+            self.stdout.write(f'  ... y {importer.rejected_count - 20} más')
@@ -1,13 +1,16 @@
-import csv
 import os
+import time
 from django.core.management.base import BaseCommand
-from tasks.models import DictionaryEntry
+from tasks.importers import DictionarySync
 
 class Command(BaseCommand):
     help = 'Carga datos desde diccionario.csv a la tabla DictionaryEntry'
 
     def add_arguments(self, parser):
         parser.add_argument('csv_file', type=str, help='Ruta al archivo CSV')
+        parser.add_argument('--dry-run', action='store_true', help='Mostrar las diferencias sin escribir')
+        parser.add_argument('--deactivate-missing', action='store_true',
+                            help='Inhabilitar las entradas que ya no figuran en el archivo')
 
     def handle(self, *args, **options):
         file_path = options['csv_file']
@@ -15,27 +18,25 @@ class Command(BaseCommand):
             self.stderr.write(self.style.ERROR(f'Archivo no encontrado: {file_path}'))
             return
 
-        with open(file_path, mode='r', encoding='utf-8') as f:
-            # Según la previsualización, el delimitador es ';'
-            reader = csv.DictReader(f, delimiter=';')
-            count = 0
-            for row in reader:
-                codigo = row.get('codigo', '').strip()
-                if not codigo:
-                    continue
-                
-                # Crear o actualizar la entrada
-                obj, created = DictionaryEntry.objects.update_or_create(
-                    codigo=codigo,
-                    defaults={
-                        'descripcion': row.get('descripcion', ''),
-                        'descripcion_en': row.get('descripcion_en', ''),
-                        'clasificacion': row.get('clasificacion', ''),
-                        'is_active': True
-                    }
-                )
-                count += 1
-                if count % 500 == 0:
-                    self.stdout.write(f'Procesados {count} registros...')
+        started = time.monotonic()
+        # Según la previsualización, el delimitador es ';'
+        with open(file_path, mode='r', encoding='utf-8-sig', newline='') as f:
+            sync = DictionarySync(deactivate_missing=options['deactivate_missing']).load(f, delimiter=';')
 
-            self.stdout.write(self.style.SUCCESS(f'Éxito: Se cargaron/actualizaron {count} registros en DictionaryEntry.'))
+        summary = (f'{len(sync.inserts)} nuevas, {len(sync.updates)} modificadas, '
+                   f'{len(sync.deactivations)} inhabilitadas, {sync.unchanged} sin cambios')
+        if sync.duplicates:
+            self.stdout.write(self.style.WARNING(f'{sync.duplicates} códigos repetidos en el archivo (se usa la última fila)'))
+
+        if options['dry_run']:
+            for label, entries in (('nueva', sync.inserts), ('modificada', sync.updates), ('inhabilitada', sync.deactivations)):
+                for entry in entries[:20]:
+                    self.stdout.write(f'  {label}: {entry.codigo}')
+                if len(entries) > 20:
+                    self.stdout.write(f'  ... y {len(entries) - 20} {label}s más')
+            self.stdout.write(self.style.SUCCESS(f'Simulación: {sync.rows} registros leídos; {summary}.'))
+            return
+
+        sync.apply()
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f'Éxito: {sync.rows} registros procesados en {elapsed:.1f}s; {summary}.'))
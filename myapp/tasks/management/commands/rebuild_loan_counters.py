@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+
+from tasks.models import Libros, Prestamo
+
+
+class Command(BaseCommand):
+    help = 'Recalcula los contadores en_prestamo/pendientes de Libros a partir de Prestamo (reconciliación).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Sólo informar diferencias, sin guardar cambios.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Libros por lote (cada lote en su propia transacción).')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        batch_size = max(1, options['batch_size'])
+
+        ids = list(Libros.objects.order_by('pk').values_list('pk', flat=True))
+        checked = fixed = 0
+        for start in range(0, len(ids), batch_size):
+            chunk = ids[start:start + batch_size]
+            with transaction.atomic():
+                # bloquear los libros del lote (en orden de pk) para que ningún préstamo cambie mientras recalculamos
+                books = list(Libros.objects.select_for_update().filter(pk__in=chunk).order_by('pk').only('pk', 'cota', 'en_prestamo', 'pendientes'))
+                expected = {}
+                totals = (
+                    Prestamo.objects.filter(book_id__in=chunk, status__in=[Prestamo.STATUS_ACTIVE, Prestamo.STATUS_PENDING])
+                    .values('book_id', 'status')
+                    .annotate(total=Sum('cantidad'))
+                )
+                for row in totals:
+                    active, pending = expected.get(row['book_id'], (0, 0))
+                    if row['status'] == Prestamo.STATUS_ACTIVE:
+                        active = row['total'] or 0
+                    else:
+                        pending = row['total'] or 0
+                    expected[row['book_id']] = (active, pending)
+
+                changed = []
+                for book in books:
+                    checked += 1
+                    active, pending = expected.get(book.pk, (0, 0))
+                    if (book.en_prestamo, book.pendientes) != (active, pending):
+                        self.stdout.write(
+                            f'{book.cota}: en_prestamo {book.en_prestamo} -> {active}, pendientes {book.pendientes} -> {pending}'
+                        )
+                        book.en_prestamo = active
+                        book.pendientes = pending
+                        changed.append(book)
+                if changed and not dry_run:
+                    Libros.objects.bulk_update(changed, ['en_prestamo', 'pendientes'])
+            fixed += len(changed)
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING(f'Dry-run: {fixed} de {checked} libros con contadores desalineados (sin cambios).'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Contadores recalculados: {fixed} de {checked} libros corregidos.'))
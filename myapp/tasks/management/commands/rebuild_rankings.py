@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from tasks.models import BookRanking
+from tasks.ranking import decayed, rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recalcula los puntajes de popularidad y tendencia (BookRanking) desde los totales diarios y los préstamos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=10, help='Libros más populares a mostrar al terminar')
+
+    def handle(self, *args, **options):
+        count = rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Éxito: {count} libros con puntaje.'))
+        top = BookRanking.objects.select_related('book').order_by('-popular')[:max(0, options['top'])]
+        for row in top:
+            score = decayed(row.popular, settings.RANKING_POPULAR_HALF_LIFE_DAYS)
+            self.stdout.write(f'  {score:10.1f}  {row.book.cota}  {row.book.titulo}')
@@ -0,0 +1,39 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from tasks.models import AnalyticsEvent
+from tasks.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recalcula los totales diarios de analítica (AnalyticsDaily / AnalyticsBookDaily) a partir de los eventos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=2, help='Días a recalcular, contando hoy (por defecto ayer y hoy)')
+        parser.add_argument('--since', help='Recalcular desde esta fecha (AAAA-MM-DD) en lugar de --days')
+        parser.add_argument('--all', action='store_true', help='Recalcular desde el primer evento registrado')
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        if options['all']:
+            first = AnalyticsEvent.objects.order_by('timestamp').values_list('timestamp', flat=True).first()
+            if first is None:
+                self.stdout.write(self.style.SUCCESS('Éxito: no hay eventos registrados.'))
+                return
+            since = timezone.localdate(first)
+        elif options['since']:
+            try:
+                since = datetime.date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError(f'Fecha inválida: {options["since"]}')
+        else:
+            if options['days'] < 1:
+                raise CommandError('--days debe ser mayor que cero')
+            since = today - datetime.timedelta(days=options['days'] - 1)
+
+        daily, by_book = rebuild(since, today)
+        self.stdout.write(self.style.SUCCESS(
+            f'Éxito: {daily} totales diarios y {by_book} totales por libro recalculados desde {since:%Y-%m-%d}.'
+        ))
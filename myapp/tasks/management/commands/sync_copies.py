@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from tasks import inventory
+from tasks.models import Ejemplar, Libros
+
+
+class Command(BaseCommand):
+    help = 'Ajusta los ejemplares de cada libro a su cantidad y libera los retenidos por préstamos ya cerrados (reconciliación).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Libros por lote (cada lote en su propia transacción).')
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+
+        # ejemplares prestados cuyo préstamo se devolvió o se eliminó sin pasar por Prestamo.save/delete
+        orphaned = (
+            Ejemplar.objects.filter(estado=Ejemplar.ESTADO_PRESTADO)
+            .filter(Q(prestamo__isnull=True) | ~Q(prestamo__status__in=inventory.HOLDING_STATUSES))
+        )
+        with transaction.atomic():
+            book_ids = list(orphaned.values_list('book_id', flat=True).distinct().order_by())
+            released = orphaned.update(estado=Ejemplar.ESTADO_DISPONIBLE, prestamo=None)
+            inventory.publish(book_ids)
+
+        ids = list(Libros.objects.order_by('pk').values_list('pk', flat=True))
+        created = retired = 0
+        for start in range(0, len(ids), batch_size):
+            with transaction.atomic():
+                new, old = inventory.sync_copies(ids[start:start + batch_size])
+            created += new
+            retired += old
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Ejemplares: {created} creados, {retired} dados de baja, {released} liberados ({len(ids)} libros).'
+        ))
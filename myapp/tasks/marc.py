@@ -0,0 +1,305 @@
+"""Lectura de registros MARC21 (ISO 2709 binario y MARCXML) en flujo.
+
+Los lectores devuelven un registro a la vez y no retienen los anteriores,
+de modo que la memoria no depende del tamaño del archivo: ISO 2709 se lee
+registro por registro con la longitud declarada en la cabecera y MARCXML con
+``iterparse``, limpiando cada ``<record>`` procesado. Los registros ISO 2709
+en MARC-8 se decodifican con ANSEL (latín extendido); los que cambian a otros
+juegos de caracteres se rechazan.
+
+``record_to_row`` traduce un registro a las columnas que entiende
+``importers.row_to_book``; el alta en lotes la hace ``BookImporter``.
+"""
+import re
+import unicodedata
+import xml.etree.ElementTree as ET
+
+from .importers import RowError
+
+LEADER_LENGTH = 24
+RECORD_TERMINATOR = b'\x1d'
+FIELD_TERMINATOR = b'\x1e'
+SUBFIELD_DELIMITER = b'\x1f'
+
+MARCXML_NS = '{http://www.loc.gov/MARC21/slim}'
+
+# MARC-8: G1 por defecto es ANSEL (latín extendido). Caracteres con espacio propio
+ANSEL_SPACING = {
+    0xA1: '\u0141', 0xA2: '\u00d8', 0xA3: '\u0110', 0xA4: '\u00de', 0xA5: '\u00c6', 0xA6: '\u0152',
+    0xA7: '\u02b9', 0xA8: '\u00b7', 0xA9: '\u266d', 0xAA: '\u00ae', 0xAB: '\u00b1', 0xAC: '\u01a0',
+    0xAD: '\u01af', 0xAE: '\u02bc', 0xB0: '\u02bb', 0xB1: '\u0142', 0xB2: '\u00f8', 0xB3: '\u0111',
+    0xB4: '\u00fe', 0xB5: '\u00e6', 0xB6: '\u0153', 0xB7: '\u02ba', 0xB8: '\u0131', 0xB9: '\u00a3',
+    0xBA: '\u00f0', 0xBC: '\u01a1', 0xBD: '\u01b0', 0xC0: '\u00b0', 0xC1: '\u2113', 0xC2: '\u2117',
+    0xC3: '\u00a9', 0xC4: '\u266f', 0xC5: '\u00bf', 0xC6: '\u00a1', 0xC7: '\u00df', 0xC8: '\u20ac',
+}
+# y diacríticos combinantes, que en MARC-8 van ANTES de la letra base (en Unicode, después)
+ANSEL_COMBINING = {
+    0xE0: '\u0309', 0xE1: '\u0300', 0xE2: '\u0301', 0xE3: '\u0302', 0xE4: '\u0303', 0xE5: '\u0304',
+    0xE6: '\u0306', 0xE7: '\u0307', 0xE8: '\u0308', 0xE9: '\u030c', 0xEA: '\u030a', 0xEB: '\ufe20',
+    0xEC: '\ufe21', 0xED: '\u0315', 0xEE: '\u030b', 0xEF: '\u0310', 0xF0: '\u0327', 0xF1: '\u0328',
+    0xF2: '\u0323', 0xF3: '\u0324', 0xF4: '\u0325', 0xF5: '\u0333', 0xF6: '\u0332', 0xF7: '\u0326',
+    0xF8: '\u031c', 0xF9: '\u032e', 0xFA: '\ufe22', 0xFB: '\ufe23', 0xFE: '\u0313',
+}
+ESCAPE = 0x1B
+
+# palabras de 300 $b (otros detalles físicos) -> valores de CONTENT_CHOICES
+CONTENT_KEYWORDS = (
+    ('ilustraciones', ('il', 'ill')),
+    ('mapas', ('map', 'mapa')),
+    ('graficos', ('graf', 'gráf', 'graph', 'chart')),
+    ('tablas', ('tabl', 'tab')),
+    ('retratos', ('retr', 'port')),
+    ('cuadros', ('cuad',)),
+)
+
+
+class MarcRecord:
+    """Registro MARC mínimo: cabecera, campos de control y campos con subcampos."""
+
+    def __init__(self, leader=''):
+        self.leader = leader
+        self.control = {}
+        self.fields = []  # [(tag, [(código, valor), ...]), ...]
+
+    def subfields(self, tag, code):
+        return [value for t, subs in self.fields if t == tag for c, value in subs if c == code]
+
+    def first(self, tags, code):
+        """Primer valor de ``code`` en el primer campo de ``tags`` que lo tenga."""
+        for tag in tags:
+            values = self.subfields(tag, code)
+            if values:
+                return values[0]
+        return ''
+
+
+def _decode_marc8(data):
+    """Decodifica MARC-8 con los juegos por defecto (ASCII + ANSEL) y normaliza a NFC."""
+    chars, marks = [], []
+    for byte in data:
+        if byte == ESCAPE:
+            # cambio a otro juego (griego, cirílico, CJK...): no se interpreta
+            raise RowError('registro MARC-8 con juegos de caracteres no latinos; conviértalo a UTF-8')
+        if byte in ANSEL_COMBINING:
+            marks.append(ANSEL_COMBINING[byte])
+            continue
+        if byte < 0x80:
+            char = chr(byte)
+        else:
+            char = ANSEL_SPACING.get(byte, '\ufffd')
+        chars.append(char + ''.join(marks))
+        marks = []
+    chars.extend(marks)
+    return unicodedata.normalize('NFC', ''.join(chars))
+
+
+def _decode(data, utf8):
+    if utf8:
+        return data.decode('utf-8', errors='replace')
+    # registros marcados como MARC-8 que en realidad vienen en UTF-8 (frecuente en exportaciones)
+    if ESCAPE not in data:
+        try:
+            return data.decode('utf-8')
+        except UnicodeDecodeError:
+            pass
+    return _decode_marc8(data)
+
+
+def parse_iso2709(raw):
+    """Convierte los bytes de un registro ISO 2709 en ``MarcRecord``."""
+    if len(raw) < 25:
+        raise RowError('registro MARC truncado')
+    leader = raw[:24].decode('ascii', errors='replace')
+    try:
+        base = int(leader[12:17])
+    except ValueError:
+        raise RowError('cabecera MARC inválida')
+    utf8 = leader[9] == 'a'
+    record = MarcRecord(leader)
+    directory = raw[24:base - 1]
+    for i in range(0, len(directory) - len(directory) % 12, 12):
+        entry = directory[i:i + 12].decode('ascii', errors='replace')
+        tag, length, start = entry[:3], int(entry[3:7]), int(entry[7:12])
+        data = raw[base + start:base + start + length].rstrip(FIELD_TERMINATOR)
+        if tag < '010':
+            record.control[tag] = _decode(data, utf8)
+            continue
+        subs = []
+        for chunk in data.split(SUBFIELD_DELIMITER)[1:]:
+            if chunk:
+                subs.append((chr(chunk[0]), _decode(chunk[1:], utf8)))
+        record.fields.append((tag, subs))
+    return record
+
+
+def iter_iso2709(fh):
+    """Genera ``(número de registro, MarcRecord o RowError)`` desde un archivo binario.
+
+    Un registro con longitud ilegible, menor que la cabecera o que no termina
+    en el terminador de registro se rechaza y la lectura se resincroniza en el
+    siguiente terminador; uno cortado al final del archivo se rechaza como truncado.
+    """
+    number = 0
+    pending = b''  # bytes leídos de más que pertenecen al registro siguiente
+
+    def read(size):
+        nonlocal pending
+        data, pending = pending[:size], pending[size:]
+        if len(data) < size:
+            data += fh.read(size - len(data))
+        return data
+
+    def push_back(data):
+        nonlocal pending
+        pending = data + pending
+
+    def skip_record():
+        while True:
+            chunk = read(4096)
+            if not chunk:
+                return
+            end = chunk.find(RECORD_TERMINATOR)
+            if end >= 0:
+                push_back(chunk[end + 1:])
+                return
+
+    while True:
+        # algunos exportadores separan los registros con saltos de línea
+        first = read(1)
+        while first in (b'\r', b'\n', b' '):
+            first = read(1)
+        if not first:
+            return
+        head = first + read(4)
+        number += 1
+        try:
+            length = int(head)
+        except ValueError:
+            length = 0
+        if length < LEADER_LENGTH:
+            yield number, RowError(f'longitud de registro MARC inválida ({head.decode("ascii", errors="replace")!r})')
+            if RECORD_TERMINATOR in head:
+                push_back(head[head.index(RECORD_TERMINATOR) + 1:])
+            else:
+                skip_record()
+            continue
+        raw = head + read(length - 5)
+        if len(raw) < length:
+            yield number, RowError(f'registro MARC truncado ({len(raw)} de {length} bytes)')
+            return
+        end = raw.find(RECORD_TERMINATOR)
+        if end != length - 1:
+            yield number, RowError(f'la longitud declarada ({length}) no coincide con el fin del registro')
+            if end >= 0:
+                push_back(raw[end + 1:])
+            else:
+                skip_record()
+            continue
+        try:
+            yield number, parse_iso2709(raw)
+        except (RowError, ValueError) as e:
+            yield number, RowError(str(e) or 'registro MARC inválido')
+
+
+def iter_marcxml(fh):
+    """Genera ``(número de registro, MarcRecord)`` desde MARCXML con ``iterparse``."""
+    number = 0
+    root = None
+    for event, elem in ET.iterparse(fh, events=('start', 'end')):
+        if root is None:
+            root = elem
+        if event != 'end' or elem.tag.replace(MARCXML_NS, '') != 'record':
+            continue
+        number += 1
+        record = MarcRecord()
+        for child in elem:
+            name = child.tag.replace(MARCXML_NS, '')
+            if name == 'leader':
+                record.leader = child.text or ''
+            elif name == 'controlfield':
+                record.control[child.get('tag', '')] = child.text or ''
+            elif name == 'datafield':
+                subs = [(sub.get('code', ''), sub.text or '') for sub in child
+                        if sub.tag.replace(MARCXML_NS, '') == 'subfield']
+                record.fields.append((child.get('tag', ''), subs))
+        yield number, record
+        # liberar el registro ya leído (y su referencia desde la raíz)
+        elem.clear()
+        root.clear()
+
+
+def _clean(value):
+    """Quita la puntuación ISBD final (' /', ' :', ',', '.') y espacios."""
+    return re.sub(r'[\s/:;,.=]+$', '', (value or '').strip()).strip()
+
+
+def _number(value):
+    match = re.search(r'\d+', value or '')
+    return match.group(0) if match else ''
+
+
+def _year(record):
+    year = re.search(r'\d{4}', record.first(('264', '260'), 'c'))
+    if year:
+        return year.group(0)
+    fixed = record.control.get('008', '')
+    return fixed[7:11] if fixed[7:11].isdigit() else ''
+
+
+def call_number(record):
+    """Cota a partir de la signatura NLM (060, o 096 local; 090 como último recurso).
+
+    'WG 200' + '.S5 2010' -> 'WG 200 S 5': clase y número, y la tabla de
+    autor separada en letra y número como en ``TaskForm``.
+    """
+    for tag in ('060', '096', '090'):
+        klass = record.first((tag,), 'a')
+        if not klass:
+            continue
+        parts = klass.split()
+        item = record.first((tag,), 'b')
+        cutter = re.match(r'\.?([A-Za-z]+)\s*(\d+)', item or '')
+        if cutter:
+            parts += [cutter.group(1), cutter.group(2)]
+        elif len(parts) < 3:
+            # algunas bibliotecas ponen toda la signatura en $a ('WG 200 .S5')
+            cutter = re.match(r'(\S+\s+\S+)\s+\.?([A-Za-z]+)\s*(\d+)', klass)
+            if cutter:
+                parts = cutter.group(1).split() + [cutter.group(2), cutter.group(3)]
+        return ' '.join(parts).upper()
+    return ''
+
+
+def _contenido(record):
+    details = record.first(('300',), 'b').lower()
+    words = re.findall(r'[a-záéíóú]+', details)
+    return ','.join(key for key, prefixes in CONTENT_KEYWORDS
+                    if any(w.startswith(prefixes) for w in words))
+
+
+def record_to_row(record):
+    """Columnas de ``row_to_book`` a partir de un registro MARC21 bibliográfico."""
+    autor = record.first(('100', '110', '111'), 'a') or record.first(('245',), 'c')
+    return {
+        'cota': call_number(record),
+        'titulo': _clean(record.first(('245',), 'a')),
+        'subtitulo': _clean(record.first(('245',), 'b')),
+        'autor': _clean(autor),
+        'co_autor': _clean(record.first(('700', '710'), 'a')),
+        'editorial': _clean(record.first(('264', '260'), 'b')),
+        'ubicacion_publicacion': _clean(record.first(('264', '260'), 'a')).strip('[]'),
+        'fecha_publicacion': _year(record),
+        'edicion': _number(record.first(('250',), 'a')),
+        'paginas': _number(record.first(('300',), 'a')),
+        'dimensiones': _clean(record.first(('300',), 'c')),
+        'serie': _clean(record.first(('490', '830'), 'a')),
+        'numero_serie': _number(record.first(('490', '830'), 'v')),
+        'contenido': _contenido(record),
+    }
+
+
+def read_marc(fh, fmt):
+    """Como ``importers.read_rows``, pero desde un archivo MARC abierto en binario."""
+    records = iter_marcxml(fh) if fmt == 'marcxml' else iter_iso2709(fh)
+    for number, record in records:
+        yield number, record if isinstance(record, Exception) else record_to_row(record)
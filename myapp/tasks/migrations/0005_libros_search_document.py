@@ -0,0 +1,79 @@
+import unicodedata
+
+from django.db import migrations, models
+
+# copias de tasks/search.py al momento de esta migración: las migraciones no deben
+# depender de código que puede cambiar después
+SEARCH_DOCUMENT_FIELDS = (
+    'cota', 'titulo', 'subtitulo', 'autor', 'co_autor',
+    'editorial', 'serie', 'contenido', 'numero_registro', 'fecha_publicacion',
+)
+BOOK_VECTOR_SQL = (
+    "(to_tsvector('spanish'::regconfig, search_document) || "
+    "to_tsvector('english'::regconfig, search_document))"
+)
+BOOK_VECTOR_INDEX = 'tasks_libros_search_gin'
+
+
+def normalize_text(value):
+    if value in (None, ''):
+        return ''
+    value = unicodedata.normalize('NFKD', str(value))
+    value = ''.join(ch for ch in value if not unicodedata.combining(ch))
+    return ' '.join(value.lower().split())
+
+
+def build_search_document(book):
+    parts = []
+    for field in SEARCH_DOCUMENT_FIELDS:
+        value = getattr(book, field, None)
+        if value in (None, ''):
+            continue
+        if field == 'contenido':
+            value = str(value).replace(',', ' ')
+        parts.append(normalize_text(value))
+    return ' '.join(p for p in parts if p)
+
+
+def fill_search_document(apps, schema_editor):
+    Libros = apps.get_model('tasks', 'Libros')
+    batch = []
+    for book in Libros.objects.using(schema_editor.connection.alias).iterator(chunk_size=1000):
+        book.search_document = build_search_document(book)
+        batch.append(book)
+        if len(batch) >= 1000:
+            Libros.objects.bulk_update(batch, ['search_document'])
+            batch = []
+    if batch:
+        Libros.objects.bulk_update(batch, ['search_document'])
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        f"CREATE INDEX IF NOT EXISTS {BOOK_VECTOR_INDEX} ON tasks_libros USING gin ({BOOK_VECTOR_SQL})"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f"DROP INDEX IF EXISTS {BOOK_VECTOR_INDEX}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0004_alter_prestamo_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='libros',
+            name='search_document',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='documento de búsqueda'),
+        ),
+        migrations.RunPython(fill_search_document, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,73 @@
+import unicodedata
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+# copias de tasks/search.py al momento de esta migración
+TRIGRAM_FIELDS = ('titulo_norm', 'autores_norm')
+
+
+def normalize_text(value):
+    if value in (None, ''):
+        return ''
+    value = unicodedata.normalize('NFKD', str(value))
+    value = ''.join(ch for ch in value if not unicodedata.combining(ch))
+    return ' '.join(value.lower().split())
+
+
+def build_autores_norm(book):
+    return ' '.join(p for p in (normalize_text(book.autor), normalize_text(book.co_autor)) if p)
+
+
+def fill_normalized_names(apps, schema_editor):
+    Libros = apps.get_model('tasks', 'Libros')
+    batch = []
+    for book in Libros.objects.using(schema_editor.connection.alias).iterator(chunk_size=1000):
+        # NFKD puede alargar el texto: recortar al largo de cada columna
+        book.titulo_norm = normalize_text(book.titulo)[:100].rstrip()
+        book.autores_norm = build_autores_norm(book)[:201].rstrip()
+        batch.append(book)
+        if len(batch) >= 1000:
+            Libros.objects.bulk_update(batch, ['titulo_norm', 'autores_norm'])
+            batch = []
+    if batch:
+        Libros.objects.bulk_update(batch, ['titulo_norm', 'autores_norm'])
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for field in TRIGRAM_FIELDS:
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS tasks_libros_{field}_trgm ON tasks_libros USING gin ({field} gin_trgm_ops)"
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for field in TRIGRAM_FIELDS:
+        schema_editor.execute(f"DROP INDEX IF EXISTS tasks_libros_{field}_trgm")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0005_libros_search_document'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='libros',
+            name='titulo_norm',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='libros',
+            name='autores_norm',
+            field=models.CharField(blank=True, default='', editable=False, max_length=201),
+        ),
+        migrations.RunPython(fill_normalized_names, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def fill_loan_counters(apps, schema_editor):
+    Libros = apps.get_model('tasks', 'Libros')
+    Prestamo = apps.get_model('tasks', 'Prestamo')
+    db = schema_editor.connection.alias
+    totals = (
+        Prestamo.objects.using(db)
+        .filter(status__in=['active', 'pending'])
+        .values('book_id', 'status')
+        .annotate(total=Sum('cantidad'))
+    )
+    for row in totals:
+        field = 'en_prestamo' if row['status'] == 'active' else 'pendientes'
+        Libros.objects.using(db).filter(pk=row['book_id']).update(**{field: row['total'] or 0})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0006_libros_trigram_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='libros',
+            name='en_prestamo',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='en préstamo'),
+        ),
+        migrations.AddField(
+            model_name='libros',
+            name='pendientes',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='pendientes de aprobación'),
+        ),
+        migrations.RunPython(fill_loan_counters, migrations.RunPython.noop),
+    ]
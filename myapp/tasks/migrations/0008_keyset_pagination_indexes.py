@@ -0,0 +1,29 @@
+# Generated by Django 5.2.1 on 2026-10-18 12:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0007_libros_loan_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='libros',
+            index=models.Index(fields=['titulo', 'id'], name='libros_titulo_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='libros',
+            index=models.Index(fields=['autor', 'id'], name='libros_autor_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='libros',
+            index=models.Index(fields=['fecha_publicacion', 'id'], name='libros_fecha_pub_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prestamo',
+            index=models.Index(fields=['status', 'returned_at', 'id'], name='prestamo_status_returned_idx'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+import re
+
+from django.db import migrations, models
+
+# copias de tasks/search.py al momento de esta migración
+DICTIONARY_VECTOR_SQL = (
+    "(to_tsvector('spanish'::regconfig, descripcion) || "
+    "to_tsvector('english'::regconfig, descripcion_en))"
+)
+DICTIONARY_VECTOR_INDEX = 'tasks_dictionaryentry_search_gin'
+
+
+def dictionary_prefix(codigo):
+    match = re.match(r'\s*([A-Za-z]+)', codigo or '')
+    return match.group(1).upper() if match else ''
+
+
+def fill_prefijo(apps, schema_editor):
+    DictionaryEntry = apps.get_model('tasks', 'DictionaryEntry')
+    batch = []
+    for entry in DictionaryEntry.objects.using(schema_editor.connection.alias).only('pk', 'codigo').iterator(chunk_size=1000):
+        entry.prefijo = dictionary_prefix(entry.codigo)
+        batch.append(entry)
+        if len(batch) >= 1000:
+            DictionaryEntry.objects.bulk_update(batch, ['prefijo'])
+            batch = []
+    if batch:
+        DictionaryEntry.objects.bulk_update(batch, ['prefijo'])
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        f"CREATE INDEX IF NOT EXISTS {DICTIONARY_VECTOR_INDEX} ON tasks_dictionaryentry USING gin ({DICTIONARY_VECTOR_SQL})"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f"DROP INDEX IF EXISTS {DICTIONARY_VECTOR_INDEX}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0008_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dictionaryentry',
+            name='prefijo',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=10),
+        ),
+        migrations.RunPython(fill_prefijo, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
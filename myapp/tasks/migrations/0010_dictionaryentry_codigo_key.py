@@ -0,0 +1,35 @@
+from django.db import migrations, models
+
+
+def normalize_code(codigo):
+    # copia de tasks/search.py al momento de esta migración
+    return ' '.join((codigo or '').split()).upper()
+
+
+def fill_codigo_key(apps, schema_editor):
+    DictionaryEntry = apps.get_model('tasks', 'DictionaryEntry')
+    batch = []
+    for entry in DictionaryEntry.objects.using(schema_editor.connection.alias).only('pk', 'codigo').iterator(chunk_size=1000):
+        entry.codigo_key = normalize_code(entry.codigo)
+        batch.append(entry)
+        if len(batch) >= 1000:
+            DictionaryEntry.objects.bulk_update(batch, ['codigo_key'])
+            batch = []
+    if batch:
+        DictionaryEntry.objects.bulk_update(batch, ['codigo_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0009_dictionaryentry_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dictionaryentry',
+            name='codigo_key',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=200),
+        ),
+        migrations.RunPython(fill_codigo_key, migrations.RunPython.noop),
+    ]
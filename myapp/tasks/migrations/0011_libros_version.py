@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0010_dictionaryentry_codigo_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='libros',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='libros',
+            name='fecha_modificacion',
+            field=models.DateTimeField(auto_now=True, blank=True, null=True, verbose_name='fecha de modificación'),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0011_libros_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='libros',
+            name='portada_derivados',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+    ]
@@ -0,0 +1,17 @@
+import tasks.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0012_libros_portada_derivados'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='libros',
+            name='portada',
+            field=models.ImageField(blank=True, help_text='Imagen de portada (opcional)', null=True, storage=tasks.storage.get_cover_storage, upload_to='covers/', verbose_name='portada'),
+        ),
+    ]
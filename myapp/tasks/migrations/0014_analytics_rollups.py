@@ -0,0 +1,60 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+
+def fill_rollups(apps, schema_editor):
+    AnalyticsEvent = apps.get_model('tasks', 'AnalyticsEvent')
+    AnalyticsDaily = apps.get_model('tasks', 'AnalyticsDaily')
+    AnalyticsBookDaily = apps.get_model('tasks', 'AnalyticsBookDaily')
+    db = schema_editor.connection.alias
+    events = AnalyticsEvent.objects.using(db).annotate(day=TruncDate('timestamp'))
+    AnalyticsDaily.objects.using(db).bulk_create([
+        AnalyticsDaily(day=row['day'], event_type=row['event_type'], count=row['n'])
+        for row in events.values('day', 'event_type').annotate(n=Count('id')).order_by()
+    ], batch_size=1000)
+    by_book = (
+        events.filter(event_type__in=['view', 'pdf'], book__isnull=False)
+        .values('day', 'book_id', 'event_type').annotate(n=Count('id')).order_by()
+    )
+    AnalyticsBookDaily.objects.using(db).bulk_create([
+        AnalyticsBookDaily(day=row['day'], book_id=row['book_id'], event_type=row['event_type'], count=row['n'])
+        for row in by_book
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0013_libros_portada_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalyticsDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('event_type', models.CharField(choices=[('view', 'View'), ('add', 'Add'), ('pdf', 'PDF Print'), ('login', 'Login')], max_length=10)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'event_type'), name='analytics_daily_day_type_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='AnalyticsBookDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('event_type', models.CharField(choices=[('view', 'View'), ('add', 'Add'), ('pdf', 'PDF Print'), ('login', 'Login')], max_length=10)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_events', to='tasks.libros')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'book', 'event_type'), name='analytics_book_daily_uniq')],
+            },
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,89 @@
+from django.db import migrations, models
+
+TABLE = 'tasks_analyticsevent'
+# nombres que Django dio a las claves foráneas y sus índices (se conservan)
+FOREIGN_KEYS = [
+    ('book_id', 'tasks_libros', 'tasks_analyticsevent_book_id_ddb0c46c'),
+    ('user_id', 'tasks_user', 'tasks_analyticsevent_user_id_9cac1f66'),
+]
+
+
+def partition_events(apps, schema_editor):
+    """PostgreSQL: reemplaza la tabla por una particionada por mes (ver tasks/partitions.py)."""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {TABLE}_old')
+        # la clave primaria de una tabla particionada debe incluir la columna de partición
+        cursor.execute(
+            f'CREATE TABLE {TABLE} ('
+            'id bigint NOT NULL, event_type varchar(10) NOT NULL, "timestamp" timestamptz NOT NULL, '
+            'user_id bigint NULL, book_id bigint NULL, '
+            f'CONSTRAINT {TABLE}_pkey_ts PRIMARY KEY (id, "timestamp")) PARTITION BY RANGE ("timestamp")'
+        )
+        cursor.execute(f'CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT')
+        # una partición por mes, desde el evento más antiguo hasta dos meses adelante
+        cursor.execute(
+            f"SELECT m::date FROM generate_series("
+            f"date_trunc('month', coalesce((SELECT min(\"timestamp\") FROM {TABLE}_old), now())), "
+            f"date_trunc('month', now()) + interval '2 months', interval '1 month') AS m"
+        )
+        for (month,) in cursor.fetchall():
+            cursor.execute(
+                f"CREATE TABLE {TABLE}_p{month:%Y%m} PARTITION OF {TABLE} "
+                f"FOR VALUES FROM (%s::timestamptz) TO (%s::timestamptz + interval '1 month')",
+                [month.isoformat(), month.isoformat()],
+            )
+        cursor.execute(f'INSERT INTO {TABLE} (id, event_type, "timestamp", user_id, book_id) '
+                       f'SELECT id, event_type, "timestamp", user_id, book_id FROM {TABLE}_old')
+        cursor.execute(f'DROP TABLE {TABLE}_old')
+        # secuencia explícita: las columnas identity en tablas particionadas requieren PostgreSQL 17
+        cursor.execute(f'CREATE SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id')
+        cursor.execute(f"ALTER TABLE {TABLE} ALTER COLUMN id SET DEFAULT nextval('{TABLE}_id_seq')")
+        cursor.execute(f"SELECT setval('{TABLE}_id_seq', coalesce((SELECT max(id) FROM {TABLE}), 0) + 1, false)")
+        for column, target, name in FOREIGN_KEYS:
+            cursor.execute(f'CREATE INDEX {name} ON {TABLE} ({column})')
+            cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {name}_fk_{target}_id FOREIGN KEY ({column}) '
+                           f'REFERENCES {target} (id) DEFERRABLE INITIALLY DEFERRED')
+
+
+def unpartition_events(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {TABLE}_partitioned')
+        cursor.execute(f'ALTER SEQUENCE {TABLE}_id_seq RENAME TO {TABLE}_partitioned_id_seq')
+        for column, target, name in FOREIGN_KEYS:
+            cursor.execute(f'ALTER TABLE {TABLE}_partitioned DROP CONSTRAINT {name}_fk_{target}_id')
+            cursor.execute(f'DROP INDEX {name}')
+        cursor.execute(
+            f'CREATE TABLE {TABLE} (id bigint GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, event_type varchar(10) NOT NULL, '
+            '"timestamp" timestamptz NOT NULL, user_id bigint NULL, book_id bigint NULL)'
+        )
+        cursor.execute(f'INSERT INTO {TABLE} (id, event_type, "timestamp", user_id, book_id) '
+                       f'SELECT id, event_type, "timestamp", user_id, book_id FROM {TABLE}_partitioned')
+        cursor.execute(f'DROP TABLE {TABLE}_partitioned CASCADE')
+        cursor.execute(f"SELECT setval(pg_get_serial_sequence('{TABLE}', 'id'), coalesce((SELECT max(id) FROM {TABLE}), 0) + 1, false)")
+        for column, target, name in FOREIGN_KEYS:
+            cursor.execute(f'CREATE INDEX {name} ON {TABLE} ({column})')
+            cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {name}_fk_{target}_id FOREIGN KEY ({column}) '
+                           f'REFERENCES {target} (id) DEFERRABLE INITIALLY DEFERRED')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0014_analytics_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_events, unpartition_events),
+        migrations.AddIndex(
+            model_name='analyticsevent',
+            index=models.Index(fields=['timestamp'], name='analytics_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='analyticsevent',
+            index=models.Index(fields=['event_type', 'timestamp'], name='analytics_type_ts_idx'),
+        ),
+    ]
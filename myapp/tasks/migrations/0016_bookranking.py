@@ -0,0 +1,23 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0015_analyticsevent_partitioning'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookRanking',
+            fields=[
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ranking', serialize=False, to='tasks.libros')),
+                ('popular', models.FloatField(default=0)),
+                ('trending', models.FloatField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-popular'], name='ranking_popular_idx'), models.Index(fields=['-trending'], name='ranking_trending_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_copies(apps, schema_editor):
+    """Un ejemplar por unidad de ``cantidad``; los préstamos vigentes retienen los primeros."""
+    Libros = apps.get_model('tasks', 'Libros')
+    Prestamo = apps.get_model('tasks', 'Prestamo')
+    Ejemplar = apps.get_model('tasks', 'Ejemplar')
+    db = schema_editor.connection.alias
+    holding = {}
+    loans = (
+        Prestamo.objects.using(db).filter(status__in=['pending', 'active', 'return_pending'])
+        .order_by('book_id', 'pk').values_list('book_id', 'pk', 'cantidad')
+    )
+    for book_id, loan_id, cantidad in loans.iterator(chunk_size=5000):
+        holding.setdefault(book_id, []).extend([loan_id] * int(cantidad or 1))
+    batch = []
+    for book_id, cantidad in Libros.objects.using(db).order_by('pk').values_list('pk', 'cantidad').iterator(chunk_size=5000):
+        held = holding.get(book_id, [])
+        # si hay más ejemplares prestados que ``cantidad`` se crean también (sync_copies da de baja los sobrantes)
+        for n in range(1, max(int(cantidad or 0), len(held)) + 1):
+            loan_id = held[n - 1] if n <= len(held) else None
+            batch.append(Ejemplar(
+                book_id=book_id, codigo_barras=f'{book_id:06d}-{n:03d}', prestamo_id=loan_id,
+                estado='prestado' if loan_id else 'disponible',
+            ))
+        if len(batch) >= 5000:
+            Ejemplar.objects.using(db).bulk_create(batch)
+            batch = []
+    Ejemplar.objects.using(db).bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0016_bookranking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Ejemplar',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('codigo_barras', models.CharField(max_length=32, unique=True, verbose_name='código de barras')),
+                ('estado', models.CharField(choices=[('disponible', 'Disponible'), ('prestado', 'Prestado'), ('baja', 'De baja')], default='disponible', max_length=20)),
+                ('condicion', models.CharField(choices=[('bueno', 'Bueno'), ('regular', 'Regular'), ('deteriorado', 'Deteriorado')], default='bueno', max_length=20, verbose_name='condición')),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ejemplares', to='tasks.libros')),
+                ('prestamo', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ejemplares', to='tasks.prestamo')),
+            ],
+            options={
+                'verbose_name_plural': 'ejemplares',
+                'indexes': [models.Index(condition=models.Q(('estado', 'disponible')), fields=['book'], name='ejemplar_libre_idx')],
+            },
+        ),
+        migrations.RunPython(fill_copies, migrations.RunPython.noop),
+    ]
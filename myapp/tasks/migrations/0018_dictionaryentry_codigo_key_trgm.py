@@ -0,0 +1,28 @@
+from django.db import migrations
+
+CODE_TRIGRAM_INDEX = 'tasks_dictionaryentry_codigo_key_trgm'
+
+
+def create_code_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        f"CREATE INDEX IF NOT EXISTS {CODE_TRIGRAM_INDEX} ON tasks_dictionaryentry USING gin (codigo_key gin_trgm_ops)"
+    )
+
+
+def drop_code_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f"DROP INDEX IF EXISTS {CODE_TRIGRAM_INDEX}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0017_ejemplar'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_code_trigram_index, drop_code_trigram_index),
+    ]
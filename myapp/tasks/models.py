@@ -1,8 +1,14 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
 from django.contrib.auth.models import AbstractUser, UserManager
 from django.conf import settings
 from django.contrib.auth.hashers import make_password, check_password
 from django.utils import timezone
+from . import covers
+from .resolver import classification_map
+from .storage import get_cover_storage, release_cover
+from .search import build_autores_norm, build_search_document, dictionary_prefix, normalize_code, normalize_text
 
 #crear superusuario
 
@@ -100,6 +106,9 @@ class Libros(models.Model):
     paginas = models.IntegerField(null=True, blank=True)
     # cantidad disponible en stock
     cantidad = models.PositiveIntegerField("cantidad", default=1, help_text="Cantidad disponible en el inventario")
+    # contadores desnormalizados de préstamos (los mantiene Prestamo.save/delete; ver rebuild_loan_counters)
+    en_prestamo = models.PositiveIntegerField("en préstamo", default=0, editable=False)
+    pendientes = models.PositiveIntegerField("pendientes de aprobación", default=0, editable=False)
     serie = models.CharField(max_length=100, null=True, blank=True)
     numero_serie = models.IntegerField(null=True, blank=True)
     # datos_control eliminado
@@ -109,7 +118,8 @@ class Libros(models.Model):
     fecha_creacion = models.DateField("fecha de creación", auto_now_add=True, null=True, blank=True)
     hora_creacion = models.TimeField("hora de creación", auto_now_add=True, null=True, blank=True)
     dimensiones = models.CharField(max_length=100, null=True, blank=True)
-    portada = models.ImageField("portada", upload_to='covers/', null=True, blank=True, help_text="Imagen de portada (opcional)")
+    # archivos nombrados por su hash: las subidas repetidas reutilizan el mismo archivo (ver storage.py)
+    portada = models.ImageField("portada", upload_to='covers/', storage=get_cover_storage, null=True, blank=True, help_text="Imagen de portada (opcional)")
     contenido = models.CharField("contenido del libro", max_length=200, null=True, blank=True,
                                 help_text="Seleccione los contenidos (guardado como valores separados por comas)")
 
@@ -122,77 +132,135 @@ class Libros(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING)
     # permitir inhabilitar libro sin borrar
     is_active = models.BooleanField('activo', default=True, help_text='Desmarcar para inhabilitar este libro sin borrarlo')
+    # documento normalizado (sin acentos, minúsculas) para la búsqueda de texto completo
+    search_document = models.TextField('documento de búsqueda', blank=True, default='', editable=False)
+    # título y autores normalizados para la búsqueda aproximada por trigramas
+    titulo_norm = models.CharField(max_length=100, blank=True, default='', editable=False)
+    autores_norm = models.CharField(max_length=201, blank=True, default='', editable=False)
+    # versión del contenido: sube en cada save() (clave de la ficha PDF cacheada, ver cards.py)
+    version = models.PositiveIntegerField(default=1, editable=False)
+    fecha_modificacion = models.DateTimeField('fecha de modificación', auto_now=True, null=True, blank=True)
+    # nombre de la portada para la que existen derivados (miniaturas/WebP, ver covers.py)
+    portada_derivados = models.CharField(max_length=100, blank=True, default='', editable=False)
     
+    class Meta:
+        # índices (columna de orden, id) para la paginación por cursor del catálogo
+        indexes = [
+            models.Index(fields=['titulo', 'id'], name='libros_titulo_id_idx'),
+            models.Index(fields=['autor', 'id'], name='libros_autor_id_idx'),
+            models.Index(fields=['fecha_publicacion', 'id'], name='libros_fecha_pub_id_idx'),
+        ]
+
+    # campos que sólo se modifican con UPDATE atómicos (F()), nunca desde un save() completo
+    COUNTER_FIELDS = ('en_prestamo', 'pendientes')
+    # campos calculados en save() (y en set_derived_fields para bulk_create)
+    DERIVED_FIELDS = ('search_document', 'titulo_norm', 'autores_norm')
+
     def __str__(self):
         return f"{self.cota} - {self.titulo} ({self.edicion}ª ed.) por {self.autor} ({self.fecha_publicacion})"
 
+    @classmethod
+    def adjust_loan_counters(cls, book_id, en_prestamo=0, pendientes=0, using=None):
+        """Suma (o resta) a los contadores del libro con un UPDATE atómico."""
+        if book_id:
+            cls.adjust_loan_counters_many([book_id], en_prestamo, pendientes, using=using)
+
+    @classmethod
+    def adjust_loan_counters_many(cls, book_ids, en_prestamo=0, pendientes=0, using=None):
+        """Igual que ``adjust_loan_counters`` para varios libros, con un solo UPDATE."""
+        changes = {}
+        if en_prestamo:
+            changes['en_prestamo'] = Greatest(F('en_prestamo') + en_prestamo, Value(0))
+        if pendientes:
+            changes['pendientes'] = Greatest(F('pendientes') + pendientes, Value(0))
+        book_ids = [pk for pk in book_ids if pk]
+        if book_ids and changes:
+            cls.objects.using(using).filter(pk__in=book_ids).update(**changes)
+
+    def set_derived_fields(self):
+        """Documento de búsqueda y nombres normalizados (save() lo hace solo; bulk_create no)."""
+        self.search_document = build_search_document(self)
+        self.titulo_norm = normalize_text(self.titulo, self._meta.get_field('titulo_norm').max_length)
+        self.autores_norm = build_autores_norm(self, self._meta.get_field('autores_norm').max_length)
+
     # Normalizar cota a mayúsculas siempre antes de guardar
     def save(self, *args, **kwargs):
         if self.cota:
             self.cota = self.cota.upper()
         # Si existe una entrada del diccionario vinculada, sincronizar la Clasificacion
+        # (mapa en memoria de clasificaciones; ver resolver.ClassificationMap)
         try:
-            if getattr(self, 'dictionary_entry', None):
-                # la entrada del diccionario puede ser un objeto o un id; intentar obtener el objeto
-                de = self.dictionary_entry
-                # si es un id (int), intentar obtener el objeto
-                from django.core.exceptions import ObjectDoesNotExist
-                if not hasattr(de, 'codigo'):
-                    try:
-                        de = DictionaryEntry.objects.get(pk=de)
-                    except Exception:
-                        de = None
-                if de:
-                    # Preferir derivar el prefijo (code) desde el campo 'codigo' del diccionario,
-                    # p.ej. 'WG 123' -> 'WG', o 'W 123' -> 'W'. Esto es más fiable que parsear
-                    # el campo 'clasificacion' libre que puede tener formatos variados.
-                    code = None
-                    label_value = None
-                    try:
-                        codigo_field = (de.codigo or '').strip()
-                        if codigo_field:
-                            code = codigo_field.split(None, 1)[0].upper()
-                    except Exception:
-                        code = None
-
-                    # Si no pudimos obtener code desde codigo_field, usar el campo clasificacion como fallback
-                    clas_label = (de.clasificacion or '').strip()
-                    if not code and clas_label:
-                        try:
-                            code = clas_label.split('-', 1)[0].strip()
-                        except Exception:
-                            try:
-                                code = clas_label.split()[0].strip()
-                            except Exception:
-                                code = None
-
-                    # Determinar label legible para la clasificación: preferir la parte derecha después de '-' en clas_label
-                    if clas_label and '-' in clas_label:
-                        label_value = clas_label.split('-', 1)[1].strip()
-                    elif clas_label:
-                        label_value = clas_label
-                    else:
-                        # si no hay label en el campo, intentar inferir algo del codigo (se puede mejorar)
-                        label_value = ''
-
-                    from .models import Clasificacion as _Clasificacion
-                    if code:
-                        clas_obj, _ = _Clasificacion.objects.get_or_create(code=code, defaults={'label': label_value})
-                        # Si existe pero no tiene label y tenemos label_value, actualizarlo
-                        try:
-                            if (not getattr(clas_obj, 'label', None)) and label_value:
-                                clas_obj.label = label_value
-                                clas_obj.save(update_fields=['label'])
-                        except Exception:
-                            pass
-                        # asignar sólo si distinto
-                        if self.classification_id != getattr(clas_obj, 'id', None):
-                            self.classification = clas_obj
+            classification_map.assign([self])
         except Exception:
             # no interrumpir el guardado por fallos en sincronización
             pass
 
+        # un save() completo no debe pisar los contadores (ni portada_derivados, que se
+        # actualiza tras el commit) con valores leídos antes
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.COUNTER_FIELDS + ('portada_derivados',)
+            ]
+
+        self.set_derived_fields()
+        adding = self._state.adding
+        if not adding:
+            # incremento en la base de datos: dos instancias cargadas a la vez no repiten versión
+            self.version = F('version') + 1
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            extra = self.DERIVED_FIELDS + ('version', 'fecha_modificacion')
+            kwargs['update_fields'] = list(update_fields) + [f for f in extra if f not in update_fields]
+
         super().save(*args, **kwargs)
+        if not adding:
+            self.refresh_from_db(fields=['version'])
+
+        # portada nueva o borrada: generar los derivados y liberar la anterior al confirmar la transacción
+        name = self.portada.name if self.portada else ''
+        if name != self.portada_derivados:
+            book_id = self.pk
+            transaction.on_commit(lambda: covers.refresh_derivatives(book_id, name), using=self._state.db)
+        previous = getattr(self, '_loaded_portada', '')
+        if previous and previous != name:
+            transaction.on_commit(lambda: release_cover(previous), using=self._state.db)
+        self._loaded_portada = name
+
+        # un ejemplar por unidad de ``cantidad``, ajustados al confirmar (ver inventory.py;
+        # si fallara, ``sync_copies`` los reconcilia)
+        if adding or ((update_fields is None or 'cantidad' in update_fields)
+                      and self.cantidad != getattr(self, '_loaded_cantidad', None)):
+            from . import inventory
+            book_id, using = self.pk, self._state.db
+            transaction.on_commit(lambda: inventory.sync_copies([book_id], using=using), using=using, robust=True)
+        self._loaded_cantidad = self.cantidad
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # recordar la portada cargada para liberar el archivo si se reemplaza
+        if 'portada' in field_names:
+            instance._loaded_portada = values[field_names.index('portada')] or ''
+        if 'cantidad' in field_names:
+            instance._loaded_cantidad = values[field_names.index('cantidad')]
+        return instance
+
+    @property
+    def portada_thumb_url(self):
+        return covers.cover_url(self, 'thumb')
+
+    @property
+    def portada_thumb_webp_url(self):
+        return covers.cover_url(self, 'thumb', 'webp')
+
+    @property
+    def portada_detail_url(self):
+        return covers.cover_url(self, 'detail')
+
+    @property
+    def portada_detail_webp_url(self):
+        return covers.cover_url(self, 'detail', 'webp')
 
     @property
     def descripcion(self):
@@ -219,9 +287,64 @@ class AnalyticsEvent(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
     timestamp = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        # en PostgreSQL la tabla está particionada por mes de timestamp (ver partitions.py)
+        indexes = [
+            models.Index(fields=['timestamp'], name='analytics_timestamp_idx'),
+            models.Index(fields=['event_type', 'timestamp'], name='analytics_type_ts_idx'),
+        ]
+
     def __str__(self):
         return f"{self.get_event_type_display()} - {self.book_id or '-'} - {self.user_id or '-'} @ {self.timestamp}"
 
+
+# Totales diarios de AnalyticsEvent (ver rollups.py): el panel sólo lee estas tablas
+class AnalyticsDaily(models.Model):
+    day = models.DateField()
+    event_type = models.CharField(max_length=10, choices=AnalyticsEvent.EVENT_CHOICES)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'event_type'], name='analytics_daily_day_type_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.event_type}: {self.count}"
+
+
+class AnalyticsBookDaily(models.Model):
+    # sólo consultas y fichas PDF (BOOK_EVENTS): los eventos con libro que interesa ordenar
+    day = models.DateField()
+    book = models.ForeignKey('Libros', on_delete=models.CASCADE, related_name='daily_events')
+    event_type = models.CharField(max_length=10, choices=AnalyticsEvent.EVENT_CHOICES)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'book', 'event_type'], name='analytics_book_daily_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.book_id} {self.event_type}: {self.count}"
+
+
+# Puntajes de popularidad con decaimiento exponencial (ver ranking.py). Tabla aparte: una visita
+# no reescribe la fila de Libros ni sus índices de búsqueda.
+class BookRanking(models.Model):
+    book = models.OneToOneField('Libros', primary_key=True, on_delete=models.CASCADE, related_name='ranking')
+    popular = models.FloatField(default=0)
+    trending = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-popular'], name='ranking_popular_idx'),
+            models.Index(fields=['-trending'], name='ranking_trending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.book_id}: {self.popular:.3g} / {self.trending:.3g}"
+
 class UserSecurity(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='security')
     question = models.CharField(max_length=255)
@@ -267,9 +390,127 @@ class Prestamo(models.Model):
     return_book_rating = models.PositiveSmallIntegerField('puntuación libro', null=True, blank=True)
     return_receiver_rating = models.PositiveSmallIntegerField('puntuación receptor', null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # historial de devoluciones paginado por (returned_at, id)
+            models.Index(fields=['status', 'returned_at', 'id'], name='prestamo_status_returned_idx'),
+        ]
+
     def __str__(self):
         return f"Prestamo {self.book_id} x{self.cantidad} ({self.status}) by {self.user_id or '-'}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # recordar el estado cargado para calcular la variación de los contadores del libro
+        if all(f in field_names for f in ('book_id', 'status', 'cantidad')):
+            instance._counted_state = instance._counter_state()
+        return instance
+
+    def _counter_state(self):
+        """(book_id, ejemplares activos, ejemplares pendientes) que aporta este préstamo."""
+        cantidad = int(self.cantidad or 0)
+        if self.status == self.STATUS_ACTIVE:
+            return (self.book_id, cantidad, 0)
+        if self.status == self.STATUS_PENDING:
+            return (self.book_id, 0, cantidad)
+        return (self.book_id, 0, 0)
+
+    def _previous_counter_state(self, using):
+        if self._state.adding or self.pk is None:
+            return (None, 0, 0)
+        state = getattr(self, '_counted_state', None)
+        if state is None:
+            row = Prestamo.objects.using(using).filter(pk=self.pk).values('book_id', 'status', 'cantidad').first()
+            if not row:
+                return (None, 0, 0)
+            state = Prestamo(book_id=row['book_id'], status=row['status'], cantidad=row['cantidad'])._counter_state()
+        return state
+
+    @staticmethod
+    def _apply_counter_change(before, after, using):
+        if before[0] == after[0]:
+            Libros.adjust_loan_counters(after[0], after[1] - before[1], after[2] - before[2], using=using)
+        else:
+            Libros.adjust_loan_counters(before[0], -before[1], -before[2], using=using)
+            Libros.adjust_loan_counters(after[0], after[1], after[2], using=using)
+
+    def _sync_copies(self, adding, previous_book_id, using):
+        """Retiene ejemplares al crear el préstamo y los libera al devolverlo (ver inventory.py)."""
+        from . import inventory
+        holds = self.status in inventory.HOLDING_STATUSES
+        moved = not adding and previous_book_id and previous_book_id != self.book_id
+        if not holds or moved:
+            inventory.release([self.pk], using=using)
+        if holds and (adding or moved):
+            # si no quedan ejemplares libres el préstamo se registra igual (alta manual)
+            copies = inventory.claim(self.book_id, int(self.cantidad or 1), using=using)
+            inventory.assign({copy_id: self.pk for copy_id in copies}, using=using)
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or self._state.db or 'default'
+        adding = self._state.adding
+        with transaction.atomic(using=using):
+            before = self._previous_counter_state(using)
+            super().save(*args, **kwargs)
+            after = self._counter_state()
+            self._apply_counter_change(before, after, using)
+            self._sync_copies(adding, before[0], using)
+            if adding:
+                # puntaje de popularidad fuera de la transacción que bloquea el libro
+                from .ranking import add_loans
+                counts = {self.book_id: int(self.cantidad or 1)}
+                transaction.on_commit(lambda: add_loans(counts), using=using, robust=True)
+        self._counted_state = after
+
+    def delete(self, *args, **kwargs):
+        using = kwargs.get('using') or self._state.db or 'default'
+        with transaction.atomic(using=using):
+            before = self._previous_counter_state(using)
+            from . import inventory
+            inventory.release([self.pk], using=using)
+            result = super().delete(*args, **kwargs)
+            self._apply_counter_change(before, (before[0], 0, 0), using)
+        self._counted_state = None
+        return result
+
+
+class Ejemplar(models.Model):
+    """Copia física de un libro; cada préstamo retiene los ejemplares que entregó (ver inventory.py)."""
+    ESTADO_DISPONIBLE = 'disponible'
+    ESTADO_PRESTADO = 'prestado'
+    ESTADO_BAJA = 'baja'
+    ESTADO_CHOICES = [
+        (ESTADO_DISPONIBLE, 'Disponible'),
+        (ESTADO_PRESTADO, 'Prestado'),
+        (ESTADO_BAJA, 'De baja'),
+    ]
+    CONDICION_BUENO = 'bueno'
+    CONDICION_REGULAR = 'regular'
+    CONDICION_DETERIORADO = 'deteriorado'
+    CONDICION_CHOICES = [
+        (CONDICION_BUENO, 'Bueno'),
+        (CONDICION_REGULAR, 'Regular'),
+        (CONDICION_DETERIORADO, 'Deteriorado'),
+    ]
+
+    book = models.ForeignKey('Libros', on_delete=models.CASCADE, related_name='ejemplares')
+    codigo_barras = models.CharField('código de barras', max_length=32, unique=True)
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default=ESTADO_DISPONIBLE)
+    condicion = models.CharField('condición', max_length=20, choices=CONDICION_CHOICES, default=CONDICION_BUENO)
+    # préstamo que tiene el ejemplar (pendiente, activo o con devolución sin confirmar)
+    prestamo = models.ForeignKey('Prestamo', null=True, blank=True, on_delete=models.SET_NULL, related_name='ejemplares')
+
+    class Meta:
+        verbose_name_plural = 'ejemplares'
+        indexes = [
+            # ejemplares libres por libro: la disponibilidad es un conteo sobre este índice parcial
+            models.Index(fields=['book'], condition=models.Q(estado='disponible'), name='ejemplar_libre_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.codigo_barras} ({self.get_estado_display()})"
+
 
 # Entradas del diccionario importadas desde CSV
 class DictionaryEntry(models.Model):
@@ -280,9 +521,22 @@ class DictionaryEntry(models.Model):
     clasificacion = models.CharField(max_length=200, blank=True)
     # permitir inhabilitar entrada del diccionario
     is_active = models.BooleanField('activo', default=True, help_text='Desmarcar para inhabilitar esta entrada del diccionario')
+    # letras iniciales del código ('QS', 'W'...), indexadas para el filtro por clasificación
+    prefijo = models.CharField(max_length=10, blank=True, default='', db_index=True, editable=False)
+    # código normalizado (mayúsculas, espacios colapsados) para búsquedas exactas y por prefijo con índice
+    codigo_key = models.CharField(max_length=200, blank=True, default='', db_index=True, editable=False)
 
     class Meta:
         ordering = ['codigo']
 
     def __str__(self):
-        return self.codigo
\ No newline at end of file
+        return self.codigo
+
+    def save(self, *args, **kwargs):
+        self.prefijo = dictionary_prefix(self.codigo)
+        self.codigo_key = normalize_code(self.codigo)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'codigo' in update_fields:
+            derived = ['prefijo', 'codigo_key']
+            kwargs['update_fields'] = list(update_fields) + [f for f in derived if f not in update_fields]
+        super().save(*args, **kwargs)
\ No newline at end of file
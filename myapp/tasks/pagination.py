@@ -0,0 +1,204 @@
+"""Paginación por cursor (keyset / seek) para listados grandes.
+
+En lugar de ``COUNT(*)`` + ``OFFSET n`` se filtra por la posición del último
+(o primer) registro mostrado según las columnas de orden más ``id``. El costo
+de cada página es el mismo sin importar cuán profunda sea.
+
+Los NULL se ordenan siempre al final (en ambos sentidos), de modo que las
+columnas opcionales (``fecha_publicacion``, ``returned_at``) también sirven
+como clave.
+"""
+import base64
+import datetime
+import json
+
+from django.core.paginator import Paginator
+from django.db.models import F, Q
+
+DIRECTION_NEXT = 'n'
+DIRECTION_PREV = 'p'
+
+
+def _encode_value(value):
+    # isoformat conserva los microsegundos (DjangoJSONEncoder los trunca a milisegundos)
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+def encode_cursor(values, direction):
+    payload = json.dumps({'v': [_encode_value(v) for v in values], 'd': direction}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Devuelve ``(valores, dirección)`` o ``None`` si el token no es válido."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        values, direction = data['v'], data['d']
+    except Exception:
+        return None
+    if not isinstance(values, list) or direction not in (DIRECTION_NEXT, DIRECTION_PREV):
+        return None
+    return values, direction
+
+
+class KeysetPage:
+    """Página obtenida por cursor; no conoce el total ni su número de página."""
+    keyset = True
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+class KeysetPaginator:
+    """Pagina ``queryset`` por las columnas ``ordering`` (p. ej. ``['-returned_at', '-id']``).
+
+    Si la última clave no es ``id``/``pk`` se agrega automáticamente como
+    desempate, en el mismo sentido que la primera clave.
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        keys = []
+        for item in ordering:
+            descending = item.startswith('-')
+            name = item.lstrip('-')
+            keys.append((name, descending))
+        if not keys or keys[-1][0] not in ('id', 'pk'):
+            keys.append(('id', keys[0][1] if keys else False))
+        self.keys = keys
+        self.per_page = per_page
+        self.queryset = queryset
+
+    def _nullable(self, name):
+        try:
+            return self.queryset.model._meta.get_field(name).null
+        except Exception:
+            return True
+
+    def _order_expressions(self, reverse=False):
+        exprs = []
+        # NULL al final en el sentido normal; al recorrer hacia atrás, al principio
+        nulls = {'nulls_first': True} if reverse else {'nulls_last': True}
+        for name, descending in self.keys:
+            if descending != reverse:
+                exprs.append(F(name).desc(**nulls))
+            else:
+                exprs.append(F(name).asc(**nulls))
+        return exprs
+
+    def ordered(self):
+        """El queryset con el orden de las claves (útil para la paginación por OFFSET)."""
+        return self.queryset.order_by(*self._order_expressions())
+
+    def _beyond(self, name, descending, value, forward):
+        """Q de las filas estrictamente posteriores (o anteriores) a ``value`` en una clave."""
+        nullable = self._nullable(name)
+        if forward:
+            if value is None:
+                return None  # los NULL van al final: no hay nada después en esta clave
+            q = Q(**{f'{name}__{"lt" if descending else "gt"}': value})
+            if nullable:
+                q |= Q(**{f'{name}__isnull': True})
+            return q
+        if value is None:
+            return Q(**{f'{name}__isnull': False})
+        return Q(**{f'{name}__{"gt" if descending else "lt"}': value})
+
+    def _seek_filter(self, values, forward):
+        condition = None
+        equal = Q()
+        for (name, descending), value in zip(self.keys, values):
+            beyond = self._beyond(name, descending, value, forward)
+            if beyond is not None:
+                term = equal & beyond
+                condition = term if condition is None else condition | term
+            equal &= Q(**{f'{name}__isnull': True}) if value is None else Q(**{name: value})
+        # cota redundante sobre la primera clave para que el motor pueda usar el índice
+        name, descending = self.keys[0]
+        first = values[0]
+        if first is None:
+            bound = Q(**{f'{name}__isnull': True}) if forward else Q()
+        else:
+            op = ('lte' if descending else 'gte') if forward else ('gte' if descending else 'lte')
+            bound = Q(**{f'{name}__{op}': first})
+            if forward and self._nullable(name):
+                bound |= Q(**{f'{name}__isnull': True})
+        if condition is None:
+            return Q(pk__in=[])
+        return bound & condition
+
+    def values_for(self, obj):
+        return [getattr(obj, name) for name, _ in self.keys]
+
+    def cursor_after(self, obj):
+        return encode_cursor(self.values_for(obj), DIRECTION_NEXT)
+
+    def cursor_before(self, obj):
+        return encode_cursor(self.values_for(obj), DIRECTION_PREV)
+
+    def get_page(self, cursor=None):
+        decoded = decode_cursor(cursor) if cursor else None
+        if decoded and len(decoded[0]) != len(self.keys):
+            decoded = None
+        if decoded is None:
+            rows = list(self.ordered()[:self.per_page + 1])
+            more = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            return KeysetPage(rows, self.cursor_after(rows[-1]) if more else None, None)
+
+        values, direction = decoded
+        forward = direction == DIRECTION_NEXT
+        qs = self.queryset.filter(self._seek_filter(values, forward))
+        qs = qs.order_by(*self._order_expressions(reverse=not forward))
+        rows = list(qs[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+        if not rows:
+            return KeysetPage([])
+        if forward:
+            return KeysetPage(rows, self.cursor_after(rows[-1]) if more else None, self.cursor_before(rows[0]))
+        return KeysetPage(rows, self.cursor_after(rows[-1]), self.cursor_before(rows[0]) if more else None)
+
+
+def paginate(request, queryset, ordering, per_page, keyset=True):
+    """Pagina según la petición: por keyset (la primera página y ``?cursor=``) o con ``Paginator``.
+
+    Con ``keyset`` sólo un ``?page=n`` explícito (enlaces anteriores) usa
+    ``Paginator`` (``COUNT`` + ``OFFSET``); las páginas por cursor no muestran el
+    total. La página por OFFSET también expone ``next_cursor`` para que la
+    plantilla ofrezca "Cargar más" sin volver a contar ni desplazar.
+    """
+    paginator = KeysetPaginator(queryset, ordering, per_page)
+    cursor = request.GET.get('cursor', '').strip()
+    if keyset and (cursor or not request.GET.get('page')):
+        return paginator.get_page(cursor or None)
+    page_obj = Paginator(paginator.ordered(), per_page).get_page(request.GET.get('page'))
+    page_obj.keyset = False
+    page_obj.next_cursor = None
+    if keyset and page_obj.has_next():
+        rows = list(page_obj.object_list)
+        page_obj.object_list = rows
+        if rows:
+            page_obj.next_cursor = paginator.cursor_after(rows[-1])
+    return page_obj
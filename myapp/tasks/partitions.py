@@ -0,0 +1,177 @@
+"""Particiones mensuales de ``AnalyticsEvent`` y archivo de los meses cerrados.
+
+En PostgreSQL la tabla está particionada por rango de ``timestamp`` (migración
+0015): una partición ``tasks_analyticsevent_pAAAAMM`` por mes y una
+``_default`` que recibe lo que no tiene partición todavía. Las consultas con
+filtro de fecha sólo leen las particiones del rango, y archivar un mes es
+exportar su partición y hacer ``DROP TABLE`` (sin DELETE masivo ni VACUUM).
+
+En otros motores la tabla no se particiona: el archivo exporta el mes y lo
+borra con un solo DELETE por rango (índice sobre ``timestamp``).
+
+Los totales del panel (``rollups.py``) no dependen de los eventos crudos, de
+modo que archivar no cambia el historial del panel.
+"""
+import datetime
+import gzip
+import json
+import os
+import tempfile
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import AnalyticsEvent
+
+PARENT = AnalyticsEvent._meta.db_table
+DEFAULT_PARTITION = f'{PARENT}_default'
+ARCHIVE_COLUMNS = ['id', 'event_type', 'book_id', 'user_id', 'timestamp']
+
+
+def month_start(value):
+    return value.replace(day=1)
+
+
+def add_months(month, n):
+    index = month.year * 12 + month.month - 1 + n
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def month_bounds(month):
+    """Límites [inicio, fin) del mes como datetimes con zona horaria."""
+    start = timezone.make_aware(datetime.datetime.combine(month, datetime.time.min))
+    end = timezone.make_aware(datetime.datetime.combine(add_months(month, 1), datetime.time.min))
+    return start, end
+
+
+def partition_name(month):
+    return f'{PARENT}_p{month:%Y%m}'
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [PARENT])
+        row = cursor.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def existing_partitions():
+    """``{mes: nombre}`` de las particiones mensuales existentes."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(%s)", [PARENT]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    prefix = f'{PARENT}_p'
+    result = {}
+    for name in names:
+        if name.startswith(prefix):
+            suffix = name[len(prefix):]
+            result[datetime.date(int(suffix[:4]), int(suffix[4:6]), 1)] = name
+    return result
+
+
+def ensure_partition(month):
+    """Crea la partición del mes (moviendo sus filas desde ``_default``). Devuelve si se creó."""
+    if month in existing_partitions():
+        return False
+    name = partition_name(month)
+    start, end = month_bounds(month)
+    qn = connection.ops.quote_name
+    with transaction.atomic(), connection.cursor() as cursor:
+        # se crea suelta y se adjunta: ATTACH falla si _default aún tiene filas del rango
+        cursor.execute(f'CREATE TABLE {qn(name)} (LIKE {qn(PARENT)} INCLUDING DEFAULTS)')
+        cursor.execute(
+            f'WITH moved AS (DELETE FROM {qn(DEFAULT_PARTITION)} WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING *) '
+            f'INSERT INTO {qn(name)} SELECT * FROM moved', [start, end]
+        )
+        cursor.execute(f'ALTER TABLE {qn(PARENT)} ATTACH PARTITION {qn(name)} FOR VALUES FROM (%s) TO (%s)', [start, end])
+    return True
+
+
+def ensure_partitions(ahead=2, today=None):
+    """Particiones del mes en curso y de los ``ahead`` siguientes."""
+    if not is_partitioned():
+        return []
+    current = month_start(today or timezone.localdate())
+    return [month for month in (add_months(current, n) for n in range(ahead + 1)) if ensure_partition(month)]
+
+
+def months_before(cutoff):
+    """Meses anteriores a ``cutoff`` que todavía tienen eventos."""
+    if not is_partitioned():
+        start, _ = month_bounds(cutoff)
+        return sorted(month_start(d) for d in AnalyticsEvent.objects.filter(timestamp__lt=start).dates('timestamp', 'month'))
+    months = {month for month in existing_partitions() if month < cutoff}
+    # filas que cayeron en _default (p. ej. con fecha anterior a la partición más vieja)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT DISTINCT date_trunc(\'month\', "timestamp" AT TIME ZONE %s)::date FROM {connection.ops.quote_name(DEFAULT_PARTITION)} '
+            f'WHERE "timestamp" < %s', [timezone.get_current_timezone_name(), month_bounds(cutoff)[0]]
+        )
+        months.update(row[0] for row in cursor.fetchall())
+    return sorted(months)
+
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, datetime.datetime) else value
+
+
+def export_month(month, directory):
+    """Escribe los eventos del mes en ``analytics-AAAA-MM.jsonl.gz``; devuelve (ruta, filas)."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'analytics-{month:%Y-%m}.jsonl.gz')
+    start, end = month_bounds(month)
+    rows = (
+        AnalyticsEvent.objects.filter(timestamp__gte=start, timestamp__lt=end)
+        .order_by().values_list(*ARCHIVE_COLUMNS).iterator(chunk_size=5000)
+    )
+    count = 0
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as gz:
+            for row in rows:
+                gz.write((json.dumps(dict(zip(ARCHIVE_COLUMNS, map(_json_value, row)))) + '\n').encode('utf-8'))
+                count += 1
+            gz.close()
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return path, count
+
+
+def drop_month(month, expected):
+    """Elimina los eventos del mes (``DROP TABLE`` de su partición o un DELETE por rango).
+
+    ``expected`` es la cantidad exportada: si el mes cambió desde entonces no se borra nada.
+    """
+    start, end = month_bounds(month)
+    partitioned = is_partitioned()
+    if partitioned:
+        ensure_partition(month)  # filas del mes que estuvieran en _default
+    qn = connection.ops.quote_name
+    with transaction.atomic():
+        if not partitioned:
+            events = AnalyticsEvent.objects.filter(timestamp__gte=start, timestamp__lt=end)
+            if events.count() != expected:
+                raise ValueError(f'{month:%Y-%m}: cambiaron los eventos durante la exportación')
+            return events.delete()[0]
+        name = partition_name(month)
+        with connection.cursor() as cursor:
+            # el bloqueo impide inserciones entre el conteo y el DROP
+            cursor.execute(f'LOCK TABLE {qn(name)} IN ACCESS EXCLUSIVE MODE')
+            cursor.execute(f'SELECT count(*) FROM {qn(name)}')
+            if cursor.fetchone()[0] != expected:
+                raise ValueError(f'{month:%Y-%m}: cambiaron los eventos durante la exportación')
+            cursor.execute(f'ALTER TABLE {qn(PARENT)} DETACH PARTITION {qn(name)}')
+            cursor.execute(f'DROP TABLE {qn(name)}')
+    return expected
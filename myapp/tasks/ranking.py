@@ -0,0 +1,136 @@
+"""Ranking de libros populares y en tendencia (``BookRanking``).
+
+Cada consulta, ficha PDF o préstamo suma un peso que decae a la mitad cada
+``RANKING_*_HALF_LIFE_DAYS``. En lugar de decaer todos los puntajes con el
+paso del tiempo, cada aporte se guarda ya multiplicado por
+``2 ** ((t - RANKING_EPOCH) / vida_media)``: el orden entre libros es el mismo
+que el de los puntajes decaídos a cualquier fecha, de modo que actualizar es
+sumar (un upsert por lote de eventos) y leer el top N es recorrer N entradas
+del índice ``-popular`` / ``-trending``.
+
+Los valores crecen con el tiempo: con vida media de 3 días un float alcanza
+su límite unos 8 años después de ``RANKING_EPOCH``; antes de eso basta con
+mover la fecha y ejecutar ``rebuild_rankings``.
+"""
+import datetime
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, FloatField, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import AnalyticsBookDaily, AnalyticsEvent, BookRanking, Prestamo
+
+EVENT_LOAN = 'loan'
+WEIGHTS = {
+    AnalyticsEvent.EVENT_VIEW: 1.0,
+    AnalyticsEvent.EVENT_PDF: 2.0,
+    EVENT_LOAN: 5.0,
+}
+# "tendencia de la semana": al menos el equivalente a una consulta de hace 7 días
+TRENDING_WINDOW = datetime.timedelta(days=7)
+
+
+def _epoch():
+    return timezone.make_aware(datetime.datetime.fromisoformat(settings.RANKING_EPOCH))
+
+
+def growth(when, half_life_days):
+    """Factor por el que se multiplica un aporte hecho en ``when``."""
+    return 2.0 ** ((when - _epoch()).total_seconds() / (half_life_days * 86400))
+
+
+def contribution(kind, when, n=1):
+    """(popular, trending) que suman ``n`` eventos ``kind`` ocurridos en ``when``."""
+    weight = WEIGHTS[kind] * n
+    return (weight * growth(when, settings.RANKING_POPULAR_HALF_LIFE_DAYS),
+            weight * growth(when, settings.RANKING_TRENDING_HALF_LIFE_DAYS))
+
+
+def decayed(value, half_life_days, now=None):
+    """Puntaje equivalente a hoy (para mostrar o comparar con un umbral)."""
+    return value / growth(now or timezone.now(), half_life_days)
+
+
+def add_scores(scores):
+    """Suma ``{book_id: (popular, trending)}`` a los puntajes (un solo upsert)."""
+    if not scores:
+        return
+    if connection.vendor in ('postgresql', 'sqlite'):
+        table = connection.ops.quote_name(BookRanking._meta.db_table)
+        placeholders = ', '.join(['(%s, %s, %s)'] * len(scores))
+        params = [value for book_id, (popular, trending) in sorted(scores.items()) for value in (book_id, popular, trending)]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} ("book_id", "popular", "trending") VALUES {placeholders} '
+                f'ON CONFLICT ("book_id") DO UPDATE SET "popular" = {table}."popular" + EXCLUDED."popular", '
+                f'"trending" = {table}."trending" + EXCLUDED."trending"',
+                params,
+            )
+        return
+    for book_id, (popular, trending) in sorted(scores.items()):
+        if not BookRanking.objects.filter(book_id=book_id).update(popular=F('popular') + popular, trending=F('trending') + trending):
+            BookRanking.objects.create(book_id=book_id, popular=popular, trending=trending)
+
+
+def _accumulate(scores, book_id, kind, when, n=1):
+    popular, trending = contribution(kind, when, n)
+    scores[book_id][0] += popular
+    scores[book_id][1] += trending
+
+
+def add_events(events):
+    """Suma las consultas y fichas PDF recién insertadas (llamado por ``analytics.store``)."""
+    scores = defaultdict(lambda: [0.0, 0.0])
+    for event in events:
+        if event.book_id and event.event_type in (AnalyticsEvent.EVENT_VIEW, AnalyticsEvent.EVENT_PDF):
+            _accumulate(scores, event.book_id, event.event_type, event.timestamp)
+    add_scores(scores)
+
+
+def add_loans(counts, when=None):
+    """Suma préstamos nuevos: ``{book_id: ejemplares}``."""
+    when = when or timezone.now()
+    scores = defaultdict(lambda: [0.0, 0.0])
+    for book_id, n in counts.items():
+        _accumulate(scores, book_id, EVENT_LOAN, when, n)
+    add_scores(scores)
+
+
+def rebuild():
+    """Recalcula todos los puntajes desde los totales diarios y los préstamos."""
+    scores = defaultdict(lambda: [0.0, 0.0])
+    daily = AnalyticsBookDaily.objects.values_list('book_id', 'event_type', 'day', 'count')
+    for book_id, kind, day, count in daily.iterator(chunk_size=5000):
+        # los totales son por día: se toma el mediodía como momento del aporte
+        when = timezone.make_aware(datetime.datetime.combine(day, datetime.time(12)))
+        _accumulate(scores, book_id, kind, when, count)
+    now = timezone.now()
+    loans = Prestamo.objects.values_list('book_id', 'approved_at', 'cantidad')
+    for book_id, approved_at, cantidad in loans.iterator(chunk_size=5000):
+        _accumulate(scores, book_id, EVENT_LOAN, approved_at or now, cantidad or 1)
+    with transaction.atomic():
+        BookRanking.objects.all().delete()
+        BookRanking.objects.bulk_create(
+            [BookRanking(book_id=book_id, popular=popular, trending=trending) for book_id, (popular, trending) in scores.items()],
+            batch_size=1000,
+        )
+    return len(scores)
+
+
+def trending_books(limit=8, now=None):
+    """Libros activos en tendencia esta semana, del más al menos activo."""
+    now = now or timezone.now()
+    threshold = WEIGHTS[AnalyticsEvent.EVENT_VIEW] * growth(now - TRENDING_WINDOW, settings.RANKING_TRENDING_HALF_LIFE_DAYS)
+    rows = (
+        BookRanking.objects.filter(trending__gte=threshold, book__is_active=True)
+        .select_related('book').order_by('-trending')[:limit]
+    )
+    return [row.book for row in rows]
+
+
+def with_popularity(queryset):
+    """Anota ``popularidad`` (0 si el libro no tiene puntaje) para ordenar el catálogo."""
+    return queryset.annotate(popularidad=Coalesce(F('ranking__popular'), Value(0.0), output_field=FloatField()))
@@ -0,0 +1,229 @@
+"""Resolución de cotas contra el diccionario NLM.
+
+``resolve_code('qs  18.2')`` busca primero la coincidencia exacta sobre
+``DictionaryEntry.codigo_key`` y luego la primera por prefijo; ambas
+consultas recorren el índice de ``codigo_key`` (en PostgreSQL el prefijo usa
+el índice ``varchar_pattern_ops`` que Django crea para columnas indexadas).
+
+Los resultados (también los fallidos) se guardan en un LRU por proceso que se
+vacía cuando cambia la versión ``DICTIONARY_CODES`` (ver ``signals.py``).
+Formularios, importaciones y cualquier API deben resolver códigos por aquí.
+
+``classification_map`` asigna a los libros la ``Clasificacion`` derivada de su
+entrada del diccionario usando un mapa en memoria código -> clasificación
+(son ~35 filas) y la clasificación ya calculada de cada entrada, de modo que
+guardar libros, uno o miles, no repite consultas de clasificación.
+"""
+import copy
+import threading
+from collections import OrderedDict
+
+from django.db import transaction
+
+from .cache_utils import bump_version, get_version
+from .indexes import DICTIONARY_CODES
+from .search import normalize_code
+
+CLASSIFICATIONS = 'classifications'
+
+_MISSING = object()
+
+
+class CodeResolver:
+    def __init__(self, maxsize=2048):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = None
+
+    def _lookup(self, key):
+        from .models import DictionaryEntry
+
+        entry = DictionaryEntry.objects.filter(codigo_key=key).order_by('codigo').first()
+        if entry is None:
+            entry = DictionaryEntry.objects.filter(codigo_key__startswith=key).order_by('codigo_key').first()
+        return entry
+
+    def resolve(self, code):
+        """``DictionaryEntry`` correspondiente a ``code`` o ``None``."""
+        key = normalize_code(code)
+        if not key:
+            return None
+        version = get_version(DICTIONARY_CODES)
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                self._entries.move_to_end(key)
+        if entry is _MISSING:
+            entry = self._lookup(key)
+            with self._lock:
+                if version == self._version:
+                    self._entries[key] = entry
+                    if len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+        # copia: quien la reciba puede asignarla o modificarla sin afectar al caché
+        return copy.copy(entry) if entry is not None else None
+
+    def resolve_many(self, codes):
+        """``{code: DictionaryEntry o None}``; las coincidencias exactas faltantes se buscan en una sola consulta."""
+        from .models import DictionaryEntry
+
+        keys = {code: normalize_code(code) for code in codes}
+        version = get_version(DICTIONARY_CODES)
+        resolved = {}
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            for key in keys.values():
+                if key and key in self._entries:
+                    resolved[key] = self._entries[key]
+        unknown = {key for key in keys.values() if key and key not in resolved}
+        if unknown:
+            exact = {}
+            for entry in DictionaryEntry.objects.filter(codigo_key__in=unknown).order_by('-codigo'):
+                exact[entry.codigo_key] = entry  # ante claves repetidas queda el primer codigo
+            for key in unknown:
+                entry = exact.get(key)
+                if entry is None:
+                    entry = DictionaryEntry.objects.filter(codigo_key__startswith=key).order_by('codigo_key').first()
+                resolved[key] = entry
+            with self._lock:
+                if version == self._version:
+                    for key in unknown:
+                        self._entries[key] = resolved[key]
+                    while len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+        return {code: copy.copy(resolved.get(key)) if resolved.get(key) is not None else None
+                for code, key in keys.items()}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+
+
+code_resolver = CodeResolver()
+
+
+def resolve_code(code):
+    return code_resolver.resolve(code)
+
+
+def classification_from_entry(codigo, clasificacion):
+    """``(code, label)`` de la clasificación de una entrada del diccionario.
+
+    El código sale del primer token de ``codigo`` ('WG 123' -> 'WG'), que es
+    más fiable que el campo libre ``clasificacion``; éste se usa como
+    respaldo y para la etiqueta ('QS-Anatomía Humana' -> 'Anatomía Humana').
+    """
+    code = None
+    codigo = (codigo or '').strip()
+    if codigo:
+        code = codigo.split(None, 1)[0].upper()
+    clas_label = (clasificacion or '').strip()
+    if not code and clas_label:
+        code = clas_label.split('-', 1)[0].strip() or None
+    if clas_label and '-' in clas_label:
+        label = clas_label.split('-', 1)[1].strip()
+    else:
+        label = clas_label
+    return code, label
+
+
+class ClassificationMap:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._by_code = {}        # code -> [id, label]
+        self._entries_version = None
+        self._entries = {}        # id de DictionaryEntry -> (code, label)
+
+    def _ensure_current(self):
+        from .models import Clasificacion
+
+        version = get_version(CLASSIFICATIONS)
+        if version != self._version:
+            rows = Clasificacion.objects.values_list('code', 'id', 'label')
+            with self._lock:
+                self._by_code = {code: [pk, label] for code, pk, label in rows}
+                self._version = version
+        entries_version = get_version(DICTIONARY_CODES)
+        if entries_version != self._entries_version:
+            with self._lock:
+                self._entries = {}
+                self._entries_version = entries_version
+
+    def prefetch_entries(self, entry_ids):
+        """Carga en una sola consulta la clasificación de las entradas que falten."""
+        from .models import DictionaryEntry
+
+        self._ensure_current()
+        missing = {pk for pk in entry_ids if pk and pk not in self._entries}
+        if not missing:
+            return
+        rows = DictionaryEntry.objects.filter(pk__in=missing).order_by().values_list('pk', 'codigo', 'clasificacion')
+        with self._lock:
+            for pk, codigo, clasificacion in rows:
+                self._entries[pk] = classification_from_entry(codigo, clasificacion)
+
+    def classification_id(self, code, label='', created=None):
+        """Id de la clasificación ``code``; la crea si no existe (y completa su etiqueta si falta).
+
+        Las filas creadas o modificadas entran al mapa recién al confirmar la
+        transacción (vía ``signals.py``); ``created`` evita repetir el
+        ``get_or_create`` dentro de un mismo lote.
+        """
+        from .models import Clasificacion
+
+        hit = self._by_code.get(code)
+        if hit is None and created is not None:
+            hit = created.get(code)
+        if hit is None:
+            obj, _ = Clasificacion.objects.get_or_create(code=code, defaults={'label': label})
+            hit = [obj.pk, obj.label]
+            if created is not None:
+                created[code] = hit
+        if not hit[1] and label:
+            Clasificacion.objects.filter(pk=hit[0]).update(label=label)
+            hit[1] = label
+            transaction.on_commit(lambda: bump_version(CLASSIFICATIONS))
+        return hit[0]
+
+    def assign(self, books):
+        """Sincroniza ``classification`` de cada libro con su entrada del diccionario."""
+        from .models import Libros
+
+        self._ensure_current()
+        field = Libros._meta.get_field('dictionary_entry')
+        pending = []
+        for book in books:
+            # si la entrada ya está cargada en el libro se usa tal cual; si no, sólo su id
+            entry = book.dictionary_entry if field.is_cached(book) else None
+            if entry is None and not book.dictionary_entry_id:
+                continue
+            pending.append((book, entry))
+        self.prefetch_entries([book.dictionary_entry_id for book, entry in pending if entry is None])
+
+        created = {}
+        for book, entry in pending:
+            if entry is not None:
+                code, label = classification_from_entry(entry.codigo, entry.clasificacion)
+            else:
+                code, label = self._entries.get(book.dictionary_entry_id, (None, ''))
+            if not code:
+                continue
+            clas_id = self.classification_id(code, label, created)
+            if book.classification_id != clas_id:
+                book.classification_id = clas_id
+
+    def clear(self):
+        with self._lock:
+            self._version = self._entries_version = None
+            self._by_code, self._entries = {}, {}
+
+
+classification_map = ClassificationMap()
@@ -0,0 +1,140 @@
+"""Totales diarios de analítica (``AnalyticsDaily`` y ``AnalyticsBookDaily``).
+
+El panel ya no agrupa los eventos crudos: lee a lo sumo ~31 filas por tipo y
+mes. Los totales se incrementan en la misma transacción que inserta los
+eventos (``add_events``, llamado por ``analytics.store``) y el comando
+``rollup_analytics`` los recalcula desde los eventos para un rango de días
+(reconciliación, o tras cargar eventos por otra vía).
+
+Los meses cerrados no cambian: ``month_counts`` los guarda en la caché sin
+caducidad práctica bajo la versión ``ANALYTICS_ROLLUPS``, que sólo se renueva
+si llega un evento atrasado de un mes anterior o se recalcula un rango que
+empieza antes del mes en curso.
+"""
+import datetime
+from collections import Counter
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .cache_utils import bump_version, get_or_build
+from .models import AnalyticsBookDaily, AnalyticsDaily, AnalyticsEvent
+
+ANALYTICS_ROLLUPS = 'analytics-rollups'
+# eventos que además se totalizan por libro
+BOOK_EVENTS = (AnalyticsEvent.EVENT_VIEW, AnalyticsEvent.EVENT_PDF)
+# los meses cerrados se guardan hasta que cambie la versión
+CLOSED_MONTH_TIMEOUT = 60 * 60 * 24 * 30
+
+
+def _increment(model, key_fields, counts):
+    """``count += n`` por clave, insertando las filas que faltan (un solo upsert)."""
+    if not counts:
+        return
+    if connection.vendor in ('postgresql', 'sqlite'):
+        table = connection.ops.quote_name(model._meta.db_table)
+        columns = [model._meta.get_field(name).column for name in key_fields]
+        column_list = ', '.join(connection.ops.quote_name(c) for c in columns + ['count'])
+        placeholders = ', '.join(['(' + ', '.join(['%s'] * (len(columns) + 1)) + ')'] * len(counts))
+        params = [value for key, n in counts.items() for value in (*key, n)]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} ({column_list}) VALUES {placeholders} '
+                f'ON CONFLICT ({", ".join(connection.ops.quote_name(c) for c in columns)}) '
+                f'DO UPDATE SET "count" = {table}."count" + EXCLUDED."count"',
+                params,
+            )
+        return
+    for key, n in counts.items():
+        lookup = dict(zip(key_fields, key))
+        if not model.objects.filter(**lookup).update(count=F('count') + n):
+            model.objects.create(count=n, **lookup)
+
+
+def add_events(events):
+    """Suma a los totales diarios los eventos recién insertados."""
+    daily, by_book = Counter(), Counter()
+    for event in events:
+        day = timezone.localdate(event.timestamp)
+        daily[(day, event.event_type)] += 1
+        if event.book_id and event.event_type in BOOK_EVENTS:
+            by_book[(day, event.book_id, event.event_type)] += 1
+    _increment(AnalyticsDaily, ('day', 'event_type'), daily)
+    _increment(AnalyticsBookDaily, ('day', 'book', 'event_type'), by_book)
+    # un evento atrasado (cola del escritor al cambiar de mes) modifica un mes ya cacheado
+    month_start = timezone.localdate().replace(day=1)
+    if any(day < month_start for day, _ in daily):
+        transaction.on_commit(lambda: bump_version(ANALYTICS_ROLLUPS))
+
+
+def rebuild(since, until=None):
+    """Recalcula los totales de los días ``since``..``until`` (incluidos) desde los eventos.
+
+    Los días anteriores al evento más antiguo (meses ya archivados) no se tocan.
+    """
+    until = until or timezone.localdate()
+    first = AnalyticsEvent.objects.order_by('timestamp').values_list('timestamp', flat=True).first()
+    if first is None:
+        return 0, 0
+    since = max(since, timezone.localdate(first))
+    start = timezone.make_aware(datetime.datetime.combine(since, datetime.time.min))
+    end = timezone.make_aware(datetime.datetime.combine(until + datetime.timedelta(days=1), datetime.time.min))
+    events = AnalyticsEvent.objects.filter(timestamp__gte=start, timestamp__lt=end).annotate(day=TruncDate('timestamp'))
+    with transaction.atomic():
+        AnalyticsDaily.objects.filter(day__gte=since, day__lte=until).delete()
+        AnalyticsBookDaily.objects.filter(day__gte=since, day__lte=until).delete()
+        daily = [
+            AnalyticsDaily(day=row['day'], event_type=row['event_type'], count=row['n'])
+            for row in events.values('day', 'event_type').annotate(n=Count('id')).order_by()
+        ]
+        AnalyticsDaily.objects.bulk_create(daily, batch_size=1000)
+        by_book = (
+            events.filter(event_type__in=BOOK_EVENTS, book__isnull=False)
+            .values('day', 'book_id', 'event_type').annotate(n=Count('id')).order_by()
+        )
+        book_rows = 0
+        batch = []
+        for row in by_book.iterator(chunk_size=2000):
+            batch.append(AnalyticsBookDaily(day=row['day'], book_id=row['book_id'], event_type=row['event_type'], count=row['n']))
+            if len(batch) >= 1000:
+                AnalyticsBookDaily.objects.bulk_create(batch)
+                book_rows += len(batch)
+                batch = []
+        AnalyticsBookDaily.objects.bulk_create(batch)
+        book_rows += len(batch)
+        # el mes en curso no se cachea: la corrida diaria no invalida los meses cerrados
+        if since < timezone.localdate().replace(day=1):
+            transaction.on_commit(lambda: bump_version(ANALYTICS_ROLLUPS))
+    return len(daily), book_rows
+
+
+def _month_totals(start, end):
+    totals = {et: 0 for et, _ in AnalyticsEvent.EVENT_CHOICES}
+    rows = AnalyticsDaily.objects.filter(day__gte=start, day__lt=end).values('event_type').annotate(total=Sum('count')).order_by()
+    for row in rows:
+        totals[row['event_type']] = row['total']
+    return totals
+
+
+def _next_month(day):
+    return (day.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+
+def month_counts(first_month, today=None):
+    """``{'YYYY-MM': {tipo: total}}`` desde ``first_month`` hasta el mes actual."""
+    today = today or timezone.localdate()
+    current = today.replace(day=1)
+    result = {}
+    month = first_month.replace(day=1)
+    while month <= current:
+        end = _next_month(month)
+        if month < current:
+            totals = get_or_build(ANALYTICS_ROLLUPS, f'analytics-month:{month:%Y-%m}',
+                                  lambda m=month, e=end: _month_totals(m, e), timeout=CLOSED_MONTH_TIMEOUT)
+        else:
+            totals = _month_totals(month, end)  # mes en curso: siempre desde la tabla
+        result[month.strftime('%Y-%m')] = totals
+        month = end
+    return result
@@ -0,0 +1,369 @@
+"""Búsqueda en el catálogo de libros.
+
+En PostgreSQL se usa búsqueda de texto completo sobre ``Libros.search_document``
+(documento normalizado que se mantiene en ``Libros.save``) con un índice GIN que
+combina las configuraciones 'spanish' e 'english'; como la búsqueda anterior,
+cada término también coincide dentro de palabras del título y los autores
+(índices de trigramas) y con el año o la fecha de registro. En otros motores se
+conserva la búsqueda anterior por ``icontains`` sobre varios campos.
+
+El modo aproximado (``fuzzy``) compara por trigramas (pg_trgm) contra
+``titulo_norm`` y ``autores_norm``, tolerando errores de tipeo y acentos.
+
+El diccionario NLM se busca con un vector bilingüe (``descripcion`` con la
+configuración 'spanish' y ``descripcion_en`` con 'english', ambas con
+lematización) indexado con GIN, y los resultados traen fragmentos resaltados.
+"""
+import datetime
+import re
+import unicodedata
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.db.models.functions import Greatest
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+# Campos de Libros que forman el documento de búsqueda
+SEARCH_DOCUMENT_FIELDS = (
+    'cota', 'titulo', 'subtitulo', 'autor', 'co_autor',
+    'editorial', 'serie', 'contenido', 'numero_registro', 'fecha_publicacion',
+)
+
+SEARCH_CONFIGS = ('spanish', 'english')
+
+# Expresión indexada (ver migración 0005). La consulta debe usar exactamente la
+# misma expresión para que PostgreSQL pueda aprovechar el índice GIN.
+BOOK_VECTOR_SQL = (
+    "(to_tsvector('spanish'::regconfig, search_document) || "
+    "to_tsvector('english'::regconfig, search_document))"
+)
+BOOK_VECTOR_INDEX = 'tasks_libros_search_gin'
+
+# Columnas normalizadas con índice GIN gin_trgm_ops (ver migración 0006)
+TRIGRAM_FIELDS = ('titulo_norm', 'autores_norm')
+
+# Diccionario: cada descripción con la configuración de su idioma (ver migración 0009)
+DICTIONARY_VECTOR_SQL = (
+    "(to_tsvector('spanish'::regconfig, descripcion) || "
+    "to_tsvector('english'::regconfig, descripcion_en))"
+)
+DICTIONARY_VECTOR_INDEX = 'tasks_dictionaryentry_search_gin'
+# ``codigo_key`` tiene índice GIN gin_trgm_ops (ver migración 0018) para buscar dentro del código
+
+# marcas que ts_headline pone alrededor de los términos; se reemplazan por <mark> después de escapar
+_MARK_START = '\x02'
+_MARK_STOP = '\x03'
+
+SEARCH_MODE_FULLTEXT = 'fulltext'
+SEARCH_MODE_CONTAINS = 'contains'
+SEARCH_MODE_FUZZY = 'fuzzy'
+
+
+def normalize_text(value, max_length=None):
+    """Minúsculas, sin acentos y con espacios colapsados ('Fisiología ' -> 'fisiologia').
+
+    NFKD puede alargar el texto ('ﬁ' -> 'fi', '½' -> '1⁄2'): ``max_length``
+    recorta el resultado para guardarlo en una columna del mismo largo que el original.
+    """
+    if value in (None, ''):
+        return ''
+    value = unicodedata.normalize('NFKD', str(value))
+    value = ''.join(ch for ch in value if not unicodedata.combining(ch))
+    value = ' '.join(value.lower().split())
+    if max_length is not None:
+        value = value[:max_length].rstrip()
+    return value
+
+
+def build_search_document(book):
+    """Compone el documento de búsqueda de un libro a partir de sus campos de texto."""
+    parts = []
+    for field in SEARCH_DOCUMENT_FIELDS:
+        value = getattr(book, field, None)
+        if value in (None, ''):
+            continue
+        if field == 'contenido':
+            value = str(value).replace(',', ' ')
+        parts.append(normalize_text(value))
+    return ' '.join(p for p in parts if p)
+
+
+def build_autores_norm(book, max_length=None):
+    value = ' '.join(p for p in (normalize_text(book.autor), normalize_text(book.co_autor)) if p)
+    return value[:max_length].rstrip() if max_length is not None else value
+
+
+def supports_full_text(using='default'):
+    return connections[using].vendor == 'postgresql'
+
+
+def _prefix_tsquery(q):
+    """'Fisiología Guyt' -> 'fisiologia:* & guyt:*' (sólo caracteres de palabra)."""
+    tokens = re.findall(r'\w+', normalize_text(q))
+    return ' & '.join(f'{t}:*' for t in tokens)
+
+
+def _bilingual_query(raw):
+    from django.contrib.postgres.search import SearchQuery
+
+    query = None
+    for config in SEARCH_CONFIGS:
+        part = SearchQuery(raw, config=config, search_type='raw')
+        query = part if query is None else query | part
+    return query
+
+
+def _date_q(term):
+    """Coincidencia de ``term`` con ``fecha_registro`` como año (YYYY) o fecha; ``Q()`` si no lo es."""
+    if len(term) == 4 and term.isdigit():
+        return Q(fecha_registro__year=int(term))
+    for fmt in ('%Y-%m-%d', '%d-%m-%Y', '%d/%m/%Y', '%Y/%m/%d'):
+        try:
+            return Q(fecha_registro=datetime.datetime.strptime(term, fmt).date())
+        except ValueError:
+            continue
+    return Q()
+
+
+def full_text_search(qs, q):
+    """Filtra por texto completo y anota ``rank`` para ordenar por relevancia.
+
+    Como en la búsqueda por ``icontains``, cada término debe coincidir y puede
+    hacerlo por el documento (prefijo de palabra), dentro de una palabra del
+    título o los autores (``titulo_norm``/``autores_norm``, con índice de
+    trigramas) o con ``fecha_registro`` (año o fecha).
+    """
+    from django.contrib.postgres.search import SearchRank, SearchVectorField
+
+    raw = _prefix_tsquery(q)
+    if not raw:
+        return qs.none()
+    match = Q()
+    for term in q.split():
+        term_raw = _prefix_tsquery(term)
+        if not term_raw:
+            continue
+        norm = normalize_text(term)
+        match &= (
+            Q(search=_bilingual_query(term_raw)) |
+            Q(titulo_norm__contains=norm) | Q(autores_norm__contains=norm) |
+            _date_q(term)
+        )
+    vector = RawSQL(BOOK_VECTOR_SQL, [], output_field=SearchVectorField())
+    return qs.alias(search=vector).filter(match).annotate(rank=SearchRank(vector, _bilingual_query(raw)))
+
+
+def fuzzy_search(qs, q, threshold=None):
+    """Búsqueda por similitud de trigramas en título y autores.
+
+    En PostgreSQL anota ``rank`` con la mejor ``word_similarity`` y filtra por
+    ``rank >= threshold``. No se usa el operador ``%>``: su umbral es un parámetro
+    de la sesión y las conexiones persistentes (``conn_max_age``) lo arrastrarían
+    a otras peticiones. En otros motores se degrada a ``icontains`` sin acentos
+    sobre las mismas columnas.
+    """
+    term = normalize_text(q)
+    if not term:
+        return qs.none(), False
+    if not supports_full_text(qs.db):
+        query = Q()
+        for token in term.split():
+            query &= Q(titulo_norm__contains=token) | Q(autores_norm__contains=token)
+        return qs.filter(query), False
+
+    from django.contrib.postgres.search import TrigramWordSimilarity
+
+    if threshold is None:
+        threshold = getattr(settings, 'CATALOG_FUZZY_THRESHOLD', 0.3)
+    similarity = Greatest(*[TrigramWordSimilarity(term, field) for field in TRIGRAM_FIELDS])
+    return qs.annotate(rank=similarity).filter(rank__gte=threshold), True
+
+
+def icontains_search(qs, q):
+    """Búsqueda anterior: cada término debe aparecer (icontains) en alguno de los campos."""
+    terms = [t for t in q.split() if t]
+    query = Q()
+    for term in terms:
+        # campos de texto básicos
+        term_q = (
+            Q(cota__icontains=term) |
+            Q(titulo__icontains=term) |
+            Q(subtitulo__icontains=term) |
+            Q(autor__icontains=term) |
+            Q(editorial__icontains=term) |
+            Q(serie__icontains=term) |
+            Q(contenido__icontains=term) |
+            Q(co_autor__icontains=term)
+        )
+        # si el término es numérico, intentar comparar con numero_registro (entero)
+        try:
+            n = int(term)
+            term_q = term_q | Q(numero_registro=n)
+        except Exception:
+            pass
+
+        # intentar interpretar el término como fecha (varios formatos) o año
+        term_q = term_q | _date_q(term)
+
+        query &= term_q
+    return qs.filter(query)
+
+
+def search_books(qs, q, mode=''):
+    """Aplica la búsqueda libre del catálogo.
+
+    Devuelve ``(queryset, ranked)``; ``ranked`` indica si el queryset trae la
+    anotación ``rank`` (texto completo o similitud de trigramas).
+    """
+    if mode == SEARCH_MODE_FUZZY:
+        return fuzzy_search(qs, q)
+    if mode != SEARCH_MODE_CONTAINS and supports_full_text(qs.db):
+        return full_text_search(qs, q), True
+    return icontains_search(qs, q), False
+
+
+def normalize_code(codigo):
+    """Clave de búsqueda de un código NLM: mayúsculas y espacios colapsados (' qs  18.2' -> 'QS 18.2')."""
+    return ' '.join((codigo or '').split()).upper()
+
+
+def dictionary_prefix(codigo):
+    """Letras iniciales del código NLM ('QS 18.2' -> 'QS', 'W 100' -> 'W')."""
+    match = re.match(r'\s*([A-Za-z]+)', codigo or '')
+    return match.group(1).upper() if match else ''
+
+
+def cota_sort_key(cota):
+    """Clave de orden natural de una cota: los números se comparan como números ('WG 200' < 'WG 1000')."""
+    key = []
+    for number, letters in re.findall(r'(\d+(?:\.\d+)?)|([A-Za-z]+)', cota or ''):
+        key.append((0, Decimal(number), '') if number else (1, 0, letters.upper()))
+    return tuple(key)
+
+
+def cota_in_range(cota, desde='', hasta=''):
+    """Si ``cota`` cae entre ``desde`` y ``hasta`` en orden natural; ``hasta`` incluye las cotas
+    que empiezan por él ('WG 300' incluye 'WG 300 A 1', pero no 'WG 3000')."""
+    key = cota_sort_key(cota)
+    if desde and key < cota_sort_key(desde):
+        return False
+    if hasta:
+        upper = cota_sort_key(hasta)
+        return key <= upper or key[:len(upper)] == upper
+    return True
+
+
+def _dictionary_query(q):
+    from django.contrib.postgres.search import SearchQuery
+
+    raw = _prefix_tsquery(q)
+    if not raw:
+        return None
+    return SearchQuery(raw, config='spanish', search_type='raw') | SearchQuery(raw, config='english', search_type='raw')
+
+
+def search_dictionary(qs, q):
+    """Busca en el diccionario por código o descripción.
+
+    En PostgreSQL usa el vector bilingüe indexado (más ``codigo_key``
+    contiene el código buscado, con índice de trigramas: '18.2' encuentra
+    'QS 18.2') y anota ``rank``; en otros motores conserva ``icontains``.
+    Devuelve ``(queryset, ranked)``.
+    """
+    code_match = Q(codigo_key__contains=normalize_code(q))
+    if not supports_full_text(qs.db):
+        return qs.filter(code_match | Q(descripcion__icontains=q) | Q(descripcion_en__icontains=q)), False
+
+    from django.contrib.postgres.search import SearchRank, SearchVectorField
+
+    query = _dictionary_query(q)
+    if query is None:
+        return qs.filter(code_match), False
+    vector = RawSQL(DICTIONARY_VECTOR_SQL, [], output_field=SearchVectorField())
+    return qs.alias(search=vector).filter(Q(search=query) | code_match).annotate(rank=SearchRank(vector, query)), True
+
+
+def _fold(ch):
+    """Minúscula sin acento de un carácter (conserva la longitud del texto)."""
+    return unicodedata.normalize('NFKD', ch)[0].lower()
+
+
+def _marked_to_html(marked):
+    return mark_safe(escape(marked).replace(_MARK_START, '<mark>').replace(_MARK_STOP, '</mark>'))
+
+
+def highlight_text(text, q, max_words=30):
+    """Fragmento de ``text`` con los términos de ``q`` marcados (sin acentos ni mayúsculas).
+
+    Versión en Python para motores sin ``ts_headline``.
+    """
+    text = text or ''
+    terms = [t for t in normalize_text(q).split() if t]
+    if not text or not terms:
+        return escape(text)
+    folded = ''.join(_fold(ch) for ch in text)
+    spans = []
+    for term in terms:
+        for match in re.finditer(re.escape(term), folded):
+            spans.append((match.start(), match.end()))
+    if not spans:
+        return escape(text)
+    spans.sort()
+    # recortar a ~max_words palabras alrededor de la primera coincidencia
+    words = list(re.finditer(r'\S+', text))
+    first = next((i for i, w in enumerate(words) if w.end() > spans[0][0]), 0)
+    begin = max(first - max_words // 3, 0)
+    end = min(begin + max_words, len(words))
+    lo, hi = words[begin].start(), words[end - 1].end()
+    parts, pos = [], lo
+    for start, stop in spans:
+        if start < pos or stop > hi:
+            continue
+        parts.append(text[pos:start] + _MARK_START + text[start:stop] + _MARK_STOP)
+        pos = stop
+    parts.append(text[pos:hi])
+    snippet = ''.join(parts)
+    if begin > 0:
+        snippet = '… ' + snippet
+    if end < len(words):
+        snippet += ' …'
+    return _marked_to_html(snippet)
+
+
+def highlight_dictionary(entries, q):
+    """Agrega ``snippet_es``/``snippet_en`` (HTML con <mark>) a las entradas de la página.
+
+    En PostgreSQL se calculan con ``ts_headline`` en una sola consulta sólo
+    para las filas mostradas.
+    """
+    entries = list(entries)
+    if not entries or not q:
+        return entries
+    if not supports_full_text(entries[0]._state.db or 'default'):
+        for e in entries:
+            e.snippet_es = highlight_text(e.descripcion, q)
+            e.snippet_en = highlight_text(e.descripcion_en, q)
+        return entries
+
+    from django.contrib.postgres.search import SearchHeadline
+    from .models import DictionaryEntry
+
+    query = _dictionary_query(q)
+    if query is None:
+        return entries
+    options = {'start_sel': _MARK_START, 'stop_sel': _MARK_STOP, 'max_words': 30, 'min_words': 10}
+    rows = DictionaryEntry.objects.using(entries[0]._state.db).filter(pk__in=[e.pk for e in entries]).values_list(
+        'pk',
+        SearchHeadline('descripcion', query, config='spanish', **options),
+        SearchHeadline('descripcion_en', query, config='english', **options),
+    )
+    snippets = {pk: (es, en) for pk, es, en in rows}
+    for e in entries:
+        es, en = snippets.get(e.pk, ('', ''))
+        e.snippet_es = _marked_to_html(es)
+        e.snippet_en = _marked_to_html(en)
+    return entries
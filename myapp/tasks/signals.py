@@ -0,0 +1,42 @@
+"""Receptores de señales que invalidan cachés e índices derivados.
+
+Las invalidaciones se publican al confirmar la transacción: si otro worker
+reconstruyera un índice antes del commit leería los datos anteriores y los
+guardaría con la versión nueva.
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache_utils import bump_version
+from .indexes import DICTIONARY_CODES, book_index
+from .models import Clasificacion, DictionaryEntry, Libros
+from .resolver import CLASSIFICATIONS
+from .storage import release_cover
+
+
+@receiver(post_save, sender=DictionaryEntry)
+@receiver(post_delete, sender=DictionaryEntry)
+def dictionary_changed(sender, using=None, **kwargs):
+    transaction.on_commit(lambda: bump_version(DICTIONARY_CODES), using=using)
+
+
+@receiver(post_save, sender=Clasificacion)
+@receiver(post_delete, sender=Clasificacion)
+def classification_changed(sender, using=None, **kwargs):
+    transaction.on_commit(lambda: bump_version(CLASSIFICATIONS), using=using)
+
+
+@receiver(post_save, sender=Libros)
+def book_saved(sender, instance, using=None, **kwargs):
+    transaction.on_commit(lambda: book_index.book_saved(instance), using=using)
+
+
+@receiver(post_delete, sender=Libros)
+def book_deleted(sender, instance, using=None, **kwargs):
+    book_id = instance.pk
+    transaction.on_commit(lambda: book_index.book_deleted(book_id), using=using)
+    # borrar la portada si ningún otro libro la usa
+    portada = instance.portada.name if instance.portada else ''
+    if portada:
+        transaction.on_commit(lambda: release_cover(portada), using=using)
@@ -0,0 +1,132 @@
+"""Almacenamiento de portadas direccionado por contenido.
+
+Cada archivo se guarda como ``covers/<aa>/<sha256><ext>``: subir dos veces la
+misma imagen devuelve el archivo existente en lugar de crear una copia con
+sufijo aleatorio, y la URL de una imagen no cambia mientras no cambie su
+contenido (el navegador la reutiliza).
+
+Las filas de ``Libros`` que apuntan a un archivo son su cuenta de
+referencias: ``release_cover`` borra el archivo (y sus derivados) sólo
+cuando ya ningún libro lo usa.
+
+Una subida que reutiliza un archivo todavía no es una referencia visible
+hasta que su transacción confirma; mientras tanto otro libro podría soltar
+el mismo archivo. Por eso ``save`` renueva la fecha de modificación del
+archivo reutilizado y ``release_cover`` no borra los tocados hace menos de
+``COVER_RELEASE_GRACE_SECONDS``; los que quedan sin referencias los borra
+después ``dedupe_covers`` (``orphan_covers``).
+"""
+import hashlib
+import os
+import posixpath
+import time
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+HASH_CHUNK = 64 * 1024
+
+
+def content_hash(content):
+    """SHA-256 de un ``File`` de Django (o archivo abierto), leído por bloques."""
+    digest = hashlib.sha256()
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    chunks = content.chunks(HASH_CHUNK) if hasattr(content, 'chunks') else iter(lambda: content.read(HASH_CHUNK), b'')
+    for chunk in chunks:
+        digest.update(chunk)
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+def content_name(directory, digest, original_name):
+    ext = os.path.splitext(original_name)[1].lower()
+    if ext == '.jpeg':
+        ext = '.jpg'
+    return posixpath.join(directory, digest[:2], digest + ext)
+
+
+def is_content_addressed(name):
+    parts = name.split('/')
+    if len(parts) < 3:
+        return False
+    stem = os.path.splitext(parts[-1])[0]
+    return len(stem) == 64 and parts[-2] == stem[:2]
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """``FileSystemStorage`` que nombra los archivos por el hash de su contenido."""
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        directory = posixpath.dirname(name.replace('\\', '/'))
+        name = content_name(directory, content_hash(content), name)
+        if self.exists(name):
+            # mismo contenido: se reutiliza el archivo (y se marca como recién usado)
+            try:
+                os.utime(self.path(name))
+                return name
+            except FileNotFoundError:
+                pass  # se borró entretanto: guardarlo de nuevo
+        return super().save(name, content, max_length=max_length)
+
+
+def get_cover_storage():
+    # la migración 0013 referencia esta función por nombre: no moverla ni renombrarla, y que
+    # importar este módulo siga sin arrastrar dependencias (PIL se importa en release_cover)
+    return cover_storage
+
+
+cover_storage = ContentAddressedStorage()
+
+
+def references(name):
+    from .models import Libros
+
+    return Libros.objects.filter(portada=name).count()
+
+
+def recently_used(name, now=None):
+    """Si ``name`` se guardó o reutilizó hace menos de ``COVER_RELEASE_GRACE_SECONDS``."""
+    grace = getattr(settings, 'COVER_RELEASE_GRACE_SECONDS', 3600)
+    try:
+        mtime = os.path.getmtime(cover_storage.path(name))
+    except OSError:
+        return False
+    return (now or time.time()) - mtime < grace
+
+
+def release_cover(name):
+    """Borra ``name`` y sus derivados si ningún libro lo referencia. Devuelve si se borró."""
+    from .covers import remove_derivatives
+
+    if not name or references(name) or recently_used(name):
+        return False
+    try:
+        cover_storage.delete(name)
+    except OSError:
+        pass
+    remove_derivatives(str(settings.MEDIA_ROOT), name)
+    return True
+
+
+def orphan_covers(directory='covers'):
+    """Nombres de las portadas por contenido que ningún libro referencia."""
+    from .covers import DERIVED_DIR
+    from .models import Libros
+
+    root = cover_storage.path(directory)
+    derived = cover_storage.path(DERIVED_DIR)
+    found = []
+    for current, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if os.path.join(current, d) != derived]
+        for filename in files:
+            name = os.path.relpath(os.path.join(current, filename), cover_storage.location).replace(os.sep, '/')
+            if is_content_addressed(name):
+                found.append(name)
+    used = set(Libros.objects.filter(portada__in=found).values_list('portada', flat=True))
+    return [name for name in found if name not in used]
@@ -1,7 +1,19 @@
-from django.test import TestCase
+from io import BytesIO, StringIO
+
+from django.test import TestCase as DjangoTestCase, override_settings
 from django.contrib.auth import get_user_model
-from .models import DictionaryEntry, Clasificacion, Libros
+from django.core.cache import cache
+from django.core.management import call_command
+from .models import AnalyticsBookDaily, AnalyticsDaily, AnalyticsEvent, BookRanking, DictionaryEntry, Clasificacion, Ejemplar, Libros, Prestamo
 from .forms import TaskForm
+from .pagination import KeysetPaginator
+from .facets import facet_counts
+from .resolver import classification_map, code_resolver, resolve_code
+
+
+@override_settings(ANALYTICS_SYNC=True)
+class TestCase(DjangoTestCase):
+	"""Los eventos de analítica se guardan en la misma petición, sin el hilo escritor."""
 
 
 class TaskFormDictionaryIntegrationTests(TestCase):
@@ -48,3 +60,1230 @@ class TaskFormDictionaryIntegrationTests(TestCase):
 		form = TaskForm(data=data)
 		# ahora que ya no validamos contra el diccionario, el formulario debe ser válido
 		self.assertTrue(form.is_valid(), msg=form.errors.as_json())
+
+
+class CatalogSearchTests(TestCase):
+	def setUp(self):
+		User = get_user_model()
+		self.user = User.objects.create_user(username='buscador', password='testpass123', cedula=22222, telefono=12345678, security_question='q', security_answer='a', email='b@example.com')
+		self.book = Libros.objects.create(cota='QT 104 G 111', titulo='Fisiología Médica', autor='Guyton, Arthur', editorial='Elsevier', user=self.user)
+
+	def test_search_document_is_normalized_on_save(self):
+		self.assertIn('fisiologia medica', self.book.search_document)
+		self.assertIn('guyton, arthur', self.book.search_document)
+		self.assertIn('qt 104 g 111', self.book.search_document)
+
+	def test_normalized_names_fit_their_columns(self):
+		# NFKD alarga las ligaduras ('ﬁ' -> 'fi'): el título de 100 caracteres pasa a 200
+		book = Libros.objects.create(cota='QT 104 G 112', titulo='ﬁ' * 100, autor='ﬁ' * 100, co_autor='ﬂ' * 100, user=self.user)
+		book.refresh_from_db()
+		self.assertEqual(book.titulo_norm, 'fi' * 50)
+		self.assertEqual(book.autores_norm, 'fi' * 100)
+
+	def test_catalog_search_finds_book(self):
+		response = self.client.get('/tasks/', {'q': 'Guyton', 'sort_by': 'relevance'})
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual([b.pk for b in response.context['tasks']], [self.book.pk])
+
+	def test_search_matches_registration_year_and_inner_words(self):
+		import datetime
+		other = Libros.objects.create(cota='WG 140 E 1', titulo='Electrocardiografía práctica', autor='Dubin, Dale', fecha_registro=datetime.date(2019, 5, 6), user=self.user)
+		for q in ('cardiograf', '2019', '06/05/2019', 'electro 2019'):
+			response = self.client.get('/tasks/', {'q': q, 'sort_by': 'relevance'})
+			self.assertEqual([b.pk for b in response.context['tasks']], [other.pk], q)
+		response = self.client.get('/tasks/', {'q': 'guyton 2019', 'sort_by': 'relevance'})
+		self.assertEqual(list(response.context['tasks']), [])
+
+	def test_fuzzy_search_ignores_accents(self):
+		response = self.client.get('/tasks/', {'q': 'fisiologia', 'search_mode': 'fuzzy'})
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual([b.pk for b in response.context['tasks']], [self.book.pk])
+
+	def test_fuzzy_threshold_does_not_touch_the_session(self):
+		from django.db import connection
+		if connection.vendor != 'postgresql':
+			self.skipTest('similitud de trigramas sólo en PostgreSQL')
+		with connection.cursor() as cursor:
+			cursor.execute("SELECT current_setting('pg_trgm.word_similarity_threshold')")
+			before = cursor.fetchone()[0]
+		with self.settings(CATALOG_FUZZY_THRESHOLD=0.4):
+			response = self.client.get('/tasks/', {'q': 'fisiolojia gyton', 'search_mode': 'fuzzy'})
+		self.assertEqual([b.pk for b in response.context['tasks']], [self.book.pk])
+		with connection.cursor() as cursor:
+			cursor.execute("SELECT current_setting('pg_trgm.word_similarity_threshold')")
+			self.assertEqual(cursor.fetchone()[0], before)
+
+
+class LoanCounterTests(TestCase):
+	def setUp(self):
+		User = get_user_model()
+		self.staff = User.objects.create_user(username='bibliotecario', password='testpass123', cedula=33333, telefono=12345678, security_question='q', security_answer='a', email='s@example.com', is_staff=True)
+		# los ejemplares se crean al confirmar
+		with self.captureOnCommitCallbacks(execute=True):
+			self.book = Libros.objects.create(cota='WG 100 A 1', titulo='Cardiología', autor='Autor, Uno', cantidad=3, user=self.staff)
+
+	def counters(self):
+		self.book.refresh_from_db()
+		return (self.book.en_prestamo, self.book.pendientes)
+
+	def test_counters_follow_loan_transitions(self):
+		loan = Prestamo.objects.create(book=self.book, user=self.staff, status=Prestamo.STATUS_PENDING)
+		self.assertEqual(self.counters(), (0, 1))
+		self.client.force_login(self.staff)
+		self.client.get(f'/loan/requests/{loan.pk}/approve/')
+		self.assertEqual(self.counters(), (1, 0))
+		self.client.post(f'/loan/return/{loan.pk}/')
+		self.assertEqual(self.counters(), (0, 0))
+		rejected = Prestamo.objects.create(book=self.book, user=self.staff, status=Prestamo.STATUS_PENDING)
+		self.client.get(f'/loan/requests/{rejected.pk}/reject/')
+		self.assertEqual(self.counters(), (0, 0))
+
+	def test_book_save_does_not_overwrite_counters(self):
+		stale = Libros.objects.get(pk=self.book.pk)
+		Prestamo.objects.create(book=self.book, user=self.staff, status=Prestamo.STATUS_ACTIVE)
+		stale.titulo = 'Cardiología clínica'
+		stale.save()
+		self.assertEqual(self.counters(), (1, 0))
+
+	def test_rebuild_command_repairs_drift(self):
+		Prestamo.objects.create(book=self.book, user=self.staff, status=Prestamo.STATUS_ACTIVE)
+		Libros.objects.filter(pk=self.book.pk).update(en_prestamo=7, pendientes=2)
+		call_command('rebuild_loan_counters', stdout=StringIO())
+		self.assertEqual(self.counters(), (1, 0))
+
+	def test_cart_checkout_claims_copies_and_creates_loans_in_bulk(self):
+		from django.db import connection
+		from django.test.utils import CaptureQueriesContext
+		with self.captureOnCommitCallbacks(execute=True):
+			agotado = Libros.objects.create(cota='WG 100 A 2', titulo='Agotado', autor='Autor, Dos', cantidad=1, user=self.staff)
+			otro = Libros.objects.create(cota='WG 100 A 3', titulo='Neumología', autor='Autor, Tres', cantidad=2, user=self.staff)
+		Prestamo.objects.create(book=agotado, user=self.staff, status=Prestamo.STATUS_ACTIVE)
+		self.client.force_login(self.staff)
+		session = self.client.session
+		session['loan_cart'] = [str(otro.pk), str(agotado.pk), str(self.book.pk), str(otro.pk), '999999']
+		session.save()
+		with CaptureQueriesContext(connection) as ctx, self.captureOnCommitCallbacks(execute=True):
+			response = self.client.post('/cart/checkout/', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+		data = response.json()
+		self.assertEqual(data['created'], 2)
+		self.assertEqual(sorted(f['reason'] for f in data['failed']), ['Libro no encontrado', 'Sin stock'])
+		self.assertEqual(self.counters(), (1, 0))
+		otro.refresh_from_db()
+		self.assertEqual(otro.en_prestamo, 1)
+		self.assertEqual(Prestamo.objects.filter(book=otro).count(), 1)
+		sql = [q['sql'] for q in ctx.captured_queries]
+		if connection.features.has_select_for_update:
+			# sólo se bloquean ejemplares (saltando los tomados por otro checkout), nunca el libro
+			locks = [s for s in sql if 'FOR UPDATE' in s]
+			self.assertEqual(len(locks), 3)
+			self.assertTrue(all('SKIP LOCKED' in s and '"tasks_ejemplar"' in s.split('WHERE')[0] for s in locks))
+		self.assertEqual(sum(s.startswith('INSERT INTO "tasks_prestamo"') for s in sql), 1)
+		self.assertEqual(sum(s.startswith('UPDATE "tasks_libros"') for s in sql), 1)
+		self.assertTrue(BookRanking.objects.filter(book=otro).exists())
+		loan = Prestamo.objects.get(book=otro)
+		self.assertEqual(list(loan.ejemplares.values_list('estado', flat=True)), [Ejemplar.ESTADO_PRESTADO])
+
+	def test_cart_checkout_survives_failing_after_commit_hooks(self):
+		from unittest import mock
+		self.client.force_login(self.staff)
+		session = self.client.session
+		session['loan_cart'] = [str(self.book.pk)]
+		session.save()
+		# p. ej. caché caída: los préstamos ya se confirmaron y el carrito debe vaciarse igual
+		with mock.patch('tasks.views.add_loans', side_effect=RuntimeError('caché caída')), \
+				self.captureOnCommitCallbacks(execute=True):
+			response = self.client.post('/cart/checkout/', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+		self.assertEqual(response.json()['created'], 1)
+		self.assertEqual(response.json()['remaining_count'], 0)
+		self.assertEqual(self.counters(), (1, 0))
+
+
+class InventoryTests(TestCase):
+	def setUp(self):
+		User = get_user_model()
+		self.staff = User.objects.create_user(username='inventario', password='testpass123', cedula=34343, telefono=12345678, security_question='q', security_answer='a', email='i@example.com', is_staff=True)
+		with self.captureOnCommitCallbacks(execute=True):
+			self.book = Libros.objects.create(cota='WG 200 B 1', titulo='Hematología', autor='Autor, Uno', cantidad=2, user=self.staff)
+
+	def states(self):
+		return list(self.book.ejemplares.order_by('pk').values_list('codigo_barras', 'estado'))
+
+	def set_quantity(self, cantidad):
+		with self.captureOnCommitCallbacks(execute=True):
+			self.book.cantidad = cantidad
+			self.book.save()
+
+	def test_copies_follow_book_quantity(self):
+		code = f'{self.book.pk:06d}'
+		self.assertEqual(self.states(), [(f'{code}-001', 'disponible'), (f'{code}-002', 'disponible')])
+		self.set_quantity(3)
+		self.assertEqual(len(self.states()), 3)
+		loan = Prestamo.objects.create(book=self.book, user=self.staff, status=Prestamo.STATUS_ACTIVE)
+		self.set_quantity(1)
+		# se dan de baja los libres más recientes; el prestado se conserva
+		self.assertEqual([e for _, e in self.states()], ['prestado', 'baja', 'baja'])
+		self.assertEqual(loan.ejemplares.count(), 1)
+		self.set_quantity(2)
+		self.assertEqual(self.states()[-1], (f'{code}-004', 'disponible'))
+
+	def test_loans_hold_copies_until_returned_or_deleted(self):
+		from . import inventory
+		loan = Prestamo.objects.create(book=self.book, user=self.staff, status=Prestamo.STATUS_PENDING)
+		self.assertEqual(inventory.free_counts([self.book.pk]), {self.book.pk: 1})
+		loan.status = Prestamo.STATUS_RETURN_PENDING
+		loan.save()
+		self.assertEqual(inventory.free_counts([self.book.pk]), {self.book.pk: 1})
+		loan.status = Prestamo.STATUS_RETURNED
+		loan.save()
+		self.assertEqual(inventory.free_counts([self.book.pk]), {self.book.pk: 2})
+		pending = Prestamo.objects.create(book=self.book, user=self.staff, status=Prestamo.STATUS_PENDING, cantidad=2)
+		self.assertEqual(pending.ejemplares.count(), 2)
+		self.client.force_login(self.staff)
+		self.client.get(f'/loan/requests/{pending.pk}/reject/')
+		self.assertEqual(inventory.free_counts([self.book.pk]), {self.book.pk: 2})
+
+	def test_returned_copies_beyond_quantity_are_retired(self):
+		from . import inventory
+		self.set_quantity(3)
+		loans = [Prestamo.objects.create(book=self.book, user=self.staff, status=Prestamo.STATUS_ACTIVE) for _ in range(2)]
+		self.set_quantity(1)
+		for loan in loans:
+			loan.status = Prestamo.STATUS_RETURNED
+			loan.save()
+		self.assertEqual(inventory.free_counts([self.book.pk]), {self.book.pk: 1})
+		self.assertEqual(self.book.ejemplares.exclude(estado=Ejemplar.ESTADO_BAJA).count(), 1)
+
+	def test_checkout_fails_without_free_copy(self):
+		Prestamo.objects.create(book=self.book, user=self.staff, status=Prestamo.STATUS_ACTIVE, cantidad=2)
+		self.client.force_login(self.staff)
+		response = self.client.get(f'/cart/add/{self.book.pk}/', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+		self.assertFalse(response.json()['ok'])
+
+	def test_sync_command_releases_orphaned_copies(self):
+		loan = Prestamo.objects.create(book=self.book, user=self.staff, status=Prestamo.STATUS_ACTIVE)
+		Prestamo.objects.filter(pk=loan.pk).update(status=Prestamo.STATUS_RETURNED)
+		Libros.objects.filter(pk=self.book.pk).update(cantidad=1)
+		out = StringIO()
+		call_command('sync_copies', stdout=out)
+		self.assertIn('1 dados de baja, 1 liberados', out.getvalue())
+		self.assertEqual([e for _, e in self.states()], ['disponible', 'baja'])
+
+
+class KeysetPaginationTests(TestCase):
+	def setUp(self):
+		User = get_user_model()
+		self.user = User.objects.create_user(username='paginador', password='testpass123', cedula=44444, telefono=12345678, security_question='q', security_answer='a', email='p@example.com', is_staff=True)
+		for i in range(7):
+			# fechas repetidas y nulas para probar el desempate por id y el orden de los NULL
+			fecha = None if i % 3 == 0 else f'200{i % 2}'
+			Libros.objects.create(cota=f'WG {100 + i}', titulo=f'Libro {i}', autor='Autor, Uno', fecha_publicacion=fecha, user=self.user)
+
+	def walk(self, ordering):
+		paginator = KeysetPaginator(Libros.objects.all(), ordering, 3)
+		page = paginator.get_page()
+		pages = [page]
+		while page.next_cursor:
+			page = paginator.get_page(page.next_cursor)
+			pages.append(page)
+		return paginator, pages
+
+	def test_pages_cover_ordered_rows_without_overlap(self):
+		for ordering in (['fecha_publicacion'], ['-fecha_publicacion'], ['cota']):
+			paginator, pages = self.walk(ordering)
+			seen = [b.pk for page in pages for b in page]
+			self.assertEqual(seen, [b.pk for b in paginator.ordered()])
+			self.assertEqual(len(seen), 7)
+
+	def test_previous_cursor_returns_previous_page(self):
+		paginator, pages = self.walk(['-fecha_publicacion'])
+		back = paginator.get_page(pages[2].previous_cursor)
+		self.assertEqual([b.pk for b in back], [b.pk for b in pages[1]])
+		self.assertTrue(back.has_previous())
+
+	def test_catalog_first_page_is_keyset_without_count(self):
+		from django.db import connection
+		from django.test.utils import CaptureQueriesContext
+		for i in range(7, 25):
+			Libros.objects.create(cota=f'WG {100 + i}', titulo=f'Libro {i}', autor='Autor, Uno', user=self.user)
+		self.client.force_login(self.user)
+		with CaptureQueriesContext(connection) as queries:
+			first = self.client.get('/tasks/')
+		self.assertTrue(first.context['tasks'].keyset)
+		self.assertFalse(first.context['tasks'].has_previous())
+		self.assertFalse(any('OFFSET' in q['sql'] or 'COUNT(*) AS "__count"' in q['sql'] for q in queries.captured_queries))
+		second = self.client.get('/tasks/', {'cursor': first.context['tasks'].next_cursor})
+		self.assertTrue(second.context['tasks'].keyset)
+		cotas = [b.cota for b in first.context['tasks']] + [b.cota for b in second.context['tasks']]
+		self.assertEqual(cotas, sorted(f'WG {100 + i}' for i in range(25)))
+		self.assertIsNone(second.context['tasks'].next_cursor)
+
+	def test_catalog_load_more_continues_offset_page(self):
+		for i in range(7, 45):
+			Libros.objects.create(cota=f'WG {100 + i}', titulo=f'Libro {i}', autor='Autor, Uno', user=self.user)
+		self.client.force_login(self.user)
+		second = self.client.get('/tasks/', {'page': 2})
+		self.assertFalse(second.context['tasks'].keyset)
+		third = self.client.get('/tasks/', {'cursor': second.context['tasks'].next_cursor})
+		cotas = [b.cota for b in second.context['tasks']] + [b.cota for b in third.context['tasks']]
+		self.assertEqual(cotas, sorted(f'WG {100 + i}' for i in range(45))[20:])
+
+
+class CatalogFacetTests(TestCase):
+	def setUp(self):
+		User = get_user_model()
+		self.user = User.objects.create_user(username='facetas', password='testpass123', cedula=55555, telefono=12345678, security_question='q', security_answer='a', email='f@example.com')
+		with self.captureOnCommitCallbacks(execute=True):
+			self.book = Libros.objects.create(cota='WG 1', titulo='Cardiología', autor='Autor, Uno', editorial='Salvat', fecha_publicacion=1995, contenido='ilustraciones,tablas', user=self.user)
+			loaned = Libros.objects.create(cota='WG 2', titulo='Cardiología clínica', autor='Autor, Dos', editorial='Salvat', fecha_publicacion=2003, contenido='tablas', cantidad=1, user=self.user)
+			Libros.objects.create(cota='WG 3', titulo='Anatomía', autor='Autor, Tres', editorial='', user=self.user)
+		with self.captureOnCommitCallbacks(execute=True):
+			self.loan = Prestamo.objects.create(book=loaned, user=self.user, status=Prestamo.STATUS_ACTIVE)
+
+	def test_counts_come_from_a_single_query(self):
+		with self.assertNumQueries(1):
+			counts = facet_counts(Libros.objects.all())
+		self.assertEqual(counts['editorial'], {'Salvat': 2, '-': 1})
+		self.assertEqual(counts['decada'], {1990: 1, 2000: 1, '-': 1})
+		self.assertEqual(counts['contenido']['tablas'], 2)
+		self.assertEqual(counts['contenido']['ilustraciones'], 1)
+		self.assertEqual(counts['disponible'], 2)
+
+	def test_facet_filters_narrow_results_and_counts(self):
+		response = self.client.get('/tasks/', {'editorial': 'Salvat', 'contenido': 'tablas', 'disponible': '1'})
+		self.assertEqual([b.cota for b in response.context['tasks']], ['WG 1'])
+		facets = {f['name']: f for f in response.context['facets']}
+		self.assertEqual([(v['label'], v['count']) for v in facets['decada']['values']], [('1990–1999', 1)])
+		self.assertTrue(facets['editorial']['values'][0]['selected'])
+
+	def test_pending_loans_hold_copies(self):
+		with self.captureOnCommitCallbacks(execute=True):
+			self.book.cantidad = 2
+			self.book.save()
+		with self.captureOnCommitCallbacks(execute=True):
+			Prestamo.objects.create(book=self.book, user=self.user, status=Prestamo.STATUS_ACTIVE)
+			Prestamo.objects.create(book=self.book, user=self.user, status=Prestamo.STATUS_PENDING)
+		self.assertEqual(facet_counts(Libros.objects.all())['disponible'], 1)
+		response = self.client.get('/tasks/', {'disponible': '1'})
+		self.assertEqual([b.cota for b in response.context['tasks']], ['WG 3'])
+
+	def test_return_pending_loan_keeps_book_unavailable_everywhere(self):
+		with self.captureOnCommitCallbacks(execute=True):
+			self.loan.status = Prestamo.STATUS_RETURN_PENDING
+			self.loan.save()
+		self.assertEqual(facet_counts(Libros.objects.all())['disponible'], 2)
+		self.client.force_login(self.user)
+		response = self.client.get('/tasks/')
+		book = next(b for b in response.context['tasks'] if b.cota == 'WG 2')
+		self.assertEqual((book.cota, book.prestados, book.total), ('WG 2', 1, 1))
+		self.assertNotIn('WG 2', [b.cota for b in self.client.get('/tasks/', {'disponible': '1'}).context['tasks']])
+		response = self.client.post(f'/cart/add/{book.pk}/', HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+		self.assertFalse(response.json()['ok'])
+		self.assertEqual(self.client.get('/catalog/suggest/', {'q': 'clinica'}).json()['results'][0]['disponibles'], 0)
+
+
+class AutocompleteCodeIndexTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		for codigo in ('QS 4', 'QS 18.2', 'WG 18', 'WB 100'):
+			DictionaryEntry.objects.create(codigo=codigo, descripcion='d')
+		DictionaryEntry.objects.create(codigo='QS 180', descripcion='d', is_active=False)
+
+	def test_prefix_and_infix_match_without_queries(self):
+		self.client.get('/autocomplete/codes/', {'q': 'qs'})
+		with self.assertNumQueries(0):
+			response = self.client.get('/autocomplete/codes/', {'q': '18'})
+		self.assertEqual(response.json()['results'], ['QS 18.2', 'WG 18'])
+		self.assertEqual(self.client.get('/autocomplete/codes/', {'q': 'qs'}).json()['results'], ['QS 18.2', 'QS 4'])
+
+	def test_index_follows_dictionary_changes(self):
+		self.assertEqual(self.client.get('/autocomplete/codes/', {'q': 'wb'}).json()['results'], ['WB 100'])
+		with self.captureOnCommitCallbacks(execute=True):
+			DictionaryEntry.objects.filter(codigo='WB 100').get().delete()
+			DictionaryEntry.objects.create(codigo='WB 200', descripcion='d')
+		self.assertEqual(self.client.get('/autocomplete/codes/', {'q': 'wb'}).json()['results'], ['WB 200'])
+
+	def test_etag_revalidation(self):
+		response = self.client.get('/autocomplete/codes/', {'q': 'wg'})
+		self.assertIn('max-age', response['Cache-Control'])
+		again = self.client.get('/autocomplete/codes/', {'q': 'wg'}, HTTP_IF_NONE_MATCH=response['ETag'])
+		self.assertEqual(again.status_code, 304)
+
+
+class CatalogSuggestTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		User = get_user_model()
+		self.user = User.objects.create_user(username='sugerencias', password='testpass123', cedula=66666, telefono=12345678, security_question='q', security_answer='a', email='g@example.com')
+		with self.captureOnCommitCallbacks(execute=True):
+			self.book = Libros.objects.create(cota='WG 200', titulo='Fisiología Médica', autor='Guyton, Arthur', cantidad=2, user=self.user)
+			Libros.objects.create(cota='QS 4', titulo='Anatomía', autor='Moore, Keith', user=self.user)
+
+	def suggest(self, q):
+		return self.client.get('/catalog/suggest/', {'q': q}).json()['results']
+
+	def test_suggestions_by_word_prefix_without_queries(self):
+		self.suggest('fis')
+		with self.assertNumQueries(0):
+			results = self.suggest('fisio guy')
+		self.assertEqual([(r['cota'], r['disponibles']) for r in results], [('WG 200', 2)])
+		self.assertEqual(self.suggest('MOORE')[0]['titulo'], 'Anatomía')
+
+	def test_index_is_updated_incrementally(self):
+		self.suggest('fis')
+		with self.captureOnCommitCallbacks(execute=True):
+			Prestamo.objects.create(book=self.book, user=self.user, status=Prestamo.STATUS_ACTIVE)
+		with self.captureOnCommitCallbacks(execute=True):
+			self.book.titulo = 'Tratado de fisiología'
+			self.book.save()
+		with self.assertNumQueries(0):
+			results = self.suggest('tratado')
+		self.assertEqual(results[0]['disponibles'], 1)
+		with self.captureOnCommitCallbacks(execute=True):
+			self.book.delete()
+		self.assertEqual(self.suggest('tratado'), [])
+
+	def test_loans_do_not_invalidate_other_workers(self):
+		from .cache_utils import get_version
+		from .indexes import BOOK_SUGGESTIONS, BookSuggestIndex
+		other = BookSuggestIndex()  # índice de otro worker, construido antes del préstamo
+		other.ensure_current()
+		version = get_version(BOOK_SUGGESTIONS)
+		with self.captureOnCommitCallbacks(execute=True):
+			Prestamo.objects.create(book=self.book, user=self.user, status=Prestamo.STATUS_ACTIVE)
+		self.assertEqual(get_version(BOOK_SUGGESTIONS), version)
+		with self.assertNumQueries(0):
+			results = other.suggest('fisio')
+		self.assertEqual(results[0]['disponibles'], 1)
+
+	def test_index_outlives_published_free_copies_only_until_rebuilt(self):
+		from .indexes import BookSuggestIndex, FREE_KEY, FREE_TIMEOUT
+		other = BookSuggestIndex()
+		other.ensure_current()
+		with self.captureOnCommitCallbacks(execute=True):
+			Prestamo.objects.create(book=self.book, user=self.user, status=Prestamo.STATUS_ACTIVE)
+		# el valor publicado caduca (o la caché lo desaloja) junto con la vida útil del índice
+		cache.delete(FREE_KEY.format(self.book.pk))
+		other._built_at -= FREE_TIMEOUT
+		self.assertEqual(other.suggest('fisio')[0]['disponibles'], 1)
+
+
+class DictionarySearchTests(TestCase):
+	def setUp(self):
+		DictionaryEntry.objects.create(codigo='WG 200', descripcion='Enfermedades del corazón', descripcion_en='Heart diseases')
+		DictionaryEntry.objects.create(codigo='W 100', descripcion='Práctica médica', descripcion_en='Medical practice')
+		DictionaryEntry.objects.create(codigo='QS 4', descripcion='Obras generales', descripcion_en='General works')
+
+	def test_prefix_is_derived_from_code(self):
+		self.assertEqual(DictionaryEntry.objects.get(codigo='WG 200').prefijo, 'WG')
+
+	def test_search_highlights_spanish_and_english(self):
+		response = self.client.get('/dictionary/', {'q': 'corazón'})
+		entries = list(response.context['entries'])
+		self.assertEqual([e.codigo for e in entries], ['WG 200'])
+		self.assertIn('<mark>corazón</mark>', entries[0].snippet_es)
+		response = self.client.get('/dictionary/', {'q': 'disease'})
+		self.assertEqual([e.codigo for e in response.context['entries']], ['WG 200'])
+
+	def test_code_search_matches_inside_the_code(self):
+		DictionaryEntry.objects.create(codigo='QS 18.2', descripcion='Histología', descripcion_en='Histology')
+		for q in ('18.2', 'qs  18', 'QS 18.2'):
+			response = self.client.get('/dictionary/', {'q': q})
+			self.assertEqual([e.codigo for e in response.context['entries']], ['QS 18.2'], q)
+
+	def test_classification_filter_uses_exact_prefix(self):
+		response = self.client.get('/dictionary/', {'clas': 'W-Medicina General. Profesiones de la Salud'})
+		self.assertEqual([e.codigo for e in response.context['entries']], ['W 100'])
+
+
+class CotaPrefixCacheTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		DictionaryEntry.objects.create(codigo='QS 4', descripcion='d')
+		DictionaryEntry.objects.create(codigo='WG 18', descripcion='d')
+
+	def test_form_uses_cached_prefixes(self):
+		TaskForm()
+		with self.assertNumQueries(0):
+			form = TaskForm()
+		self.assertEqual([c for c, _ in form.fields['cota_part1'].choices], ['', 'QS', 'WG'])
+		with self.captureOnCommitCallbacks(execute=True):
+			DictionaryEntry.objects.create(codigo='WB 100', descripcion='d')
+		self.assertIn(('WB', 'WB'), TaskForm().fields['cota_part1'].choices)
+
+
+class CodeResolverTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		code_resolver.clear()
+		self.exact = DictionaryEntry.objects.create(codigo='QS 18', descripcion='d')
+		self.longer = DictionaryEntry.objects.create(codigo='QS 18.2', descripcion='d')
+
+	def test_exact_then_prefix_with_normalized_key(self):
+		self.assertEqual(DictionaryEntry.objects.get(pk=self.longer.pk).codigo_key, 'QS 18.2')
+		self.assertEqual(resolve_code(' qs   18 ').pk, self.exact.pk)
+		self.assertEqual(resolve_code('qs 18.').pk, self.longer.pk)
+		self.assertIsNone(resolve_code('WG 1'))
+
+	def test_lru_cache_and_invalidation(self):
+		resolve_code('WG 1')
+		with self.assertNumQueries(0):
+			self.assertIsNone(resolve_code('wg 1'))
+		with self.captureOnCommitCallbacks(execute=True):
+			DictionaryEntry.objects.create(codigo='WG 1', descripcion='d')
+		self.assertEqual(resolve_code('wg 1').codigo, 'WG 1')
+
+
+class ClassificationSyncTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		classification_map.clear()
+		User = get_user_model()
+		self.user = User.objects.create_user(username='clasif', password='testpass123', cedula=77777, telefono=12345678, security_question='q', security_answer='a', email='c@example.com')
+		self.clas = Clasificacion.objects.create(code='WG', label='')
+		self.entries = [DictionaryEntry.objects.create(codigo=f'WG {i}', clasificacion='WG-Sistema Cardiovascular') for i in range(1, 4)]
+
+	def test_save_assigns_classification_without_extra_queries(self):
+		first = Libros.objects.create(cota='WG 1 A 1', titulo='Uno', autor='Autor', dictionary_entry_id=self.entries[0].pk, user=self.user)
+		self.assertEqual(first.classification_id, self.clas.pk)
+		self.clas.refresh_from_db()
+		self.assertEqual(self.clas.label, 'Sistema Cardiovascular')
+		with self.assertNumQueries(1):
+			Libros.objects.create(cota='WG 1 A 2', titulo='Dos', autor='Autor', dictionary_entry_id=self.entries[0].pk, user=self.user)
+
+	def test_batch_assign_prefetches_entries(self):
+		books = [Libros(cota=f'WG {i} B 1', dictionary_entry_id=e.pk) for i, e in enumerate(self.entries)]
+		books.append(Libros(cota='QS 4 B 1', dictionary_entry=DictionaryEntry(codigo='QS 4', clasificacion='QS-Anatomía Humana')))
+		# carga del mapa, entradas en una consulta, etiqueta de WG y get_or_create de QS (SELECT, SAVEPOINT, INSERT, RELEASE)
+		with self.assertNumQueries(7):
+			classification_map.assign(books)
+		self.assertEqual({b.classification_id for b in books[:3]}, {self.clas.pk})
+		self.assertEqual(Clasificacion.objects.get(pk=books[3].classification_id).label, 'Anatomía Humana')
+
+
+class BookImportCommandTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		classification_map.clear()
+		code_resolver.clear()
+		User = get_user_model()
+		self.admin = User.objects.create_superuser(username='importador', password='testpass123', cedula=88888, telefono=12345678, security_question='q', security_answer='a', email='i@example.com')
+		self.entry = DictionaryEntry.objects.create(codigo='WG 200', clasificacion='WG-Sistema Cardiovascular')
+		Libros.objects.create(cota='QS 4 A 1', titulo='Existente', autor='Autor', user=self.admin)
+
+	def _write(self, name, content):
+		import os, tempfile
+		path = os.path.join(tempfile.mkdtemp(), name)
+		with open(path, 'w', encoding='utf-8') as f:
+			f.write(content)
+		return path
+
+	def test_csv_import_inserts_valid_rows_and_reports_rejects(self):
+		path = self._write('libros.csv', (
+			'cota;titulo;autor;cantidad;fecha_registro;contenido\n'
+			'wg  200 a 1;Cardiología;Pérez;3;15/03/2020;mapas,otro\n'
+			'WG 200 A 1;Repetido;Pérez;1;;\n'
+			'QS 4 A 1;Ya existe;Autor;1;;\n'
+			'QS 5 A 1;Sin autor;;1;;\n'
+			'QS 6 A 1;Cantidad mala;Autor;muchos;;\n'
+			'QS 7 A 1;Cantidad negativa;Autor;-1;;\n'
+		))
+		rejects = path + '.rechazos.csv'
+		out = StringIO()
+		call_command('import_books', path, '--batch-size', '2', '--rejects', rejects, stdout=out)
+		book = Libros.objects.get(cota='WG 200 A 1')
+		self.assertEqual(book.titulo, 'Cardiología')
+		self.assertEqual(book.cantidad, 3)
+		self.assertEqual(book.contenido, 'mapas')
+		self.assertEqual(book.dictionary_entry_id, self.entry.pk)
+		self.assertEqual(book.classification.code, 'WG')
+		self.assertEqual(book.titulo_norm, 'cardiologia')
+		self.assertEqual(book.user, self.admin)
+		self.assertEqual(Libros.objects.count(), 2)
+		with open(rejects, encoding='utf-8') as f:
+			self.assertEqual(len(f.read().strip().splitlines()), 6)
+		self.assertIn('1 libros; 5 filas rechazadas', out.getvalue())
+
+	def test_out_of_range_numbers_reject_the_row(self):
+		path = self._write('libros.jsonl', '\n'.join([
+			'{"cota": "WG 200 C 1", "titulo": "Bien", "autor": "A", "edicion": "2"}',
+			'{"cota": "WG 200 C 2", "titulo": "Edición", "autor": "A", "edicion": "99"}',
+			'{"cota": "WG 200 C 3", "titulo": "Volumen", "autor": "A", "volumen": "-3"}',
+			'{"cota": "WG 200 C 4", "titulo": "Páginas", "autor": "A", "paginas": "99999999999999999999"}',
+			'{"cota": "WG 200 C 5", "titulo": "Serie", "autor": "A", "numero_serie": "-99999999999999999999"}',
+		]) + '\n')
+		out = StringIO()
+		call_command('import_books', path, stdout=out)
+		self.assertEqual(list(Libros.objects.filter(cota__startswith='WG 200 C').values_list('cota', flat=True)), ['WG 200 C 1'])
+		self.assertIn('1 libros; 4 filas rechazadas', out.getvalue())
+
+	def test_jsonl_dry_run_does_not_insert(self):
+		path = self._write('libros.jsonl', '{"cota": "WG 200 B 1", "titulo": "Uno", "autor": "A", "paginas": "120.0"}\nno es json\n')
+		out = StringIO()
+		clasificaciones = Clasificacion.objects.count()
+		call_command('import_books', path, '--dry-run', stdout=out)
+		self.assertFalse(Libros.objects.filter(cota='WG 200 B 1').exists())
+		# la cota corresponde a WG 200, pero la clasificación WG no se crea en la simulación
+		self.assertEqual(Clasificacion.objects.count(), clasificaciones)
+		self.assertFalse(Clasificacion.objects.filter(code='WG').exists())
+		self.assertIn('se insertarían 1 libros; 1 filas rechazadas', out.getvalue())
+
+
+class DictionaryImportCommandTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		DictionaryEntry.objects.create(codigo='QS 1', descripcion='Viejo', clasificacion='Anatomía humana')
+		DictionaryEntry.objects.create(codigo='QS 4', descripcion='Obras generales', clasificacion='Anatomía humana')
+		DictionaryEntry.objects.create(codigo='QS 9', descripcion='Retirado', clasificacion='Anatomía humana')
+
+	def _write(self, content):
+		import os, tempfile
+		path = os.path.join(tempfile.mkdtemp(), 'diccionario.csv')
+		with open(path, 'w', encoding='utf-8') as f:
+			f.write(content)
+		return path
+
+	def _csv(self):
+		return self._write(
+			'codigo;descripcion;descripcion_en;clasificacion\n'
+			'QS 1;Organizaciones;Organizations;Anatomía humana\n'
+			'QS 4;Obras generales;;Anatomía humana\n'
+			'wg  200;Corazón;Heart;Sistema cardiovascular\n'
+			'[QS 32];Este número no se utiliza;;Anatomía humana\n'
+		)
+
+	def test_import_applies_only_differences(self):
+		from .cache_utils import get_version
+		from .indexes import DICTIONARY_CODES
+		version = get_version(DICTIONARY_CODES)
+		out = StringIO()
+		with self.captureOnCommitCallbacks(execute=True):
+			call_command('import_dictionary', self._csv(), '--deactivate-missing', stdout=out)
+		self.assertIn('2 nuevas, 1 modificadas, 1 inhabilitadas, 1 sin cambios', out.getvalue())
+		self.assertEqual(DictionaryEntry.objects.get(codigo='QS 1').descripcion_en, 'Organizations')
+		nueva = DictionaryEntry.objects.get(codigo='wg  200')
+		self.assertEqual((nueva.prefijo, nueva.codigo_key, nueva.is_active), ('WG', 'WG 200', True))
+		self.assertEqual(DictionaryEntry.objects.get(codigo='[QS 32]').prefijo, '')
+		self.assertFalse(DictionaryEntry.objects.get(codigo='QS 9').is_active)
+		self.assertNotEqual(get_version(DICTIONARY_CODES), version)
+
+		# una segunda importación no escribe nada; sin la opción no se inhabilita
+		out = StringIO()
+		with self.assertNumQueries(1):
+			call_command('import_dictionary', self._csv(), stdout=out)
+		self.assertIn('0 nuevas, 0 modificadas, 0 inhabilitadas, 4 sin cambios', out.getvalue())
+
+	def test_apply_does_not_load_deferred_fields_per_row(self):
+		from django.db import connection
+		from django.test.utils import CaptureQueriesContext
+		from .importers import DictionarySync
+		with open(self._csv(), encoding='utf-8') as fh:
+			sync = DictionarySync().load(fh)
+		self.assertEqual(len(sync.updates), 1)
+		with CaptureQueriesContext(connection) as queries:
+			sync.apply()
+		self.assertFalse([q for q in queries if q['sql'].startswith('SELECT')])
+		self.assertEqual(DictionaryEntry.objects.get(codigo='QS 1').codigo_key, 'QS 1')
+
+	def test_dry_run_reports_without_writing(self):
+		out = StringIO()
+		call_command('import_dictionary', self._csv(), '--dry-run', stdout=out)
+		self.assertIn('nueva: wg  200', out.getvalue())
+		self.assertFalse(DictionaryEntry.objects.filter(codigo='wg  200').exists())
+		self.assertEqual(DictionaryEntry.objects.get(codigo='QS 1').descripcion, 'Viejo')
+
+
+def _marc_record(fields, utf8=True):
+	"""Registro ISO 2709 a partir de ``[(tag, datos)]``; los datos de campos >= 010 llevan indicadores y subcampos.
+
+	Con ``utf8=False`` la cabecera declara MARC-8 y los datos se pasan ya codificados (bytes)."""
+	directory, data = b'', b''
+	for tag, value in fields:
+		raw = (value.encode('utf-8') if utf8 else value) + b'\x1e'
+		directory += f'{tag}{len(raw):04d}{len(data):05d}'.encode('ascii')
+		data += raw
+	base = 24 + len(directory) + 1
+	length = base + len(data) + 1
+	leader = f'{length:05d}nam {"a" if utf8 else " "}22{base:05d}   4500'.encode('ascii')
+	return leader + directory + b'\x1e' + data + b'\x1d'
+
+
+class MarcImportTests(TestCase):
+	def setUp(self):
+		cache.clear()
+		classification_map.clear()
+		code_resolver.clear()
+		User = get_user_model()
+		self.admin = User.objects.create_superuser(username='marc', password='testpass123', cedula=99999, telefono=12345678, security_question='q', security_answer='a', email='m@example.com')
+		self.entry = DictionaryEntry.objects.create(codigo='WG 200', clasificacion='WG-Sistema Cardiovascular')
+
+	def _path(self, name, content):
+		import os, tempfile
+		path = os.path.join(tempfile.mkdtemp(), name)
+		with open(path, 'wb') as f:
+			f.write(content)
+		return path
+
+	def test_iso2709_records_map_onto_libros(self):
+		sf = '\x1f'
+		records = _marc_record([
+			('008', '200101s2019    sp a          000 0 spa d'),
+			('060', f'00{sf}aWG 200{sf}b.P4 2019'),
+			('100', f'1 {sf}aPérez, Juan,'),
+			('245', f'10{sf}aCardiología clínica :{sf}bfundamentos /{sf}cJuan Pérez.'),
+			('250', f'  {sf}a3a ed.'),
+			('264', f' 1{sf}aCaracas :{sf}bEditorial Médica,{sf}c2019.'),
+			('300', f'  {sf}axii, 450 p. :{sf}bil., tablas ;{sf}c24 cm.'),
+			('700', f'1 {sf}aGómez, Ana.'),
+		]) + b'\n' + _marc_record([('245', f'10{sf}aSin signatura')])
+		out = StringIO()
+		call_command('import_books', self._path('lote.mrc', records), stdout=out)
+		book = Libros.objects.get()
+		self.assertEqual(book.cota, 'WG 200 P 4')
+		self.assertEqual((book.titulo, book.subtitulo, book.autor, book.co_autor), ('Cardiología clínica', 'fundamentos', 'Pérez, Juan', 'Gómez, Ana'))
+		self.assertEqual((book.editorial, book.ubicacion_publicacion, book.fecha_publicacion), ('Editorial Médica', 'Caracas', 2019))
+		self.assertEqual((book.edicion, book.paginas, book.dimensiones), (3, 450, '24 cm'))
+		self.assertEqual(book.contenido, 'ilustraciones,tablas')
+		self.assertEqual(book.dictionary_entry_id, self.entry.pk)
+		self.assertIn('1 filas rechazadas', out.getvalue())
+
+	def test_iso2709_rejects_bad_lengths_and_resyncs(self):
+		from .importers import RowError
+		from .marc import MarcRecord, iter_iso2709
+		sf = '\x1f'
+		good = _marc_record([('245', f'10{sf}aBueno')])
+		too_long = b'%05d' % (len(good) + 40) + good[5:]
+		stream = b''.join([
+			b'00010nam\x1d',  # menor que la cabecera
+			good,
+			too_long,  # el terminador llega antes de lo declarado: los bytes siguientes no se pierden
+			good,
+			b'xx12' + good,  # longitud ilegible
+			good[:-10],  # cortado al final del archivo
+		])
+		results = [value for _, value in iter_iso2709(BytesIO(stream))]
+		self.assertEqual(
+			[type(value) for value in results],
+			[RowError, MarcRecord, RowError, MarcRecord, RowError, RowError],
+		)
+		self.assertIn('truncado', str(results[-1]))
+
+	def test_marc8_diacritics_follow_their_base_letter(self):
+		from .importers import RowError
+		from .marc import parse_iso2709
+		record = parse_iso2709(_marc_record([
+			('100', b'1 \x1faM\xe8uller, Jos\xe2e,'),
+			('245', b'10\x1faFisiolog\xe2ia m\xe2edica /\x1fcA. Pe\xe4na ; \xa2stergaard.'),
+		], utf8=False))
+		self.assertEqual(record.first(['100'], 'a'), 'Müller, José,')
+		self.assertEqual(record.first(['245'], 'a'), 'Fisiología médica /')
+		self.assertEqual(record.first(['245'], 'c'), 'A. Peña ; Østergaard.')
+		with self.assertRaises(RowError):
+			parse_iso2709(_marc_record([('245', b'10\x1fa\x1b(S\x41\x1b(B')], utf8=False))
+
+	def test_marcxml_is_read_with_iterparse(self):
+		xml = (
+			'<?xml version="1.0" encoding="UTF-8"?>'
+			'<collection xmlns="http://www.loc.gov/MARC21/slim">'
+			'<record><leader>00000nam a2200000   4500</leader>'
+			'<controlfield tag="008">200101s2015    sp</controlfield>'
+			'<datafield tag="096" ind1=" " ind2=" "><subfield code="a">WG 200</subfield><subfield code="b">R12</subfield></datafield>'
+			'<datafield tag="110" ind1="2" ind2=" "><subfield code="a">Sociedad de Cardiología.</subfield></datafield>'
+			'<datafield tag="245" ind1="1" ind2="0"><subfield code="a">Guías /</subfield></datafield>'
+			'<datafield tag="490" ind1="0" ind2=" "><subfield code="a">Monografías ;</subfield><subfield code="v">7</subfield></datafield>'
+			'</record></collection>'
+		)
+		call_command('import_books', self._path('lote.xml', xml.encode('utf-8')), stdout=StringIO())
+		book = Libros.objects.get()
+		self.assertEqual((book.cota, book.titulo, book.autor), ('WG 200 R 12', 'Guías', 'Sociedad de Cardiología'))
+		self.assertEqual((book.fecha_publicacion, book.serie, book.numero_serie), (2015, 'Monografías', 7))
+
+
+class ExportTests(TestCase):
+	def setUp(self):
+		User = get_user_model()
+		self.admin = User.objects.create_superuser(username='exportador', password='testpass123', cedula=55555, telefono=12345678, security_question='q', security_answer='a', email='e@example.com')
+		self.book = Libros.objects.create(cota='WG 200 A 1', titulo='Cardiología, "clínica"', autor='Pérez', user=self.admin)
+		Prestamo.objects.create(book=self.book, user=self.admin, status=Prestamo.STATUS_RETURNED, cantidad=1)
+		Prestamo.objects.create(book=self.book, user=self.admin, status=Prestamo.STATUS_ACTIVE, cantidad=2)
+
+	def test_books_csv_is_streamed_to_superusers(self):
+		import csv as csv_module
+		self.assertEqual(self.client.get('/adminpanel/export/books/').status_code, 302)
+		self.client.force_login(self.admin)
+		response = self.client.get('/adminpanel/export/books/')
+		self.assertTrue(response.streaming)
+		self.assertIn('catalogo-', response['Content-Disposition'])
+		rows = list(csv_module.reader(b''.join(response.streaming_content).decode('utf-8-sig').splitlines()))
+		self.assertEqual(rows[0][:3], ['id', 'cota', 'titulo'])
+		self.assertEqual(rows[1][1:3], ['WG 200 A 1', 'Cardiología, "clínica"'])
+
+	def test_loans_jsonl_filters_by_status(self):
+		import json
+		self.client.force_login(self.admin)
+		response = self.client.get('/adminpanel/export/loans/', {'format': 'jsonl', 'status': 'active'})
+		lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+		self.assertEqual(len(lines), 1)
+		loan = json.loads(lines[0])
+		self.assertEqual((loan['cota'], loan['cantidad'], loan['estado'], loan['usuario']), ('WG 200 A 1', 2, 'active', 'exportador'))
+
+	def test_export_command_writes_file(self):
+		import os, tempfile
+		path = os.path.join(tempfile.mkdtemp(), 'prestamos.csv')
+		call_command('export_data', 'loans', '--output', path, '--chunk-size', '1', stderr=StringIO())
+		with open(path, encoding='utf-8-sig') as f:
+			self.assertEqual(len(f.read().splitlines()), 3)
+
+
+class PdfCardCacheTests(TestCase):
+	def setUp(self):
+		import tempfile
+		self.card_dir = tempfile.mkdtemp()
+		override = self.settings(CARD_CACHE_DIR=self.card_dir)
+		override.enable()
+		self.addCleanup(override.disable)
+		User = get_user_model()
+		self.user = User.objects.create_user(username='fichas', password='testpass123', cedula=44444, telefono=12345678, security_question='q', security_answer='a', email='f@example.com')
+		self.book = Libros.objects.create(cota='WG 200 A 1', titulo='Cardiología', autor='Pérez', user=self.user)
+
+	def test_card_is_cached_per_version_and_revalidated(self):
+		import os
+		from unittest import mock
+		response = self.client.get(f'/book/{self.book.pk}/card/')
+		self.assertEqual(response.status_code, 200)
+		self.assertTrue(response.content.startswith(b'%PDF'))
+		etag = response['ETag']
+		self.assertIn('Last-Modified', response)
+		self.assertEqual(len(os.listdir(self.card_dir)), 1)
+
+		with mock.patch('tasks.cards.render_card', side_effect=AssertionError('no debe regenerarse')):
+			self.assertEqual(self.client.get(f'/book/{self.book.pk}/card/').content, response.content)
+			self.assertEqual(self.client.get(f'/book/{self.book.pk}/card/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+		self.book.titulo = 'Cardiología clínica'
+		self.book.save()
+		self.assertEqual(self.book.version, 2)
+		response = self.client.get(f'/book/{self.book.pk}/card/', HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 200)
+		self.assertNotEqual(response['ETag'], etag)
+		self.assertEqual(len(os.listdir(self.card_dir)), 1)
+
+	def test_concurrent_saves_do_not_reuse_a_version(self):
+		stale = Libros.objects.get(pk=self.book.pk)
+		self.book.titulo = 'Cardiología clínica'
+		self.book.save()
+		stale.autor = 'Pérez Gómez'
+		stale.save()
+		self.assertEqual((self.book.version, stale.version), (2, 3))
+		self.book.refresh_from_db()
+		self.assertEqual(self.book.version, 3)
+
+	def test_counter_updates_do_not_change_the_card(self):
+		etag = self.client.get(f'/book/{self.book.pk}/card/')['ETag']
+		Prestamo.objects.create(book=self.book, user=self.user, status=Prestamo.STATUS_ACTIVE)
+		self.assertEqual(self.client.get(f'/book/{self.book.pk}/card/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class PdfCardBatchTests(TestCase):
+	def setUp(self):
+		import tempfile
+		override = self.settings(CARD_CACHE_DIR=tempfile.mkdtemp())
+		override.enable()
+		self.addCleanup(override.disable)
+		User = get_user_model()
+		self.staff = User.objects.create_user(username='circulacion', password='testpass123', cedula=33333, telefono=12345678, security_question='q', security_answer='a', email='s@example.com', is_staff=True)
+		wg = Clasificacion.objects.create(code='WG', label='Sistema Cardiovascular')
+		qs = Clasificacion.objects.create(code='QS', label='Anatomía')
+		for i in range(1, 4):
+			Libros.objects.create(cota=f'WG {i}00 A 1', titulo=f'Libro {i}', autor='Autor', classification=wg, user=self.staff)
+		Libros.objects.create(cota='QS 4 A 1', titulo='Otro', autor='Autor', classification=qs, user=self.staff)
+		Libros.objects.create(cota='WG 900 A 1', titulo='Inactivo', autor='Autor', classification=wg, is_active=False, user=self.staff)
+
+	def _pages(self, response):
+		import re
+		return len(re.findall(rb'/Type /Page\b(?!s)', b''.join(response.streaming_content)))
+
+	def test_batch_by_classification_and_cota_range(self):
+		from unittest import mock
+		self.client.force_login(self.staff)
+		response = self.client.get('/books/cards/', {'clasificacion': 'wg'})
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(self._pages(response), 3)
+		self.assertEqual(AnalyticsEvent.objects.filter(event_type=AnalyticsEvent.EVENT_PDF).count(), 3)
+		with mock.patch('tasks.cards.render_batch', side_effect=AssertionError('no debe regenerarse')):
+			self.assertEqual(self._pages(self.client.get('/books/cards/', {'clasificacion': 'WG'})), 3)
+		self.assertEqual(self._pages(self.client.get('/books/cards/', {'desde': 'wg 100', 'hasta': 'WG 200'})), 2)
+		# el rango es natural, no lexicográfico: 'WG 1'..'WG 200' no incluye 'WG 1000'
+		Libros.objects.create(cota='WG 1000 A 1', titulo='Mil', autor='Autor', classification=Clasificacion.objects.get(code='WG'), user=self.staff)
+		self.assertEqual(self._pages(self.client.get('/books/cards/', {'desde': 'WG 1', 'hasta': 'WG 200'})), 2)
+		self.assertEqual(self._pages(self.client.get('/books/cards/', {'desde': 'WG 300', 'hasta': 'WG 1000'})), 2)
+		self.assertEqual(self._pages(self.client.get('/books/cards/', {'desde': 'WG 300', 'hasta': 'WG 300'})), 1)
+		# un solo extremo se acota a su clasificación; extremos sin letras comunes se rechazan
+		self.assertEqual(self._pages(self.client.get('/books/cards/', {'desde': 'WG 300'})), 2)
+		self.assertEqual(self._pages(self.client.get('/books/cards/', {'hasta': 'QS 10'})), 1)
+		self.assertEqual(self.client.get('/books/cards/', {'desde': 'QS 1', 'hasta': 'WG 200'}).status_code, 302)
+		ids = ','.join(str(pk) for pk in Libros.objects.filter(cota__in=['QS 4 A 1', 'WG 300 A 1']).values_list('pk', flat=True))
+		self.assertEqual(self._pages(self.client.get('/books/cards/', {'ids': ids})), 2)
+
+	def test_range_over_the_limit_is_rejected_before_truncating(self):
+		from unittest import mock
+		from django.contrib.messages import get_messages
+		self.client.force_login(self.staff)
+		with mock.patch('tasks.views.CARD_BATCH_LIMIT', 2):
+			response = self.client.get('/books/cards/', {'desde': 'WG 100', 'hasta': 'WG 300'})
+			self.assertEqual(response.status_code, 302)
+			self.assertIn('abarca 3 libros', str(list(get_messages(response.wsgi_request))[0]))
+			self.assertEqual(self._pages(self.client.get('/books/cards/', {'desde': 'WG 100', 'hasta': 'WG 200'})), 2)
+
+	def test_batch_requires_staff_and_criteria(self):
+		self.assertEqual(self.client.get('/books/cards/', {'clasificacion': 'WG'}).status_code, 302)
+		self.client.force_login(self.staff)
+		self.assertEqual(self.client.get('/books/cards/').status_code, 302)
+
+
+class CoverDerivativeTests(TestCase):
+	def setUp(self):
+		import tempfile
+		self.media = tempfile.mkdtemp()
+		override = self.settings(MEDIA_ROOT=self.media, CARD_CACHE_DIR=tempfile.mkdtemp())
+		override.enable()
+		self.addCleanup(override.disable)
+		User = get_user_model()
+		self.user = User.objects.create_user(username='portadas', password='testpass123', cedula=22222, telefono=12345678, security_question='q', security_answer='a', email='p@example.com')
+
+	def _photo(self, size=(1200, 1600)):
+		from PIL import Image
+		from django.core.files.uploadedfile import SimpleUploadedFile
+		img = Image.new('RGB', size, (200, 30, 30))
+		exif = Image.Exif()
+		exif[0x010F] = 'Telefono'  # Make
+		exif[0x0112] = 6  # Orientation: rotada 90°
+		buffer = BytesIO()
+		img.save(buffer, 'JPEG', exif=exif.tobytes())
+		return SimpleUploadedFile('foto.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+	def test_upload_generates_stripped_derivatives(self):
+		import os
+		from PIL import Image
+		from .covers import derivative_name
+		with self.captureOnCommitCallbacks(execute=True):
+			book = Libros.objects.create(cota='WG 1 A 1', titulo='Uno', autor='Autor', user=self.user, portada=self._photo())
+		book.refresh_from_db()
+		self.assertEqual(book.portada_derivados, book.portada.name)
+		thumb = os.path.join(self.media, derivative_name(book.portada.name, 'thumb'))
+		with Image.open(thumb) as img:
+			# orientación aplicada (apaisada) y sin EXIF
+			self.assertEqual(img.size, (160, 120))
+			self.assertFalse(img.getexif())
+		self.assertTrue(os.path.exists(os.path.join(self.media, derivative_name(book.portada.name, 'detail', 'webp'))))
+		self.assertTrue(book.portada_thumb_url.endswith('-thumb.jpg'))
+		self.assertEqual(self.client.get(f'/book/{book.pk}/card/').status_code, 200)
+
+	def test_backfill_command(self):
+		with self.captureOnCommitCallbacks(execute=False):
+			book = Libros.objects.create(cota='WG 2 A 1', titulo='Dos', autor='Autor', user=self.user, portada=self._photo((400, 300)))
+		self.assertEqual(book.portada_thumb_url, book.portada.url)
+		out = StringIO()
+		call_command('build_cover_derivatives', '--workers', '2', stdout=out)
+		self.assertIn('1 portadas procesadas, 0 con errores', out.getvalue())
+		book.refresh_from_db()
+		self.assertTrue(book.portada_thumb_url.endswith('-thumb.jpg'))
+
+
+class ContentAddressedCoverTests(TestCase):
+	def setUp(self):
+		import tempfile
+		self.media = tempfile.mkdtemp()
+		override = self.settings(MEDIA_ROOT=self.media, CARD_CACHE_DIR=tempfile.mkdtemp(), COVER_RELEASE_GRACE_SECONDS=0)
+		override.enable()
+		self.addCleanup(override.disable)
+		User = get_user_model()
+		self.user = User.objects.create_user(username='hashes', password='testpass123', cedula=33333, telefono=12345678, security_question='q', security_answer='a', email='h@example.com')
+
+	def _image(self, name='portada.jpg', color=(10, 120, 200)):
+		from PIL import Image
+		from django.core.files.uploadedfile import SimpleUploadedFile
+		buffer = BytesIO()
+		Image.new('RGB', (300, 400), color).save(buffer, 'JPEG')
+		return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+	def test_same_image_shares_file_until_last_reference(self):
+		import os
+		from .covers import derivative_name
+		with self.captureOnCommitCallbacks(execute=True):
+			first = Libros.objects.create(cota='WG 1 H 1', titulo='Uno', autor='Autor', user=self.user, portada=self._image('a.jpg'))
+		with self.captureOnCommitCallbacks(execute=True):
+			second = Libros.objects.create(cota='WG 1 H 2', titulo='Dos', autor='Autor', user=self.user, portada=self._image('b.jpeg'))
+		self.assertEqual(first.portada.name, second.portada.name)
+		name = first.portada.name
+		self.assertRegex(name, r'^covers/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+		self.assertEqual(os.listdir(os.path.join(self.media, 'covers', name.split('/')[1])), [name.split('/')[2]])
+		second.refresh_from_db()
+		self.assertEqual(second.portada_derivados, name)
+
+		with self.captureOnCommitCallbacks(execute=True):
+			first.delete()
+		self.assertTrue(os.path.exists(os.path.join(self.media, name)))
+		# reemplazar la portada del último libro libera el archivo y sus derivados
+		with self.captureOnCommitCallbacks(execute=True):
+			second.portada = self._image('c.jpg', color=(0, 0, 0))
+			second.save()
+		self.assertFalse(os.path.exists(os.path.join(self.media, name)))
+		self.assertFalse(os.path.exists(os.path.join(self.media, derivative_name(name, 'thumb'))))
+		self.assertTrue(os.path.exists(second.portada.path))
+
+	def test_dedupe_command(self):
+		import os
+		legacy = os.path.join(self.media, 'covers')
+		os.makedirs(legacy)
+		content = self._image().read()
+		for filename in ('foto.jpg', 'foto_Ab12Cd3.jpg'):
+			with open(os.path.join(legacy, filename), 'wb') as f:
+				f.write(content)
+		with self.captureOnCommitCallbacks(execute=False):
+			one = Libros.objects.create(cota='WG 2 H 1', titulo='Uno', autor='Autor', user=self.user, portada='covers/foto.jpg')
+			two = Libros.objects.create(cota='WG 2 H 2', titulo='Dos', autor='Autor', user=self.user, portada='covers/foto_Ab12Cd3.jpg')
+		out = StringIO()
+		call_command('dedupe_covers', '--dry-run', stdout=out)
+		self.assertIn('2 archivos se unificarían en 1', out.getvalue())
+		self.assertTrue(os.path.exists(os.path.join(legacy, 'foto.jpg')))
+
+		out = StringIO()
+		call_command('dedupe_covers', stdout=out)
+		self.assertIn('2 libros actualizados', out.getvalue())
+		one.refresh_from_db()
+		two.refresh_from_db()
+		self.assertEqual(one.portada.name, two.portada.name)
+		self.assertTrue(os.path.exists(one.portada.path))
+		self.assertFalse(os.path.exists(os.path.join(legacy, 'foto.jpg')))
+		self.assertFalse(os.path.exists(os.path.join(legacy, 'foto_Ab12Cd3.jpg')))
+
+	def test_recently_reused_cover_survives_release(self):
+		import os
+		import time
+		from .storage import cover_storage, release_cover
+		with self.captureOnCommitCallbacks(execute=True):
+			book = Libros.objects.create(cota='WG 3 H 1', titulo='Uno', autor='Autor', user=self.user, portada=self._image('a.jpg'))
+		name = book.portada.name
+		old = time.time() - 7200
+		os.utime(cover_storage.path(name), (old, old))
+		Libros.objects.filter(pk=book.pk).update(portada='')
+		# otra subida (aún sin confirmar) reutiliza el archivo: renueva su fecha
+		self.assertEqual(cover_storage.save('covers/b.jpg', self._image('b.jpg')), name)
+		with self.settings(COVER_RELEASE_GRACE_SECONDS=3600):
+			self.assertFalse(release_cover(name))
+			self.assertTrue(os.path.exists(cover_storage.path(name)))
+			os.utime(cover_storage.path(name), (old, old))
+			self.assertTrue(release_cover(name))
+		self.assertFalse(os.path.exists(cover_storage.path(name)))
+
+	def test_dedupe_command_removes_orphan_covers(self):
+		import os
+		from .storage import cover_storage
+		with self.captureOnCommitCallbacks(execute=True):
+			book = Libros.objects.create(cota='WG 3 H 2', titulo='Uno', autor='Autor', user=self.user, portada=self._image('a.jpg'))
+		kept = book.portada.name
+		orphan = cover_storage.save('covers/b.jpg', self._image('b.jpg', color=(0, 0, 0)))
+		out = StringIO()
+		call_command('dedupe_covers', '--dry-run', stdout=out)
+		self.assertIn('1 portadas sin referencias se borrarían', out.getvalue())
+		self.assertTrue(os.path.exists(cover_storage.path(orphan)))
+		out = StringIO()
+		call_command('dedupe_covers', stdout=out)
+		self.assertIn('1 portadas sin referencias borradas', out.getvalue())
+		self.assertFalse(os.path.exists(cover_storage.path(orphan)))
+		self.assertTrue(os.path.exists(cover_storage.path(kept)))
+
+
+class AnalyticsBufferTests(TestCase):
+	def setUp(self):
+		User = get_user_model()
+		self.user = User.objects.create_user(username='lector', password='testpass123', cedula=44444, telefono=12345678, security_question='q', security_answer='a', email='l@example.com')
+		self.book = Libros.objects.create(cota='WG 1 E 1', titulo='Eventos', autor='Autor', user=self.user)
+
+	def test_bounded_queue_drops_and_flushes_in_batches(self):
+		from unittest import mock
+		from .analytics import EventBuffer, make_event
+		buffer = EventBuffer(batch_size=2, flush_interval=0.05, max_queue=3)
+		with mock.patch.object(buffer, '_ensure_worker'):
+			buffer.put([make_event(AnalyticsEvent.EVENT_VIEW, self.book, self.user) for _ in range(5)])
+		self.assertEqual((buffer.pending, buffer.dropped), (3, 2))
+		from django.db import connection
+		from django.test.utils import CaptureQueriesContext
+		with CaptureQueriesContext(connection) as queries:
+			buffer.flush()
+		self.assertEqual(len([q for q in queries if q['sql'].startswith('INSERT INTO "tasks_analyticsevent"')]), 2)
+		self.assertEqual(buffer.written, 3)
+		self.assertEqual(AnalyticsEvent.objects.filter(book=self.book, user=self.user).count(), 3)
+
+	def test_writer_reconnects_once_after_lost_connection(self):
+		from unittest import mock
+		from django.db import OperationalError
+		from .analytics import EventBuffer, make_event
+		buffer = EventBuffer(batch_size=10)
+		batch = [make_event(AnalyticsEvent.EVENT_VIEW, self.book)]
+		# como en el hilo escritor: fuera de una transacción
+		with mock.patch('tasks.analytics.connection') as conn, \
+				mock.patch('tasks.analytics.store', side_effect=[OperationalError('server closed the connection'), None]) as store:
+			conn.in_atomic_block = False
+			buffer._write(batch)
+		self.assertEqual(store.call_count, 2)
+		conn.close_if_unusable_or_obsolete.assert_called_once_with()
+		conn.close.assert_called_once_with()
+		self.assertEqual((buffer.written, buffer.dropped), (1, 0))
+
+	def test_detail_view_enqueues_after_commit(self):
+		from unittest import mock
+		with self.settings(ANALYTICS_SYNC=False), mock.patch('tasks.analytics.buffer.put') as put:
+			with self.captureOnCommitCallbacks(execute=True):
+				self.assertEqual(self.client.get(f'/book/{self.book.pk}/').status_code, 200)
+		(events,), _ = put.call_args
+		self.assertEqual([(e.event_type, e.book_id, e.user_id) for e in events], [(AnalyticsEvent.EVENT_VIEW, self.book.pk, None)])
+		self.assertFalse(AnalyticsEvent.objects.exists())
+
+
+class AnalyticsRollupTests(TestCase):
+	def setUp(self):
+		from django.core.cache import cache
+		cache.clear()
+		User = get_user_model()
+		self.user = User.objects.create_user(username='panel', password='testpass123', cedula=55555, telefono=12345678, security_question='q', security_answer='a', email='d@example.com')
+		self.book = Libros.objects.create(cota='WG 1 R 1', titulo='Totales', autor='Autor', user=self.user)
+
+	def test_events_update_daily_totals(self):
+		from django.utils import timezone
+		self.client.force_login(self.user)
+		for _ in range(3):
+			self.client.get(f'/book/{self.book.pk}/')
+		today = timezone.localdate()
+		self.assertEqual(AnalyticsDaily.objects.get(day=today, event_type=AnalyticsEvent.EVENT_VIEW).count, 3)
+		self.assertEqual(AnalyticsBookDaily.objects.get(day=today, book=self.book, event_type=AnalyticsEvent.EVENT_VIEW).count, 3)
+		response = self.client.get('/dashboard/')
+		self.assertEqual(response.context['views_data'][-1], 3)
+
+	def test_dashboard_reads_rollups_and_command_rebuilds(self):
+		import datetime
+		from django.utils import timezone
+		last_month = timezone.now().replace(day=1) - datetime.timedelta(days=3)
+		# eventos cargados sin pasar por analytics.store: el panel no los ve hasta recalcular
+		AnalyticsEvent.objects.bulk_create([AnalyticsEvent(event_type=AnalyticsEvent.EVENT_PDF, book=self.book, timestamp=last_month) for _ in range(4)])
+		self.client.force_login(self.user)
+		from django.db import connection
+		from django.test.utils import CaptureQueriesContext
+		self.assertEqual(self.client.get('/dashboard/').context['pdfs_data'][-2], 0)
+		with CaptureQueriesContext(connection) as queries:
+			self.client.get('/dashboard/')
+		tables = [q['sql'] for q in queries if 'tasks_analytics' in q['sql']]
+		# sólo el mes en curso se consulta; los cerrados salen de la caché
+		self.assertEqual(len(tables), 1)
+		self.assertNotIn('tasks_analyticsevent', tables[0])
+		out = StringIO()
+		with self.captureOnCommitCallbacks(execute=True):
+			call_command('rollup_analytics', '--all', stdout=out)
+		self.assertIn('1 totales diarios y 1 totales por libro', out.getvalue())
+		self.assertEqual(self.client.get('/dashboard/').context['pdfs_data'][-2], 4)
+
+	def test_rebuilding_current_month_keeps_closed_months_cached(self):
+		import datetime
+		from django.utils import timezone
+		from .cache_utils import get_version
+		from .rollups import ANALYTICS_ROLLUPS, rebuild
+		month_start = timezone.localdate().replace(day=1)
+		last_month = timezone.now().replace(day=1) - datetime.timedelta(days=3)
+		AnalyticsEvent.objects.bulk_create([
+			AnalyticsEvent(event_type=AnalyticsEvent.EVENT_VIEW, book=self.book, timestamp=last_month),
+			AnalyticsEvent(event_type=AnalyticsEvent.EVENT_VIEW, book=self.book, timestamp=timezone.now()),
+		])
+		version = get_version(ANALYTICS_ROLLUPS)
+		with self.captureOnCommitCallbacks(execute=True):
+			rebuild(month_start)
+		self.assertEqual(get_version(ANALYTICS_ROLLUPS), version)
+		with self.captureOnCommitCallbacks(execute=True):
+			rebuild(month_start - datetime.timedelta(days=5))
+		self.assertNotEqual(get_version(ANALYTICS_ROLLUPS), version)
+
+
+class AnalyticsArchiveTests(TestCase):
+	def setUp(self):
+		import tempfile
+		self.archive = tempfile.mkdtemp()
+		User = get_user_model()
+		self.user = User.objects.create_user(username='archivo', password='testpass123', cedula=66666, telefono=12345678, security_question='q', security_answer='a', email='ar@example.com')
+		self.book = Libros.objects.create(cota='WG 1 Z 1', titulo='Archivo', autor='Autor', user=self.user)
+
+	def test_archive_closed_months_keeps_rollups(self):
+		import gzip
+		import json
+		import os
+		from django.db import connection
+		from django.db.models import Sum
+		from django.utils import timezone
+		from .analytics import store
+		from .partitions import add_months, existing_partitions, is_partitioned
+		current = timezone.localdate().replace(day=1)
+		old_month = add_months(current, -8)
+		old = timezone.make_aware(timezone.datetime.combine(old_month.replace(day=10), timezone.datetime.min.time()))
+		store([AnalyticsEvent(event_type=AnalyticsEvent.EVENT_VIEW, book=self.book, timestamp=old) for _ in range(3)])
+		store([AnalyticsEvent(event_type=AnalyticsEvent.EVENT_VIEW, book=self.book, timestamp=timezone.now()) for _ in range(2)])
+
+		out = StringIO()
+		call_command('archive_analytics', '--keep-months', '3', '--archive-dir', self.archive, '--dry-run', stdout=out)
+		self.assertIn(f'{old_month:%Y-%m}', out.getvalue())
+		self.assertEqual(AnalyticsEvent.objects.count(), 5)
+
+		out = StringIO()
+		with self.captureOnCommitCallbacks(execute=True):
+			call_command('archive_analytics', '--keep-months', '3', '--archive-dir', self.archive, stdout=out)
+		self.assertIn('3 eventos archivados de 1 meses', out.getvalue())
+		with gzip.open(os.path.join(self.archive, f'analytics-{old_month:%Y-%m}.jsonl.gz'), 'rt') as f:
+			rows = [json.loads(line) for line in f]
+		self.assertEqual({(r['event_type'], r['book_id']) for r in rows}, {('view', self.book.pk)})
+		self.assertEqual(len(rows), 3)
+		self.assertEqual(AnalyticsEvent.objects.count(), 2)
+		if connection.vendor == 'postgresql':
+			self.assertTrue(is_partitioned())
+			self.assertIn(current, existing_partitions())
+			self.assertNotIn(old_month, existing_partitions())
+
+		# el panel conserva el historial y recalcular no borra los días archivados
+		call_command('rollup_analytics', '--all', stdout=StringIO())
+		self.assertEqual(AnalyticsDaily.objects.aggregate(total=Sum('count'))['total'], 5)
+
+
+class RankingTests(TestCase):
+	def setUp(self):
+		User = get_user_model()
+		self.user = User.objects.create_user(username='ranking', password='testpass123', cedula=77777, telefono=12345678, security_question='q', security_answer='a', email='r@example.com')
+		self.hot = Libros.objects.create(cota='WG 1 T 1', titulo='Caliente', autor='Autor', cantidad=3, user=self.user)
+		self.warm = Libros.objects.create(cota='WG 2 T 1', titulo='Tibio', autor='Autor', user=self.user)
+		self.old = Libros.objects.create(cota='WG 3 T 1', titulo='Viejo', autor='Autor', user=self.user)
+		self.cold = Libros.objects.create(cota='WG 4 T 1', titulo='Frio', autor='Autor', user=self.user)
+
+	def _activity(self):
+		import datetime
+		from django.utils import timezone
+		from .analytics import store
+		for _ in range(2):
+			self.client.get(f'/book/{self.hot.pk}/')
+		self.client.get(f'/book/{self.warm.pk}/')
+		with self.captureOnCommitCallbacks(execute=True):
+			Prestamo.objects.create(book=self.hot, user=self.user, cantidad=1, status=Prestamo.STATUS_PENDING)
+		# muchas consultas, pero hace un mes: popular sí, en tendencia no
+		store([AnalyticsEvent(event_type=AnalyticsEvent.EVENT_VIEW, book=self.old, timestamp=timezone.now() - datetime.timedelta(days=30)) for _ in range(3)])
+
+	def test_scores_order_catalog_and_index(self):
+		self._activity()
+		self.assertEqual(BookRanking.objects.count(), 3)
+		response = self.client.get('/tasks/', {'sort_by': 'popular'})
+		self.assertEqual([b.pk for b in response.context['tasks']], [self.hot.pk, self.old.pk, self.warm.pk, self.cold.pk])
+		response = self.client.get('/')
+		self.assertEqual([b.pk for b in response.context['trending']], [self.hot.pk, self.warm.pk])
+		self.assertContains(response, 'Tendencias de la semana')
+
+	def test_rebuild_matches_incremental_order(self):
+		self._activity()
+		incremental = list(BookRanking.objects.order_by('-popular').values_list('book_id', flat=True))
+		BookRanking.objects.all().delete()
+		out = StringIO()
+		call_command('rebuild_rankings', stdout=out)
+		self.assertIn('3 libros con puntaje', out.getvalue())
+		self.assertEqual(list(BookRanking.objects.order_by('-popular').values_list('book_id', flat=True)), incremental)
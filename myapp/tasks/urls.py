@@ -10,6 +10,7 @@ urlpatterns = [
     path('tasks/', views.tasks, name='tasks'),
     path('dictionary/', views.dictionary_view, name='dictionary'),
     path('autocomplete/codes/', views.autocomplete_codes, name='autocomplete_codes'),
+    path('catalog/suggest/', views.catalog_suggest, name='catalog_suggest'),
     path('logout/', views.signout, name='logout'),
     path('signin/', views.signin, name='signin'),
     path('edit_user/', views.edit_user, name='edit_user'),
@@ -37,6 +38,7 @@ urlpatterns = [
     path('book/<int:pk>/edit/', views.task_edit, name='task_edit'),
     path('book/<int:pk>/pdf/', views.task_pdf_card, name='task_pdf'),
     path('book/<int:pk>/card/', views.task_pdf_card, name='task_pdf_card'),  # ← nueva ruta para ficha
+    path('books/cards/', views.task_pdf_cards, name='task_pdf_cards'),
     # Panel administrativo personalizado (solo superusers)
     path('adminpanel/', views.admin_panel, name='admin_panel'),
     path('adminpanel/users/', views.admin_users, name='admin_users'),
@@ -53,4 +55,7 @@ urlpatterns = [
     path('adminpanel/dictionary/add/', views.admin_dictionary_add, name='admin_dictionary_add'),
     path('adminpanel/dictionary/<int:pk>/edit/', views.admin_dictionary_edit, name='admin_dictionary_edit'),
     path('adminpanel/dictionary/<int:pk>/delete/', views.admin_dictionary_delete, name='admin_dictionary_delete'),
+
+    path('adminpanel/export/books/', views.admin_export_books, name='admin_export_books'),
+    path('adminpanel/export/loans/', views.admin_export_loans, name='admin_export_loans'),
 ]
\ No newline at end of file
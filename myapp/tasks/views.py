@@ -5,9 +5,20 @@ from django.db import IntegrityError
 from .forms import TaskForm, CustomUserCreationForm, UserEditForm, DictionaryEntryForm
 from .models import Libros, Clasificacion, AnalyticsEvent, UserSecurity, DictionaryEntry
 from .models import Prestamo
+from .search import (
+    SEARCH_MODE_FUZZY, cota_in_range, cota_sort_key, dictionary_prefix, highlight_dictionary, search_books,
+    search_dictionary, supports_full_text,
+)
+from .pagination import paginate
+from .facets import apply_facets, build_facets, facet_counts, facet_query, selected_facets
+from .indexes import book_index, code_index
+from .exports import streaming_export
+from .cards import batch_card_path, card_bytes, card_etag
+from . import analytics, inventory
+from .rollups import month_counts
+from .ranking import add_loans, trending_books, with_popularity
 from django.db.models import Q
-from django.db.models import Count, Sum, Avg
-from django.db.models.functions import TruncMonth
+from django.db.models import Count, Avg
 import datetime
 from django.core.paginator import Paginator
 from django.urls import reverse
@@ -15,18 +26,19 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.db import transaction
 from .models import UserSecurity  # si usaste otro nombre ajústalo
-from django.http import HttpResponse
+from django.http import FileResponse, HttpResponse
 from django.http import JsonResponse
 from django.utils import timezone
 from django.template.loader import render_to_string
-import io
-from reportlab.lib.pagesizes import A4, landscape, A5
+import os
+from reportlab.lib.pagesizes import A4
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib import colors
-from reportlab.lib.units import cm
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
+import hashlib
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 
 User = get_user_model()
 
@@ -68,12 +80,10 @@ def admin_panel(request):
 @_superuser_required
 def admin_users(request):
     q = request.GET.get('q', '').strip()
-    qs = User.objects.all().order_by('-is_superuser', 'username')
+    qs = User.objects.all()
     if q:
         qs = qs.filter(Q(username__icontains=q) | Q(first_name__icontains=q) | Q(last_name__icontains=q) | Q(cedula__icontains=q))
-    paginator = Paginator(qs, 50)
-    page = request.GET.get('page')
-    page_obj = paginator.get_page(page)
+    page_obj = paginate(request, qs, ['-is_superuser', 'username'], 50)
     return render(request, 'admin/users_list.html', {'users': page_obj, 'q': q})
 
 @_superuser_required
@@ -132,12 +142,10 @@ def admin_user_delete(request, pk):
 @_superuser_required
 def admin_books(request):
     q = request.GET.get('q', '').strip()
-    qs = Libros.objects.all().order_by('cota')
+    qs = Libros.objects.all()
     if q:
         qs = qs.filter(Q(cota__icontains=q) | Q(titulo__icontains=q) | Q(autor__icontains=q) | Q(co_autor__icontains=q))
-    paginator = Paginator(qs, 50)
-    page = request.GET.get('page')
-    page_obj = paginator.get_page(page)
+    page_obj = paginate(request, qs, ['cota'], 50)
     return render(request, 'admin/books_list.html', {'books': page_obj, 'q': q})
 
 @_superuser_required
@@ -186,12 +194,13 @@ def admin_book_delete(request, pk):
 @_superuser_required
 def admin_dictionary(request):
     q = request.GET.get('q', '').strip()
-    qs = DictionaryEntry.objects.all().order_by('codigo')
+    qs = DictionaryEntry.objects.all()
+    ranked = False
     if q:
-        qs = qs.filter(Q(codigo__icontains=q) | Q(descripcion__icontains=q) | Q(descripcion_en__icontains=q))
-    paginator = Paginator(qs, 50)
-    page = request.GET.get('page')
-    page_obj = paginator.get_page(page)
+        qs, ranked = search_dictionary(qs, q)
+    # por relevancia sólo hay páginas numeradas (rank no sirve como clave de cursor)
+    page_obj = paginate(request, qs, ['-rank', 'codigo'] if ranked else ['codigo'], 50, keyset=not ranked)
+    page_obj.object_list = highlight_dictionary(page_obj.object_list, q)
     classification_list = None
     return render(request, 'admin/dictionary_list.html', {'entries': page_obj, 'q': q, 'classification_list': classification_list})
 
@@ -229,10 +238,21 @@ def admin_dictionary_delete(request, pk):
         return redirect('admin_dictionary')
     return render(request, 'admin/dictionary_confirm_delete.html', {'entry': e})
 
+@_superuser_required
+def admin_export_books(request):
+    # ?format=csv|jsonl&activos=1; se envía en flujo, sin cargar el catálogo en memoria
+    return streaming_export('books', request.GET.get('format', 'csv'), request.GET)
+
+@_superuser_required
+def admin_export_loans(request):
+    # ?format=csv|jsonl&status=returned&desde=AAAA-MM-DD&hasta=AAAA-MM-DD
+    return streaming_export('loans', request.GET.get('format', 'csv'), request.GET)
+
 #INDEX
 
 def index(request):
-    return render(request, 'index.html')
+    # "tendencias de la semana": top N leído del índice de BookRanking
+    return render(request, 'index.html', {'trending': trending_books(8)})
 
 
 ############### Usuarios ###############
@@ -369,7 +389,7 @@ def signin(request):
             auth_login(request, user)
             # registrar login
             try:
-                AnalyticsEvent.objects.create(event_type=AnalyticsEvent.EVENT_LOGIN, user=user)
+                analytics.record(AnalyticsEvent.EVENT_LOGIN, user=user)
             except Exception:
                 pass
             if next_url:
@@ -578,60 +598,24 @@ def tasks(request):
     materia_id = request.GET.get('materia', '').strip()
 
     # nuevos parámetros
-    sort_by = request.GET.get('sort_by', '').strip()  # autor, titulo, editorial, ubicacion_publicacion, fecha_publicacion
+    sort_by = request.GET.get('sort_by', '').strip()  # autor, titulo, editorial, ubicacion_publicacion, fecha_publicacion, popular
     order = request.GET.get('order', 'asc').strip()   # asc or desc
     filter_field = request.GET.get('filter_field', '').strip()
     filter_value = request.GET.get('filter_value', '').strip()
     min_year = request.GET.get('min_year', '').strip()
     max_year = request.GET.get('max_year', '').strip()
+    search_mode = request.GET.get('search_mode', '').strip()  # '' (automático), 'fuzzy' o 'contains'
 
     qs = Libros.objects.all()
 
-    # búsqueda libre existente
+    # búsqueda libre: texto completo cuando el motor lo soporta, icontains en otro caso
+    ranked = False
     if q:
-        terms = [t for t in q.split() if t]
-        query = Q()
-        for term in terms:
-            # campos de texto básicos
-            term_q = (
-                Q(cota__icontains=term) |
-                Q(titulo__icontains=term) |
-                Q(subtitulo__icontains=term) |
-                Q(autor__icontains=term) |
-                Q(editorial__icontains=term) |
-                Q(serie__icontains=term) |
-                Q(contenido__icontains=term) |
-                Q(co_autor__icontains=term)
-            )
-            # si el término es numérico, intentar comparar con numero_registro (entero)
-            try:
-                n = int(term)
-                term_q = term_q | Q(numero_registro=n)
-            except Exception:
-                pass
+        qs, ranked = search_books(qs, q, mode=search_mode)
 
-            # intentar interpretar el término como fecha (varios formatos) o año
-            try:
-                # año YYYY
-                if len(term) == 4 and term.isdigit():
-                    term_q = term_q | Q(fecha_registro__year=int(term))
-                else:
-                    for fmt in ('%Y-%m-%d', '%d-%m-%Y', '%d/%m/%Y', '%Y/%m/%d'):
-                        try:
-                            dt = datetime.datetime.strptime(term, fmt).date()
-                            term_q = term_q | Q(fecha_registro=dt)
-                            break
-                        except Exception:
-                            continue
-            except Exception:
-                pass
-
-            query &= term_q
-        qs = qs.filter(query)
-
-    # filtro por clasificación (opcional) - usar 'materia' param kept for compatibility
-    if materia_id:
-        qs = qs.filter(classification__id=materia_id)
+    # facetas: clasificación ('materia', se conserva por compatibilidad), editorial, década, contenido y disponibilidad
+    selected = selected_facets(request.GET)
+    qs = apply_facets(qs, selected)
 
     # filtro por campo seleccionado (texto -> icontains)
     text_filter_fields = {'autor','titulo','editorial','ubicacion_publicacion'}
@@ -653,26 +637,33 @@ def tasks(request):
 
     # ordenación: permitir solo campos seguros
     allowed_sort = ['autor', 'titulo', 'editorial', 'ubicacion_publicacion', 'fecha_publicacion']
+    by_rank = False
     if sort_by in allowed_sort:
         prefix = '-' if order == 'desc' else ''
-        qs = qs.order_by(f"{prefix}{sort_by}")
+        ordering = [f"{prefix}{sort_by}"]
+    elif sort_by == 'popular':
+        # puntaje precalculado (ranking.py); siempre de más a menos popular
+        qs = with_popularity(qs)
+        ordering = ['-popularidad']
+    elif ranked and (sort_by == 'relevance' or search_mode == SEARCH_MODE_FUZZY):
+        ordering = ['-rank', 'cota']
+        by_rank = True
     else:
-        qs = qs.order_by('cota')
+        ordering = ['cota']
+
+    # conteos de todas las facetas sobre el resultado actual (una sola consulta agrupada)
+    counts = facet_counts(qs)
 
     qs = qs.distinct()
 
-    # paginación
-    paginator = Paginator(qs, 20)
-    page = request.GET.get('page')
-    page_obj = paginator.get_page(page)
+    # paginación: por cursor (?cursor=) o por número de página; el orden por relevancia sólo admite páginas
+    page_obj = paginate(request, qs, ordering, 20, keyset=not by_rank)
 
     from .models import Clasificacion
-    materias = Clasificacion.objects.all().order_by('code')
-    # adjuntar conteo de prestados para cada libro en la página
-    for t in page_obj.object_list:
-        tot = Prestamo.objects.filter(book=t, status=Prestamo.STATUS_ACTIVE).aggregate(total=Sum('cantidad'))['total'] or 0
-        setattr(t, 'prestados', int(tot))
-        setattr(t, 'total', int(t.cantidad or 0))
+    materias = list(Clasificacion.objects.all().order_by('code'))
+    facets = build_facets(request.GET, selected, counts, materias)
+    # adjuntar prestados/total para cada libro en la página (ejemplares libres, una consulta)
+    inventory.availability(page_obj.object_list)
 
     return render(request, 'tasks.html', {
         'tasks': page_obj,
@@ -685,6 +676,12 @@ def tasks(request):
         'filter_value': filter_value,
         'min_year': min_year,
         'max_year': max_year,
+        'search_mode': search_mode,
+        'full_text': supports_full_text(),
+        'ranked': ranked,
+        'facets': facets,
+        'selected_facets': selected,
+        'facet_query': facet_query(selected),
     })
 
 
@@ -692,11 +689,9 @@ def tasks(request):
 def cart_add(request, pk):
     """Añade un libro al carrito guardado en session. Máximo 10 ítems."""
     book = get_object_or_404(Libros, pk=pk)
-    # calcular cuántos ejemplares están actualmente prestados (activos)
-    prestados_qs = Prestamo.objects.filter(book=book, status=Prestamo.STATUS_ACTIVE)
-    prestados_total = prestados_qs.aggregate(total=Sum('cantidad'))['total'] or 0
-    disponible = (book.cantidad or 0) - prestados_total
-    if disponible <= 0:
+    # ejemplares libres y retenidos por préstamos
+    inventory.availability([book])
+    if book.libres <= 0:
         # si es AJAX devolver JSON con error
         if request.headers.get('x-requested-with') == 'XMLHttpRequest':
             return JsonResponse({'ok': False, 'message': 'No hay ejemplares disponibles', 'count': 0})
@@ -715,7 +710,7 @@ def cart_add(request, pk):
     request.session.modified = True
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
         # además incluir información de prestados/total
-        return JsonResponse({'ok': True, 'count': len(cart), 'prestados': int(prestados_total), 'total': int(book.cantidad or 0)})
+        return JsonResponse({'ok': True, 'count': len(cart), 'prestados': book.prestados, 'total': book.total})
     return redirect(request.META.get('HTTP_REFERER', reverse('tasks')))
 
 
@@ -788,7 +783,7 @@ def create_task(request):
 
             # registrar alta de libro
             try:
-                AnalyticsEvent.objects.create(event_type=AnalyticsEvent.EVENT_ADD, book=new_task, user=request.user)
+                analytics.record(AnalyticsEvent.EVENT_ADD, book=new_task, user=request.user)
             except Exception:
                 pass
 
@@ -808,11 +803,11 @@ def task_detail(request, pk):
     book = get_object_or_404(Libros, pk=pk)
     # registrar vista/consulta
     try:
-        AnalyticsEvent.objects.create(event_type=AnalyticsEvent.EVENT_VIEW, book=book, user=request.user if request.user.is_authenticated else None)
+        analytics.record(AnalyticsEvent.EVENT_VIEW, book=book, user=request.user)
     except Exception:
         pass
-    prestados = Prestamo.objects.filter(book=book, status=Prestamo.STATUS_ACTIVE).aggregate(total=Sum('cantidad'))['total'] or 0
-    return render(request, 'task_detail.html', {'book': book, 'prestados': int(prestados), 'total': int(book.cantidad or 0)})
+    inventory.availability([book])
+    return render(request, 'task_detail.html', {'book': book, 'prestados': book.prestados, 'total': book.total})
 
 @trabajador_required
 def task_edit(request, pk):
@@ -871,196 +866,83 @@ def task_edit(request, pk):
 
 
 def task_pdf_card(request, pk):
-    book = get_object_or_404(Libros, pk=pk)
+    book = get_object_or_404(Libros.objects.select_related('classification'), pk=pk)
     # bloquear impresión de ficha si el libro está inactivo
     if not getattr(book, 'is_active', True):
         messages.error(request, 'No es posible imprimir la ficha de un libro inactivo.')
         return redirect('task_detail', pk=book.pk)
     # registrar impresión PDF
     try:
-        AnalyticsEvent.objects.create(event_type=AnalyticsEvent.EVENT_PDF, book=book, user=request.user if request.user.is_authenticated else None)
+        analytics.record(AnalyticsEvent.EVENT_PDF, book=book, user=request.user)
     except Exception:
         pass
 
-    buffer = io.BytesIO()
-    page_size = landscape(A5)
-    c = canvas.Canvas(buffer, pagesize=page_size)
-    w, h = page_size
-    m = 0.7 * cm
-
-    # espacio reservado arriba para el título (fuera del recuadro)
-    title_space = 1.0 * cm
-    # dibujar rectángulo principal desplazado hacia abajo para dejar espacio al título
-    rect_x = m
-    rect_y = m
-    rect_width = w - 2 * m
-    rect_height = h - 2 * m - title_space  # altura reducida para que el título quede fuera
-
-    # borde externo (rectángulo)
-    c.setLineWidth(1)
-    c.rect(rect_x, rect_y, rect_width, rect_height)
-
-    # Título centrado por fuera (arriba del recuadro)
-    title_text = "ACADEMIA NACIONAL DE MEDICINA - BIBLIOTECA"
-    c.setFont("Helvetica-Bold", 11)
-    title_y = rect_y + rect_height + (title_space / 2)  # centrado vertical en el espacio superior
-    c.drawCentredString(w / 2, title_y, title_text)
-
-    # Área portada (derecha) dentro del rectángulo
-    cover_w = 5.0 * cm
-    cover_h = 7.0 * cm
-    cover_x = rect_x + rect_width - cover_w - (0.3 * cm)
-    cover_y = rect_y + rect_height - cover_h - (0.6 * cm)  # dejar pequeño margen superior dentro del rect.
-    c.rect(cover_x, cover_y, cover_w, cover_h)
-    if getattr(book, 'portada', None):
-        try:
-            img = ImageReader(book.portada.path)
-            c.drawImage(img, cover_x+2, cover_y+2, cover_w-4, cover_h-4, preserveAspectRatio=True, anchor='nw')
-        except Exception:
-            pass
+    etag = card_etag(book)
+    last_modified = book.fecha_modificacion.timestamp() if book.fecha_modificacion else None
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = HttpResponse(card_bytes(book), content_type='application/pdf')
+        response['Content-Disposition'] = f'inline; filename=\"Ficha_{book.id}.pdf\"'
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    # el navegador puede guardar la ficha, pero revalida en cada impresión
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
-    # Cajas y etiquetas principales (imitando ficha)
-    x0 = rect_x + 6
-    # AUMENTE el margen superior del bloque de datos (mayor separación desde la parte superior del rectángulo)
-    top_block_margin = 1.9 * cm  # aumentado
-    y = rect_y + rect_height - top_block_margin
-    line_h = 12
-
-    c.setFont("Helvetica-Bold", 9)
-    c.drawString(x0, y, "COTA:")
-    c.setFont("Helvetica", 9)
-    c.drawString(x0 + 36, y, book.cota or "")
-    y -= line_h
-
-    c.setFont("Helvetica-Bold", 9)
-    c.drawString(x0, y, "N.º REGISTRO:")
-    c.setFont("Helvetica", 9)
-    numero_reg = getattr(book, 'numero_registro', None) or getattr(book, 'id', '')
-    c.drawString(x0 + 70, y, str(numero_reg))
-    y -= line_h
-
-    c.setFont("Helvetica-Bold", 9)
-    c.drawString(x0, y, "FECHA REGISTRO:")
-    c.setFont("Helvetica", 9)
-    fr = getattr(book, 'fecha_registro', None)
-    try:
-        fr_txt = fr.strftime('%Y-%m-%d') if fr else ''
-    except Exception:
-        fr_txt = str(fr) if fr else ''
-    c.drawString(x0 + 90, y, fr_txt)
-    y -= line_h
-
-    c.setFont("Helvetica-Bold", 9)
-    c.drawString(x0, y, "TÍTULO:")
-    c.setFont("Helvetica", 9)
-    c.drawString(x0 + 40, y, (book.titulo or "")[:80])
-    y -= line_h
-
-    c.setFont("Helvetica-Bold", 9)
-    c.drawString(x0, y, "SUBTÍTULO:")
-    c.setFont("Helvetica", 9)
-    c.drawString(x0 + 60, y, (book.subtitulo or "")[:80])
-    y -= line_h
-
-    c.setFont("Helvetica-Bold", 9)
-    c.drawString(x0, y, "AUTOR:")
-    c.setFont("Helvetica", 9)
-    c.drawString(x0 + 40, y, (book.autor or "")[:60])
-    y -= line_h
-
-    c.setFont("Helvetica-Bold", 9)
-    c.drawString(x0, y, "COAUTOR:")
-    c.setFont("Helvetica", 9)
-    c.drawString(x0 + 50, y, (getattr(book, 'co_autor', '') or '')[:60])
-    y -= line_h
-
-    c.setFont("Helvetica-Bold", 9)
-    c.drawString(x0, y, "AÑO PUB:")
-    c.setFont("Helvetica", 9)
-    try:
-        ap = book.fecha_publicacion.strftime('%Y') if getattr(book, 'fecha_publicacion', None) else ''
-    except Exception:
-        ap = str(getattr(book, 'fecha_publicacion', '') or '')
-    c.drawString(x0 + 53, y, ap)
-    y -= line_h
-
-    c.setFont("Helvetica-Bold", 9)
-    c.drawString(x0, y, "EDITORIAL:")
-    c.setFont("Helvetica", 9)
-    c.drawString(x0 + 60, y, (book.editorial or "")[:60])
-    y -= line_h
-
-    c.setFont("Helvetica-Bold", 9)
-    c.drawString(x0, y, "CLASIFICACIÓN:")
-    c.setFont("Helvetica", 9)
-    try:
-        clas_txt = book.classification.label if getattr(book, 'classification', None) and getattr(book.classification, 'label', None) else (str(book.classification) if getattr(book, 'classification', None) else '')
-    except Exception:
-        clas_txt = str(getattr(book, 'classification', '') or '')
-    c.drawString(x0 + 86, y, (clas_txt or '')[:60])
-    y -= line_h
-
-    c.setFont("Helvetica-Bold", 9)
-    c.drawString(x0, y, "EDICIÓN:")
-    c.setFont("Helvetica", 9)
-    c.drawString(x0 + 50, y, f"{book.edicion}ª" if book.edicion else "")
-    y -= line_h
-
-    c.setFont("Helvetica-Bold", 9)
-    c.drawString(x0, y, "UBICACIÓN:")
-    c.setFont("Helvetica", 9)
-    c.drawString(x0 + 60, y, (book.ubicacion_publicacion or "")[:60])
-    y -= (line_h + 8) # un poco más de espacio antes del bloque inferior
-
-    # sección inferior: aumentar separación entre las filas y margen superior del bloque
-    c.setFont("Helvetica-Bold", 9)
-    bottom_x = x0
-    # Espaciado más grande entre líneas de firma
-    sig_spacing = 30  # distancia vertical entre cada campo (aumentada)
-    line_len = 220
-    # Ajustar posición vertical para tener mayor margen superior antes de esta zona
-    y -= 6  # pequeño ajuste extra para empujar hacia abajo (puedes aumentar)
-    # PRESTADO POR
-    c.drawString(bottom_x, y, "PRESTADO POR:")
-    c.line(bottom_x + 80, y-2, bottom_x + 80 + line_len, y-2)
-    y -= sig_spacing
-    # RECIBIDO POR
-    c.drawString(bottom_x, y, "RECIBIDO POR:")
-    c.line(bottom_x + 80, y-2, bottom_x + 80 + line_len, y-2)
-    y -= sig_spacing
-    # FIRMA
-    c.drawString(bottom_x, y, "FIRMA:")
-    c.line(bottom_x + 40, y-2, bottom_x + 40 + (line_len * 0.6), y-2)
-
-    # Pie pequeño con número de serie / vol / año
-    c.setFont("Helvetica", 8)
-    footer_items = []
-    nr = getattr(book, 'numero_registro', None)
-    if nr:
-        footer_items.append(f"N.º registro: {nr}")
-    footer_items.append(f"ID: {book.id}")
-    if getattr(book, 'paginas', None):
-        footer_items.append(f"Páginas: {book.paginas}")
-    if getattr(book, 'volumen', None):
-        footer_items.append(f"Vol: {book.volumen}")
-    if getattr(book, 'serie', None):
-        footer_items.append(f"Serie: {book.serie}")
-    # incluir fecha_registro si existe
-    if getattr(book, 'fecha_registro', None):
-        try:
-            footer_items.append(f"Fecha registro: {book.fecha_registro.strftime('%Y-%m-%d')}")
-        except Exception:
-            footer_items.append(f"Fecha registro: {book.fecha_registro}")
-    c.drawString(m + 6, m + 6, '  |  '.join(footer_items))
 
-    c.showPage()
-    c.save()
 
-    buffer.seek(0)
-    response = HttpResponse(buffer.getvalue(), content_type='application/pdf')
-    response['Content-Disposition'] = f'inline; filename=\"Ficha_{book.id}.pdf\"'
-    return response
+# límite de fichas por lote (una clasificación completa cabe holgadamente)
+CARD_BATCH_LIMIT = 5000
 
+@trabajador_required
+def task_pdf_cards(request):
+    """Fichas de varios libros en un solo PDF: ?clasificacion=WG, ?desde=WG 200&hasta=WG 300 o ?ids=1,2,3"""
+    qs = Libros.objects.filter(is_active=True).select_related('classification')
+    clasificacion = request.GET.get('clasificacion', '').strip().upper()
+    desde = ' '.join(request.GET.get('desde', '').split()).upper()
+    hasta = ' '.join(request.GET.get('hasta', '').split()).upper()
+    ids = [int(x) for x in request.GET.get('ids', '').replace(' ', '').split(',') if x.isdigit()]
+    back = 'admin_books' if request.user.is_superuser else 'tasks'
+    if not (clasificacion or desde or hasta or ids):
+        messages.error(request, 'Indique una clasificación, un rango de cotas o una lista de libros.')
+        return redirect(back)
+    if clasificacion:
+        qs = qs.filter(classification__code=clasificacion)
+    if ids:
+        qs = qs.filter(pk__in=ids)
+    if desde or hasta:
+        # rango en orden natural ('WG 1'..'WG 200' no incluye 'WG 1000'): la base de datos compara
+        # texto, así que sólo acota por las letras comunes de los extremos y el rango se aplica aquí.
+        # Con un solo extremo el rango queda dentro de su clasificación ('WG 200' -> 'WG 200'..'WG ∞')
+        prefix = os.path.commonprefix([dictionary_prefix(bound) for bound in (desde, hasta) if bound])
+        if not prefix:
+            messages.error(request, 'Los extremos del rango de cotas deben compartir la clasificación (p. ej. WG 100 a WG 300).')
+            return redirect(back)
+        in_range = [
+            pk for pk, cota in qs.filter(cota__startswith=prefix).values_list('pk', 'cota').iterator(chunk_size=2000)
+            if cota_in_range(cota, desde, hasta)
+        ]
+        if len(in_range) > CARD_BATCH_LIMIT:
+            messages.error(request, f'El rango abarca {len(in_range)} libros y el lote admite {CARD_BATCH_LIMIT} fichas; acote la selección.')
+            return redirect(back)
+        qs = qs.filter(pk__in=in_range)
+    books = sorted(qs[:CARD_BATCH_LIMIT + 1], key=lambda book: cota_sort_key(book.cota))
+    if not books:
+        messages.error(request, 'No hay libros activos con esos criterios.')
+        return redirect(back)
+    if len(books) > CARD_BATCH_LIMIT:
+        messages.error(request, f'El lote supera {CARD_BATCH_LIMIT} fichas; acote la selección.')
+        return redirect(back)
+
+    try:
+        analytics.record_many([analytics.make_event(AnalyticsEvent.EVENT_PDF, book, request.user) for book in books])
+    except Exception:
+        pass
+    # FileResponse envía el archivo por bloques
+    response = FileResponse(open(batch_card_path(books), 'rb'), content_type='application/pdf')
+    response['Content-Disposition'] = f'inline; filename="Fichas_{len(books)}.pdf"'
+    return response
 
 #################################### DASHBOARD - ESTADISTICA #####################################
 
@@ -1079,14 +961,9 @@ def dashboard(request):
         month = dt.month % 12 + 1
         dt = dt.replace(year=year, month=month, day=1)
 
-    # consulta agrupada por mes y tipo
-    events = AnalyticsEvent.objects.filter(timestamp__date__gte=first_day).annotate(month=TruncMonth('timestamp')).values('event_type', 'month').annotate(count=Count('id'))
-    # preparar mapeo
-    data_map = {et: {m:0 for m in months} for et, _ in AnalyticsEvent.EVENT_CHOICES}
-    for e in events:
-        m = e['month'].strftime('%Y-%m')
-        if m in months:
-            data_map[e['event_type']][m] = e['count']
+    # totales diarios agregados por mes (rollups.py); los meses cerrados salen de la caché
+    counts = month_counts(first_day, today)
+    data_map = {et: {m: counts.get(m, {}).get(et, 0) for m in months} for et, _ in AnalyticsEvent.EVENT_CHOICES}
 
     labels = months
     views_data = [data_map[AnalyticsEvent.EVENT_VIEW][m] for m in months]
@@ -1114,7 +991,7 @@ def task_list(request):
 @login_required
 def cart_checkout(request):
     """Confirma los préstamos listados en la sesión: crea Prestamo por cada libro con cantidad=1.
-    Verifica disponibilidad dentro de una transacción para evitar sobre-reservas.
+    Cada préstamo retiene un ejemplar libre, tomado dentro de una transacción para evitar sobre-reservas.
     """
     cart_ids = request.session.get('loan_cart', [])[:10]
     if not cart_ids:
@@ -1126,39 +1003,41 @@ def cart_checkout(request):
     receiver_first_name = request.user.first_name
     receiver_last_name = request.user.last_name
 
+    # Determinar estado inicial: Activo para trabajadores, Pendiente para usuarios
+    initial_status = Prestamo.STATUS_ACTIVE if (request.user.is_staff or request.user.is_superuser) else Prestamo.STATUS_PENDING
+    approved_at_time = timezone.now() if initial_status == Prestamo.STATUS_ACTIVE else None
+
+    ids = []
+    for pk_s in cart_ids:
+        try:
+            pk = int(pk_s)
+        except Exception:
+            continue
+        if pk not in ids:
+            ids.append(pk)
+
     # usar transacción para evitar condiciones de carrera
     created = []
     failed = []
     try:
         with transaction.atomic():
-            for pk_s in cart_ids:
-                try:
-                    pk = int(pk_s)
-                except Exception:
-                    continue
-                book = Libros.objects.select_for_update().filter(pk=pk).first()
-                if not book:
+            existing = set(Libros.objects.filter(pk__in=ids).values_list('pk', flat=True))
+            loans = []
+            copies = []
+            for pk in ids:
+                if pk not in existing:
                     failed.append((pk, 'Libro no encontrado'))
                     continue
-                # Calcular stock incluyendo préstamos activos y pendientes de aprobación
-                prestados_total = Prestamo.objects.filter(
-                    book=book
-                ).filter(
-                    Q(status=Prestamo.STATUS_ACTIVE) | Q(status=Prestamo.STATUS_PENDING)
-                ).aggregate(total=Sum('cantidad'))['total'] or 0
-                
-                disponible = (book.cantidad or 0) - prestados_total
-                if disponible <= 0:
+                # tomar un ejemplar libre sin bloquear el libro: los que otro checkout
+                # ya tiene bloqueados se saltan (SKIP LOCKED), así que nadie espera
+                claimed = inventory.claim(pk)
+                if not claimed:
                     failed.append((pk, 'Sin stock'))
                     continue
-                
-                # Determinar estado inicial: Activo para trabajadores, Pendiente para usuarios
-                initial_status = Prestamo.STATUS_ACTIVE if (request.user.is_staff or request.user.is_superuser) else Prestamo.STATUS_PENDING
-                approved_at_time = timezone.now() if initial_status == Prestamo.STATUS_ACTIVE else None
-                
-                # crear prestamo por 1 ejemplar, incluyendo datos del receptor si se recogieron
-                p = Prestamo.objects.create(
-                    book=book,
+                copies.append(claimed[0])
+                # prestamo por 1 ejemplar, incluyendo datos del receptor
+                loans.append(Prestamo(
+                    book_id=pk,
                     user=request.user,
                     cantidad=1,
                     status=initial_status,
@@ -1166,8 +1045,22 @@ def cart_checkout(request):
                     receiver_first_name=receiver_first_name,
                     receiver_last_name=receiver_last_name,
                     approved_at=approved_at_time,
-                )
-                created.append(p)
+                ))
+            if loans:
+                # bulk_create no pasa por Prestamo.save(): ejemplares y contadores aquí
+                created = Prestamo.objects.bulk_create(loans)
+                inventory.assign({copy_id: p.pk for copy_id, p in zip(copies, created)})
+                for p in created:
+                    p._counted_state = p._counter_state()
+                book_ids = [p.book_id for p in created]
+                # contadores del catálogo en la misma transacción (coinciden con los ejemplares);
+                # es la última sentencia, así la fila del libro queda bloqueada sólo hasta el commit
+                if initial_status == Prestamo.STATUS_ACTIVE:
+                    Libros.adjust_loan_counters_many(book_ids, en_prestamo=1)
+                else:
+                    Libros.adjust_loan_counters_many(book_ids, pendientes=1)
+                # los préstamos ya están confirmados: un fallo del puntaje no debe llegar al usuario
+                transaction.on_commit(lambda: add_loans({pk: 1 for pk in book_ids}), robust=True)
     except Exception as e:
         messages.error(request, 'Error al procesar el checkout: ' + str(e))
         return redirect('cart_view')
@@ -1251,13 +1144,9 @@ def loan_return(request, pk):
             loan.save()
             msg = 'Solicitud de devolución enviada.'
             
-        # calcular nuevo conteo de prestados para el libro asociado (solo activos cuentan como prestados)
-        book = loan.book
-        prestados_total = Prestamo.objects.filter(
-            book=book
-        ).filter(
-            Q(status=Prestamo.STATUS_ACTIVE) | Q(status=Prestamo.STATUS_PENDING)
-        ).aggregate(total=Sum('cantidad'))['total'] or 0
+        # nuevo conteo de prestados para el libro asociado (ejemplares ya liberados por loan.save)
+        book = Libros.objects.get(pk=loan.book_id)
+        inventory.availability([book])
         
         # si es AJAX devolver JSON con información útil para actualizar UI en tiempo real
         if request.headers.get('x-requested-with') == 'XMLHttpRequest':
@@ -1271,8 +1160,8 @@ def loan_return(request, pk):
                 'ok': True,
                 'loan_id': loan.id,
                 'book_id': book.id,
-                'prestados': int(prestados_total),
-                'total': int(book.cantidad or 0),
+                'prestados': book.prestados,
+                'total': book.total,
                 'returned_at': loan.returned_at.isoformat() if loan.returned_at else None,
                 'return_report': loan.return_report,
                 'return_book_rating': loan.return_book_rating,
@@ -1291,21 +1180,20 @@ def cart_json(request):
     """Devuelve el contenido del carrito (sesión) en JSON para uso en pop-ups/JS."""
     cart_ids = request.session.get('loan_cart', [])[:10]
     libs_qs = Libros.objects.filter(id__in=cart_ids)
-    libs_map = {str(b.id): b for b in libs_qs}
+    libs_map = {str(b.id): b for b in inventory.availability(list(libs_qs))}
     items = []
     for pk in cart_ids:
         b = libs_map.get(str(pk))
         if not b:
             continue
-        prestados = Prestamo.objects.filter(book=b, status=Prestamo.STATUS_ACTIVE).aggregate(total=Sum('cantidad'))['total'] or 0
         items.append({
             'id': b.id,
             'titulo': b.titulo,
             'autor': b.autor,
             'cota': b.cota,
-            'portada': b.portada.url if getattr(b, 'portada', None) else '',
-            'prestados': int(prestados),
-            'total': int(b.cantidad or 0),
+            'portada': b.portada_thumb_url,
+            'prestados': b.prestados,
+            'total': b.total,
         })
     return JsonResponse({'ok': True, 'items': items, 'loan_cart_user': request.session.get('loan_cart_user', '')})
 
@@ -1315,20 +1203,26 @@ def dictionary_view(request):
     clas = request.GET.get('clas', '').strip()
     # Mostrar sólo entradas activas en la vista pública
     qs = DictionaryEntry.objects.filter(is_active=True)
+    ranked = False
     if q:
-        qs = qs.filter(Q(codigo__icontains=q) | Q(descripcion__icontains=q) | Q(descripcion_en__icontains=q))
+        # texto completo bilingüe (español/inglés) con ranking; icontains si el motor no lo soporta
+        qs, ranked = search_dictionary(qs, q)
+        if ranked:
+            qs = qs.order_by('-rank', 'codigo')
     # filtro por clasificación (acepta prefijos como 'QS' o la etiqueta completa 'QS-Anatomía Humana')
     if clas:
         # intentar extraer el código antes del guion si el usuario pasó la etiqueta completa
         code = clas.split('-', 1)[0].strip()
-        # filtrar por campo clasificacion o por prefijo de codigo (p. ej. 'QS')
-        qs = qs.filter(
-            Q(clasificacion__icontains=clas) | Q(clasificacion__icontains=code) | Q(codigo__istartswith=code)
-        )
+        if code.isalpha() and len(code) <= 3:
+            # prefijo indexado del código (p. ej. 'QS')
+            qs = qs.filter(prefijo=code.upper())
+        else:
+            qs = qs.filter(clasificacion__icontains=clas)
     from django.core.paginator import Paginator
     paginator = Paginator(qs, 50)
     page = request.GET.get('page')
     page_obj = paginator.get_page(page)
+    page_obj.object_list = highlight_dictionary(page_obj.object_list, q)
     classification_list = [
         'QS-Anatomía Humana', 'QT-Fisiología', 'QU-Bioquímica. Biología Celular y Genética',
         'QV-Farmacología', 'QW-Microbiología. Inmunología', 'QX-Parasitología. Vectores de Enfermedades',
@@ -1353,13 +1247,34 @@ def dictionary_view(request):
 def autocomplete_codes(request):
     """Devuelve JSON con códigos del diccionario que coinciden con el término 'q'."""
     term = request.GET.get('q', '').strip()
-    # Autocompletado público: sólo códigos activos
-    qs = DictionaryEntry.objects.filter(is_active=True)
-    if term:
-        qs = qs.filter(codigo__icontains=term)
-    # limitar a 50 resultados
-    results = list(qs.order_by('codigo').values_list('codigo', flat=True)[:50])
-    return JsonResponse({'results': results})
+    # Autocompletado público: sólo códigos activos, desde el índice en memoria (máx. 50 resultados)
+    results = code_index.search(term, limit=50)
+    return _cacheable_json(request, {'results': results}, settings.AUTOCOMPLETE_MAX_AGE)
+
+
+def catalog_suggest(request):
+    """Sugerencias de libros (título, autor, cota, disponibilidad) mientras se escribe.
+
+    Se responde desde el índice en memoria ``book_index``, sin consultar la base de datos.
+    """
+    q = request.GET.get('q', '').strip()
+    try:
+        limit = min(max(int(request.GET.get('limit', 8)), 1), 20)
+    except ValueError:
+        limit = 8
+    results = book_index.suggest(q, limit=limit)
+    for r in results:
+        r['url'] = reverse('task_detail', args=[r['id']])
+    return _cacheable_json(request, {'results': results}, settings.CATALOG_SUGGEST_MAX_AGE)
+
+
+def _cacheable_json(request, data, max_age):
+    """JsonResponse con Cache-Control público y ETag; si el navegador ya lo tiene responde 304."""
+    response = JsonResponse(data)
+    etag = quote_etag(hashlib.md5(response.content).hexdigest())
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=max_age)
+    return get_conditional_response(request, etag=etag, response=response)
 
 
 @login_required
@@ -1561,12 +1476,9 @@ def loan_requests(request):
     cart_ids = request.session.get('loan_cart', [])[:10]
     libs_qs = Libros.objects.filter(id__in=cart_ids)
     libs_map = {str(b.id): b for b in libs_qs}
-    cart_books = [libs_map[i] for i in cart_ids if str(i) in libs_map]
+    cart_books = inventory.availability([libs_map[i] for i in cart_ids if str(i) in libs_map])
     for b in cart_books:
-        tot = Prestamo.objects.filter(book=b, status=Prestamo.STATUS_ACTIVE).aggregate(total=Sum('cantidad'))['total'] or 0
-        setattr(b, 'prestados', int(tot))
-        setattr(b, 'total', int(b.cantidad or 0))
-        setattr(b, 'disponible', int(b.cantidad or 0) - int(tot))
+        setattr(b, 'disponible', b.libres)
 
     # Datos para Solicitudes Pendientes
     if is_staff:
@@ -1644,12 +1556,8 @@ def return_requests(request):
     if q_history:
         history_qs = history_qs.filter(book__titulo__icontains=q_history)
     
-    history_qs = history_qs.order_by('-returned_at', '-id')
-
-    # Paginación (usaremos prefijos o simplemente paginaremos el historial que es el más grande)
-    paginator = Paginator(history_qs, 10)
-    page = request.GET.get('page')
-    history_page = paginator.get_page(page)
+    # Paginación del historial (el listado más grande): por cursor o por número de página
+    history_page = paginate(request, history_qs, ['-returned_at', '-id'], 10)
 
     return render(request, 'return_requests.html', {
         'active_loans': active_qs,